@@ -1,18 +1,36 @@
 ﻿import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
+import argparse
 import threading
 import os
 import yt_dlp
 import sys
 import platform
+import time
+import base64
+from collections import OrderedDict, defaultdict
 from config import AppConfig
 from url_validator import URLValidator
 from download_manager import DownloadManager
+from bulk_import import BulkImporter, iter_file_lines, iter_text_lines
+from perf_profile import get_profile
+from log_setup import setup_logging, apply_levels
+from responsiveness import EventLoopWatchdog
+from thumbnails import ThumbnailCache, THUMBNAILS_AVAILABLE
+from channel_sync import scan_source, get_sync_archive
+from throughput import format_bytes, format_eta
+from progress_trace import ProgressTraceRecorder
 from gui_components import (
     ModernFrame, ModernButton, ModernEntry, StatusIndicator,
-    ModernTreeview, InfoDialog
+    ModernTreeview, InfoDialog, ProfilingDialog
 )
 
+# Перетаскивание файлов и текста (необязательная зависимость tkinterdnd2)
+try:
+    from tkinterdnd2 import TkinterDnD, DND_FILES, DND_TEXT
+except ImportError:
+    TkinterDnD = None
+
 if platform.system() == 'Darwin':
     try:
         from Foundation import NSBundle
@@ -27,19 +45,66 @@ if platform.system() == 'Darwin':
 class VideoDownloaderApp:
     """Главное приложение Video Downloader Pro"""
 
-    def __init__(self):
-        """Инициализация приложения"""
+    def __init__(self, download_manager=None, trace_path=None):
+        """
+        Инициализация приложения.
+
+        Args:
+            download_manager (DownloadManager): готовый менеджер загрузок (бенчмарк интерфейса
+                передает менеджер без воркеров); обработчики событий назначаются ему здесь
+            trace_path (str): файл для записи событий прогресса (JSON lines) для benchmarks.py gui --replay
+        """
         self.root = tk.Tk()
         self.setup_window()
         self.create_styles()
         self.create_widgets()
 
-        self.download_manager = DownloadManager(
-            progress_callback=self.update_progress,
-            completion_callback=self.download_completed
-        )
+        callbacks = (self.update_progress, self.download_completed)
+        self.trace_recorder = ProgressTraceRecorder(trace_path) if trace_path else None
+        if self.trace_recorder:
+            callbacks = self.trace_recorder.wrap(*callbacks)
+        if download_manager is None:
+            download_manager = DownloadManager(progress_callback=callbacks[0], completion_callback=callbacks[1])
+        else:
+            download_manager.progress_callback, download_manager.completion_callback = callbacks
+        self.download_manager = download_manager
         self.download_items = {}
         self.url_change_timer = None
+        self.bulk_importer = None
+        self.bulk_pending = []
+        self.bulk_settings = None
+
+        # Ограниченное окно сессии: завершенные строки по времени завершения, старые уходят в историю
+        self.finished_rows = OrderedDict()
+        self.history_rows = {}
+        self.history_cursor = (time.time(), '')
+        self.history_exhausted = False
+        self.root.after(AppConfig.HISTORY_TRIM_INTERVAL_MS, self._periodic_trim)
+
+        # Фильтр над таблицей: строки сессии временно скрываются, показываются результаты поиска
+        self.filter_timer = None
+        self.filter_text = ''
+        self.search_rows = {}
+        self.detached_rows = []
+
+        # Превью строк: загрузка и уменьшение в фоне, в главном потоке только создание PhotoImage
+        self.thumbnails = ThumbnailCache()
+        self.thumbnail_images = OrderedDict()
+        self.thumbnail_waiters = defaultdict(set)
+        self.thumbnail_requested = set()
+
+        self.setup_drag_and_drop()
+
+        # Профилировщик общий с менеджером загрузок; файл управления проверяется периодически
+        self.profiler = self.download_manager.profiler
+        self.root.after(AppConfig.PROFILING_POLL_MS, self._poll_profiling)
+
+        # Измеряем задержку цикла событий и показываем ее в статусной строке
+        self.watchdog = EventLoopWatchdog(self.root, on_update=self.update_lag_indicator)
+        self.watchdog.start()
+
+        # Сводная скорость и история скорости строк обновляются по таймеру, а не на каждое событие
+        self.root.after(AppConfig.THROUGHPUT_REFRESH_MS, self._refresh_throughput)
 
     def setup_window(self):
         """Настройка главного окна"""
@@ -222,7 +287,23 @@ class VideoDownloaderApp:
             command=self.get_video_info,
             style='info'
         )
-        self.info_button.grid(row=0, column=2)
+        self.info_button.grid(row=0, column=2, padx=(0, 10))
+
+        self.import_button = ModernButton(
+            input_frame,
+            "📄 Список",
+            command=self.import_url_list,
+            style='secondary'
+        )
+        self.import_button.grid(row=0, column=3, padx=(0, 10))
+
+        self.sync_button = ModernButton(
+            input_frame,
+            "🔁 Канал",
+            command=self.sync_channel,
+            style='secondary'
+        )
+        self.sync_button.grid(row=0, column=4)
 
         self.service_indicator = StatusIndicator(url_frame)
         self.service_indicator.pack(anchor='w', padx=30, pady=(0, 20))
@@ -282,7 +363,7 @@ class VideoDownloaderApp:
         quality_combo = ttk.Combobox(
             grid_frame,
             textvariable=self.quality_var,
-            values=list(AppConfig.VIDEO_QUALITIES.keys()),
+            values=list(get_profile().section('video_qualities').keys()),
             state="readonly",
             style='Modern.TCombobox',
             width=20,
@@ -357,16 +438,41 @@ class VideoDownloaderApp:
             style='info'
         ).pack(side='left')
 
+        filter_frame = tk.Frame(downloads_frame, bg=AppConfig.COLORS['white'])
+        filter_frame.pack(fill='x', padx=30, pady=(0, 10))
+
+        self.filter_var = tk.StringVar()
+        self.filter_entry = ModernEntry(
+            filter_frame,
+            textvariable=self.filter_var,
+            placeholder="🔍 Поиск по истории: название, ссылка, сервис, файл, ошибка..."
+        )
+        self.filter_entry.pack(fill='x')
+        self.filter_entry.bind('<KeyRelease>', self.on_filter_change)
+        self.filter_entry.bind('<Escape>', lambda event: self.clear_filter())
+
+        self.throughput_var = tk.StringVar(value="🚀 Нет активных загрузок")
+        tk.Label(
+            downloads_frame,
+            textvariable=self.throughput_var,
+            font=('Consolas', 10),
+            fg=AppConfig.COLORS['gray_700'],
+            bg=AppConfig.COLORS['white'],
+            anchor='w'
+        ).pack(fill='x', padx=30, pady=(0, 10))
+
         tree_frame = tk.Frame(downloads_frame, bg=AppConfig.COLORS['white'])
         tree_frame.pack(fill='both', expand=True, padx=30, pady=(0, 20))
 
-        columns = ('service', 'url', 'type', 'status', 'progress', 'speed', 'filename')
+        columns = ('service', 'url', 'type', 'status', 'progress', 'speed', 'filename', 'trend')
         self.downloads_tree = ModernTreeview(
             tree_frame,
             columns=columns,
-            show='headings',
+            show='tree headings' if THUMBNAILS_AVAILABLE else 'headings',
             height=10
         )
+        # Колонка дерева (#0) занята превью
+        self.downloads_tree.column('#0', width=AppConfig.THUMBNAIL_SIZE[0] + 24, stretch=False)
 
         headings = {
             'service': '🌐 Сервис',
@@ -375,7 +481,8 @@ class VideoDownloaderApp:
             'status': '📊 Статус',
             'progress': '⚡ Прогресс',
             'speed': '🚀 Скорость',
-            'filename': '📄 Файл'
+            'filename': '📄 Файл',
+            'trend': '📈 Скорость / осталось'
         }
 
         widths = {
@@ -385,15 +492,19 @@ class VideoDownloaderApp:
             'status': 120,
             'progress': 100,
             'speed': 100,
-            'filename': 250
+            'filename': 250,
+            'trend': 180
         }
 
         for col in columns:
             self.downloads_tree.heading(col, text=headings[col])
             self.downloads_tree.column(col, width=widths[col])
 
-        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.downloads_tree.yview)
+        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.on_tree_scroll)
         self.downloads_tree.configure(yscrollcommand=scrollbar.set)
+        # Прокрутка к началу списка подгружает более старые записи из истории
+        for sequence in ("<MouseWheel>", "<Button-4>"):
+            self.downloads_tree.bind(sequence, lambda event: self.root.after_idle(self._check_history_scroll), add='+')
 
         self.downloads_tree.pack(side='left', fill='both', expand=True)
         scrollbar.pack(side='right', fill='y')
@@ -419,6 +530,16 @@ class VideoDownloaderApp:
         )
         status_label.pack(side='left', anchor='w')
 
+        self.lag_var = tk.StringVar(value="⏱ — мс")
+        self.lag_label = tk.Label(
+            content_frame,
+            textvariable=self.lag_var,
+            font=('Arial', 10),
+            fg=AppConfig.COLORS['gray_700'],
+            bg=AppConfig.COLORS['gray_200']
+        )
+        self.lag_label.pack(side='left', anchor='w', padx=(20, 0))
+
         about_button = ModernButton(
             content_frame,
             "ℹ️ О программе",
@@ -428,6 +549,15 @@ class VideoDownloaderApp:
         )
         about_button.pack(side='right', anchor='e')
 
+        profiling_button = ModernButton(
+            content_frame,
+            "🔬 Профилирование",
+            command=self.show_profiling_settings,
+            style='secondary',
+            width=17
+        )
+        profiling_button.pack(side='right', anchor='e', padx=(0, 10))
+
     def create_context_menu(self):
         """Создает контекстное меню для таблицы загрузок"""
         self.context_menu = tk.Menu(self.root, tearoff=0)
@@ -468,6 +598,7 @@ class VideoDownloaderApp:
 
         if len(url) < 10:
             self.service_indicator.set_status('default', "Вставьте ссылку для определения сервиса")
+            self.download_manager.prefetcher.cancel()
             return
 
         if URLValidator.validate_url(url):
@@ -478,12 +609,16 @@ class VideoDownloaderApp:
                     'success',
                     f"{icon} {service_name} - Поддерживается ✅"
                 )
+                # Заранее извлекаем метаданные, чтобы "Инфо" и загрузка начинались сразу
+                self.download_manager.prefetch(url)
             else:
+                self.download_manager.prefetcher.cancel()
                 self.service_indicator.set_status(
                     'error',
                     "❌ Сервис не поддерживается"
                 )
         else:
+            self.download_manager.prefetcher.cancel()
             self.service_indicator.set_status(
                 'error',
                 "❌ Неверный формат URL"
@@ -491,6 +626,16 @@ class VideoDownloaderApp:
 
     def on_paste(self, event):
         """Обработчик вставки через Ctrl+V"""
+        try:
+            clipboard_text = self.root.clipboard_get()
+        except tk.TclError:
+            clipboard_text = ""
+
+        # Несколько строк - это список ссылок для пакетного импорта
+        if len(clipboard_text.strip().splitlines()) > 1:
+            self.start_bulk_import(iter_text_lines(clipboard_text), "буфера обмена")
+            return "break"
+
         self.root.after(50, self._process_url_change)
 
     def paste_url(self):
@@ -504,6 +649,161 @@ class VideoDownloaderApp:
         except:
             pass
 
+    def setup_drag_and_drop(self):
+        """Включает перетаскивание файлов со списками и текста со ссылками"""
+        if TkinterDnD is None:
+            return
+        try:
+            TkinterDnD._require(self.root)
+            for widget in (self.downloads_tree, self.url_entry):
+                widget.drop_target_register(DND_FILES, DND_TEXT)
+                widget.dnd_bind('<<Drop>>', self.on_drop)
+        except (tk.TclError, RuntimeError):
+            pass
+
+    def on_drop(self, event):
+        """Обрабатывает перетаскивание файлов или текста в окно"""
+        items = self.root.tk.splitlist(event.data)
+        paths = [item for item in items if os.path.isfile(item)]
+        if paths:
+            self.start_bulk_import(
+                (line for path in paths for line in iter_file_lines(path)),
+                os.path.basename(paths[0]) if len(paths) == 1 else f"{len(paths)} файлов"
+            )
+        else:
+            self.start_bulk_import(iter_text_lines(event.data), "перетаскивания")
+        return event.action
+
+    def import_url_list(self):
+        """Импортирует список ссылок из текстового файла"""
+        path = filedialog.askopenfilename(
+            title="Выберите файл со списком ссылок",
+            filetypes=[("Текстовые файлы", "*.txt *.csv *.lst"), ("Все файлы", "*.*")]
+        )
+        if path:
+            self.start_bulk_import(iter_file_lines(path), os.path.basename(path))
+
+    def start_bulk_import(self, lines, source_name):
+        """Запускает потоковый импорт ссылок с пакетной вставкой строк в таблицу"""
+        if self.bulk_importer and not self.bulk_importer.finished:
+            messagebox.showwarning("Предупреждение", "Импорт списка уже выполняется")
+            return
+
+        folder = self.folder_var.get().strip()
+        if not os.path.exists(folder):
+            messagebox.showerror("Ошибка", "Указанная папка не существует")
+            return
+
+        self.bulk_settings = (self.type_var.get(), self.quality_var.get(), folder)
+        known_urls = {info['url'] for info in list(self.download_manager.active_downloads.values())}
+        self.bulk_importer = BulkImporter(
+            lines,
+            self.download_manager._clean_url,
+            known_urls=known_urls,
+            preflight=AppConfig.BULK_IMPORT_PREFLIGHT
+        ).start()
+        self.bulk_pending = []
+        self.import_button.set_enabled(False)
+        self.status_var.set(f"📄 Импорт ссылок из {source_name}...")
+        self.root.after(AppConfig.BULK_IMPORT_INTERVAL_MS, self._drain_bulk_import)
+
+    def _drain_bulk_import(self):
+        """Вставляет очередную порцию импортированных строк и отправляет ее в менеджер загрузок"""
+        importer = self.bulk_importer
+        if not self.bulk_pending:
+            self.bulk_pending = importer.poll() or []
+
+        batch = self.bulk_pending[:AppConfig.BULK_INSERT_BATCH]
+        self.bulk_pending = self.bulk_pending[AppConfig.BULK_INSERT_BATCH:]
+
+        if batch:
+            download_type, quality, folder = self.bulk_settings
+            # Строки вставляются до постановки в очередь, чтобы не потерять первые события прогресса
+            tree_items = {
+                url: self.downloads_tree.insert('', 'end', values=(
+                    service_name, url, download_type, 'Ожидает', '0%', '0 KB/s', 'Ожидает...'
+                ))
+                for url, service_name in batch
+            }
+            download_ids, _ = self.download_manager.add_downloads(
+                list(tree_items), download_type, quality, folder, preflight=False
+            )
+            for url, download_id in download_ids.items():
+                self.download_items[download_id] = tree_items[url]
+
+        stats = importer.stats
+        if importer.finished and not self.bulk_pending:
+            self.import_button.set_enabled(True)
+            self.status_var.set(
+                f"✅ Импорт завершен: добавлено {stats['accepted']}, дубликатов {stats['duplicates']}, "
+                f"неверных {stats['invalid']}, не поддерживается {stats['unsupported']}, "
+                f"недоступно {stats['dead']}, не удалось проверить {stats['unchecked']}"
+            )
+            return
+
+        self.status_var.set(f"📄 Импорт: прочитано {stats['lines']}, добавлено {stats['accepted']}...")
+        self.root.after(AppConfig.BULK_IMPORT_INTERVAL_MS, self._drain_bulk_import)
+
+    def sync_channel(self):
+        """Ставит в очередь только новые записи канала или плейлиста из поля ссылки"""
+        url = self.url_entry.get_real_text().strip()
+        if not url or not URLValidator.validate_url(url):
+            messagebox.showwarning("Предупреждение", "Введите ссылку на канал или плейлист")
+            return
+
+        folder = self.folder_var.get().strip()
+        if not os.path.exists(folder):
+            messagebox.showerror("Ошибка", "Указанная папка не существует")
+            return
+
+        settings = (self.type_var.get(), self.quality_var.get(), folder)
+        # Записи, которые уже стоят в очереди с прошлой синхронизации, не добавляются повторно
+        in_queue = {info['archive_key'] for info in list(self.download_manager.active_downloads.values())
+                    if info.get('archive_key')}
+        self.sync_button.set_enabled(False)
+        self.status_var.set("🔁 Поиск новых записей...")
+
+        def sync_worker():
+            try:
+                result, error = scan_source(url, get_sync_archive(), skip=in_queue), None
+            except Exception as e:
+                result, error = None, str(e)
+            self.root.after(0, lambda: self._enqueue_synced(url, result, error, settings))
+
+        threading.Thread(target=sync_worker, daemon=True).start()
+
+    def _enqueue_synced(self, url, result, error, settings):
+        """Добавляет новые записи канала в таблицу и очередь порциями"""
+        if error:
+            self.sync_button.set_enabled(True)
+            self.status_var.set(f"❌ Ошибка синхронизации: {error}")
+            return
+
+        download_type, quality, folder = settings
+        entries = result['entries']
+        for entry in entries[:AppConfig.BULK_INSERT_BATCH]:
+            service_name, _ = URLValidator.detect_service(entry['url'])
+            tree_item_id = self.downloads_tree.insert('', 'end', values=(
+                service_name, entry['url'], download_type, 'Ожидает', '0%', '0 KB/s', 'Ожидает...'
+            ))
+            download_id = self.download_manager.add_download(
+                entry['url'], download_type, quality, folder, archive_key=entry['key']
+            )
+            self.download_items[download_id] = tree_item_id
+
+        rest = dict(result, entries=entries[AppConfig.BULK_INSERT_BATCH:])
+        if rest['entries']:
+            self.root.after(AppConfig.BULK_IMPORT_INTERVAL_MS,
+                            lambda: self._enqueue_synced(url, rest, None, settings))
+            return
+
+        self.sync_button.set_enabled(True)
+        self.status_var.set(
+            f"🔁 {result['title'] or url}: новых {result['new']}, просмотрено {result['listed']}, "
+            f"уже скачано {result['seen']}"
+            + (" (дальше только старые)" if result['stopped_early'] else "")
+        )
+
     def clear_url(self):
         """Очищает поле URL"""
         self.url_var.set("")
@@ -535,8 +835,11 @@ class VideoDownloaderApp:
                     'skip_download': True
                 }
 
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
+                # Если метаданные уже предзагружены (или загружаются), берем их
+                info = self.download_manager.prefetched(url, timeout=60)
+                if info is None:
+                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                        info = ydl.extract_info(url, download=False)
 
                 title = info.get('title', 'Без названия')
                 uploader = info.get('uploader', 'Неизвестно')
@@ -622,7 +925,7 @@ class VideoDownloaderApp:
 
         # Определение параметров загрузки
         is_audio = (download_type == "Только аудио (MP3)")  # Флаг загрузки аудио
-        quality_key = AppConfig.VIDEO_QUALITIES.get(quality, 'best')  # Ключ качества
+        quality_key = get_profile().section('video_qualities').get(quality, 'best')  # Ключ качества
 
         # Определение сервиса (YouTube и т.д.)
         service_name, _ = URLValidator.detect_service(url)
@@ -659,28 +962,250 @@ class VideoDownloaderApp:
         """Обновляет прогресс загрузки в таблице"""
         tree_item_id = self.download_items.get(download_id)
         if tree_item_id and self.downloads_tree.exists(tree_item_id):
-            self.downloads_tree.item(tree_item_id, values=(
-                self.downloads_tree.item(tree_item_id, 'values')[0],  # service
-                self.downloads_tree.item(tree_item_id, 'values')[1],  # url
-                self.downloads_tree.item(tree_item_id, 'values')[2],  # type
+            # Сервис, ссылка и тип остаются; колонку истории скорости обновляет _refresh_throughput
+            values = list(self.downloads_tree.item(tree_item_id, 'values'))
+            values[3:7] = [
                 status,
                 f"{progress:.1f}%",
                 f"{speed:.1f} KB/s" if speed else "0 KB/s",
                 filename
-            ))
+            ]
+            self.downloads_tree.item(tree_item_id, values=values)
+            if THUMBNAILS_AVAILABLE and download_id not in self.thumbnail_requested:
+                download_info = self.download_manager.get_download(download_id)
+                if download_info and download_info.get('thumbnail'):
+                    self.thumbnail_requested.add(download_id)
+                    self.root.after(0, self.show_thumbnail, tree_item_id, download_info['thumbnail'])
+
+    def show_thumbnail(self, tree_item_id, url):
+        """Ставит превью в строку; если картинки еще нет - запрашивает ее в фоне"""
+        if not url or not THUMBNAILS_AVAILABLE:
+            return
+        image = self.thumbnail_images.get(url)
+        if image is not None:
+            self.thumbnail_images.move_to_end(url)
+            if self.downloads_tree.exists(tree_item_id):
+                self.downloads_tree.item(tree_item_id, image=image)
+            return
+        first_request = url not in self.thumbnail_waiters
+        self.thumbnail_waiters[url].add(tree_item_id)
+        if first_request:
+            self.thumbnails.request(url, lambda url, data: self.root.after(0, self._apply_thumbnail, url, data))
+
+    def _apply_thumbnail(self, url, data):
+        """Создает PhotoImage из готового PNG и ставит его во все ожидающие строки"""
+        if data is None:
+            self.thumbnail_waiters.pop(url, None)
+            return
+        image = tk.PhotoImage(data=base64.b64encode(data))
+        self.thumbnail_images[url] = image
+        while len(self.thumbnail_images) > AppConfig.THUMBNAIL_TK_IMAGES:
+            self.thumbnail_images.popitem(last=False)
+        for tree_item_id in self.thumbnail_waiters.pop(url, ()):
+            if self.downloads_tree.exists(tree_item_id):
+                self.downloads_tree.item(tree_item_id, image=image)
     
-    def download_completed(self, download_id, success, message):
-        """Обрабатывает завершение загрузки"""
+    def download_completed(self, download_id, success, message, result=None):
+        """Обрабатывает завершение загрузки (result - готовые файлы и их контрольные суммы)"""
         tree_item_id = self.download_items.get(download_id)
         if tree_item_id and self.downloads_tree.exists(tree_item_id):
             values = list(self.downloads_tree.item(tree_item_id, 'values'))
             values[3] = 'Завершено' if success else 'Ошибка'
+            if len(values) > 7:
+                # История скорости остается, оставшееся время больше не нужно
+                values[7] = values[7].split(' ')[0]
             self.downloads_tree.item(tree_item_id, values=values)
         
+        download_info = self.download_manager.get_download(download_id)
+        finished_at = download_info['finished_at'] if download_info else time.time()
         self.root.after(0, lambda: (
             self.status_var.set(f"{'✅ Загрузка завершена' if success else f'❌ Ошибка: {message}'}"),
-            self.download_button.set_enabled(True)
+            self.download_button.set_enabled(True),
+            self._mark_finished(download_id, finished_at)
         ))
+
+    def _refresh_throughput(self):
+        """Обновляет сводную панель скорости и колонку истории скорости идущих загрузок"""
+        try:
+            summary = self.download_manager.throughput_summary()
+            if summary['active'] or summary['queued']:
+                remaining = format_bytes(summary['remaining'])
+                if summary['unknown']:
+                    remaining += f" (+{summary['unknown']} без размера)"
+                eta = format_eta(summary['eta'])
+                self.throughput_var.set(
+                    f"🚀 {format_bytes(summary['speed'])}/с {summary['sparkline']}   "
+                    f"📦 Осталось {remaining}   "
+                    f"⏳ Очередь: {'≥ ' + eta if summary['unknown'] and summary['eta'] else eta}   "
+                    f"⬇️ Активно {summary['active']}, ожидает {summary['queued']}"
+                )
+            else:
+                self.throughput_var.set("🚀 Нет активных загрузок")
+
+            for download_id in self.download_manager.throughput.job_ids():
+                row = self.download_manager.throughput.row(download_id)
+                download_info = self.download_manager.get_download(download_id)
+                if row is None or download_info is None:
+                    continue
+                sparkline, eta = row
+                # Присоединенные повторные ссылки показывают ту же загрузку
+                for subscriber in list(download_info['subscribers']):
+                    tree_item_id = self.download_items.get(subscriber)
+                    if tree_item_id and self.downloads_tree.exists(tree_item_id):
+                        self.downloads_tree.set(tree_item_id, 'trend', f"{sparkline} {format_eta(eta)}")
+        finally:
+            self.root.after(AppConfig.THROUGHPUT_REFRESH_MS, self._refresh_throughput)
+
+    def _mark_finished(self, download_id, finished_at):
+        """Запоминает завершенную строку и при переполнении окна сессии архивирует старые"""
+        if download_id not in self.download_items:
+            return
+        self.finished_rows[download_id] = finished_at
+        if len(self.finished_rows) > AppConfig.HISTORY_RETAIN_ROWS:
+            self._trim_session()
+
+    def _periodic_trim(self):
+        self._trim_session()
+        self.root.after(AppConfig.HISTORY_TRIM_INTERVAL_MS, self._periodic_trim)
+
+    def _trim_session(self):
+        """Убирает из таблицы завершенные строки сверх лимита или старше срока хранения.
+
+        Сами записи уже сохранены менеджером загрузок в историю и
+        подгружаются обратно при прокрутке к началу списка.
+        """
+        cutoff = time.time() - AppConfig.HISTORY_RETAIN_SECONDS
+        excess = len(self.finished_rows) - AppConfig.HISTORY_RETAIN_ROWS
+        trimmed = 0
+        while self.finished_rows:
+            download_id, finished_at = next(iter(self.finished_rows.items()))
+            if excess <= 0 and finished_at >= cutoff:
+                break
+            self.finished_rows.popitem(last=False)
+            excess -= 1
+            trimmed += 1
+            tree_item_id = self.download_items.pop(download_id, None)
+            self.thumbnail_requested.discard(download_id)
+            if tree_item_id and self.downloads_tree.exists(tree_item_id):
+                self.downloads_tree.delete(tree_item_id)
+
+        if not trimmed:
+            return
+        # Подгруженные ранее записи старше убранных строк; начинаем подгрузку заново от оставшихся
+        self._drop_history_rows()
+        if self.finished_rows:
+            download_id, finished_at = next(iter(self.finished_rows.items()))
+            self.history_cursor = (finished_at, download_id)
+        else:
+            self.history_cursor = (time.time(), '')
+        self.history_exhausted = False
+
+    def _drop_history_rows(self):
+        for tree_item_id in self.history_rows:
+            if self.downloads_tree.exists(tree_item_id):
+                self.downloads_tree.delete(tree_item_id)
+        self.history_rows.clear()
+
+    @staticmethod
+    def _history_values(record):
+        """Значения колонок таблицы для записи истории"""
+        return (
+            record['service'],
+            record['url'],
+            record['type'],
+            record['status'],
+            '100%' if record['status'] == 'Завершено' else '—',
+            '',
+            record['filename'] or record['error'] or ''
+        )
+
+    def on_filter_change(self, event=None):
+        """Обработчик ввода в поле поиска с дебаунсингом"""
+        if self.filter_timer:
+            self.root.after_cancel(self.filter_timer)
+        self.filter_timer = self.root.after(300, self.apply_filter)
+
+    def clear_filter(self):
+        """Сбрасывает поиск и возвращает строки сессии"""
+        self.filter_var.set("")
+        self.filter_entry._show_placeholder()
+        self.apply_filter()
+
+    def apply_filter(self):
+        """Показывает совпадающие активные загрузки и результаты поиска по истории"""
+        self.filter_timer = None
+        text = self.filter_entry.get_real_text().strip()
+        if text == self.filter_text:
+            return
+
+        for tree_item_id in self.search_rows:
+            if self.downloads_tree.exists(tree_item_id):
+                self.downloads_tree.delete(tree_item_id)
+        self.search_rows.clear()
+
+        if not text:
+            # Возвращаем скрытые строки в исходном порядке, добавленные во время поиска - после них
+            hidden = set(self.detached_rows)
+            added = [item for item in self.downloads_tree.get_children() if item not in hidden]
+            for tree_item_id in self.detached_rows + added:
+                if self.downloads_tree.exists(tree_item_id):
+                    self.downloads_tree.move(tree_item_id, '', 'end')
+            self.detached_rows = []
+            self.filter_text = ''
+            self.status_var.set("✅ Готов к работе")
+            return
+
+        if not self.filter_text:
+            self.detached_rows = list(self.downloads_tree.get_children())
+        self.downloads_tree.detach(*self.downloads_tree.get_children())
+        self.filter_text = text
+
+        # Незавершенные загрузки есть только в памяти, завершенные ищутся в истории
+        lowered = text.lower()
+        for download_id, tree_item_id in self.download_items.items():
+            if download_id in self.finished_rows or not self.downloads_tree.exists(tree_item_id):
+                continue
+            values = self.downloads_tree.item(tree_item_id, 'values')
+            if any(lowered in str(value).lower() for value in values):
+                self.downloads_tree.move(tree_item_id, '', 'end')
+
+        started = time.perf_counter()
+        records = self.download_manager.history.search(text, limit=AppConfig.HISTORY_SEARCH_LIMIT)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for record in records:
+            tree_item_id = self.downloads_tree.insert('', 'end', values=self._history_values(record))
+            self.search_rows[tree_item_id] = record
+            self.show_thumbnail(tree_item_id, record.get('thumbnail'))
+        self.status_var.set(f"🔍 Найдено в истории: {len(records)} ({elapsed_ms:.0f} мс)")
+
+    def on_tree_scroll(self, *args):
+        """Прокрутка таблицы полосой прокрутки"""
+        self.downloads_tree.yview(*args)
+        self._check_history_scroll()
+
+    def _check_history_scroll(self):
+        if not self.history_exhausted and not self.filter_text and self.downloads_tree.yview()[0] <= 0.0:
+            self.load_older_history()
+
+    def load_older_history(self):
+        """Подгружает в начало таблицы следующую страницу более старых записей истории"""
+        records = self.download_manager.history.page_before(self.history_cursor)
+        if len(records) < AppConfig.HISTORY_PAGE_SIZE:
+            self.history_exhausted = True
+        if not records:
+            return
+
+        children = self.downloads_tree.get_children()
+        anchor = children[0] if children else None
+        # Записи идут от новых к старым, каждую вставляем в начало - самые старые окажутся сверху
+        for record in records:
+            tree_item_id = self.downloads_tree.insert('', 0, values=self._history_values(record))
+            self.history_rows[tree_item_id] = record
+            self.show_thumbnail(tree_item_id, record.get('thumbnail'))
+        self.history_cursor = (records[-1]['finished_at'], records[-1]['id'])
+        if anchor:
+            self.downloads_tree.see(anchor)
+        self.status_var.set(f"🕘 Загружено из истории: {len(self.history_rows)}")
     
     def choose_folder(self):
         """Открывает диалог выбора папки для сохранения"""
@@ -692,9 +1217,14 @@ class VideoDownloaderApp:
         """Очищает список загрузок"""
         confirm = messagebox.askyesno("Подтверждение", "Вы уверены, что хотите очистить список загрузок?")
         if confirm:
+            self.clear_filter()
             for item in self.downloads_tree.get_children():
                 self.downloads_tree.delete(item)
             self.download_items.clear()
+            self.finished_rows.clear()
+            self.history_rows.clear()
+            self.history_cursor = (time.time(), '')
+            self.history_exhausted = False
             self.status_var.set("✅ Список загрузок очищен")
     
     def open_downloads_folder(self):
@@ -711,12 +1241,19 @@ class VideoDownloaderApp:
         else:
             messagebox.showerror("Ошибка", "Папка не существует")
     
+    def _row_filepath(self, tree_item_id):
+        """Путь к файлу строки; для строк из истории - сохраненная папка загрузки"""
+        record = self.search_rows.get(tree_item_id) or self.history_rows.get(tree_item_id)
+        if record:
+            return os.path.join(record['path'] or '', record['filename'] or '')
+        filename = self.downloads_tree.item(tree_item_id, 'values')[6]
+        return os.path.join(self.folder_var.get(), filename)
+
     def open_file(self):
         """Открывает выбранный файл"""
         selected = self.downloads_tree.selection()
         if selected:
-            filename = self.downloads_tree.item(selected[0], 'values')[6]
-            filepath = os.path.join(self.folder_var.get(), filename)
+            filepath = self._row_filepath(selected[0])
             if os.path.exists(filepath):
                 import platform
                 if platform.system() == "Windows":
@@ -732,8 +1269,7 @@ class VideoDownloaderApp:
         """Показывает файл в папке"""
         selected = self.downloads_tree.selection()
         if selected:
-            filename = self.downloads_tree.item(selected[0], 'values')[6]
-            filepath = os.path.join(self.folder_var.get(), filename)
+            filepath = self._row_filepath(selected[0])
             if os.path.exists(filepath):
                 import platform
                 if platform.system() == "Windows":
@@ -753,6 +1289,11 @@ class VideoDownloaderApp:
                 download_id = next((k for k, v in self.download_items.items() if v == item), None)
                 if download_id:
                     del self.download_items[download_id]
+                    self.finished_rows.pop(download_id, None)
+                    # Строка могла быть присоединена к уже идущей загрузке - отписываемся от нее
+                    self.download_manager.detach(download_id)
+                self.history_rows.pop(item, None)
+                self.search_rows.pop(item, None)
                 self.downloads_tree.delete(item)
             self.status_var.set("✅ Элемент удален из списка")
     
@@ -766,12 +1307,50 @@ class VideoDownloaderApp:
         }
         InfoDialog(self.root, "О программе", about_info).show()
     
+    def show_profiling_settings(self):
+        """Открывает настройки профилирования"""
+        ProfilingDialog(self.root, self.profiler, on_apply=self._sync_profiling)
+
+    def _sync_profiling(self):
+        """Включает или выключает профилирование главного потока по текущим настройкам"""
+        saved = self.profiler.sync_main_thread()
+        if saved:
+            self.status_var.set(f"🔬 Профиль главного потока сохранен: {saved}.prof")
+        elif self.profiler.main_thread_active:
+            self.status_var.set("🔬 Профилирование главного потока включено")
+
+    def _poll_profiling(self):
+        """Подхватывает изменения, сделанные через CLI"""
+        if self.profiler.reload_if_changed():
+            self._sync_profiling()
+        self.root.after(AppConfig.PROFILING_POLL_MS, self._poll_profiling)
+
+    def update_lag_indicator(self, lag_ms, window_max_ms):
+        """Показывает текущую задержку цикла событий и максимум за последнюю секунду"""
+        self.lag_var.set(f"⏱ {lag_ms:.0f} мс (макс {window_max_ms:.0f})")
+        color = 'danger' if window_max_ms >= AppConfig.WATCHDOG_LAG_THRESHOLD_MS else 'gray_700'
+        self.lag_label.configure(fg=AppConfig.COLORS[color])
+
     def on_closing(self):
         """Обработчик закрытия приложения"""
         if messagebox.askokcancel("Выход", "Вы уверены, что хотите выйти?"):
+            if self.bulk_importer:
+                self.bulk_importer.cancel()
             self.download_manager.stop_all()
+            self.thumbnails.close()
+            self.profiler.stop_main_thread()
+            self.watchdog.stop()
+            if self.trace_recorder:
+                self.trace_recorder.close()
             self.root.destroy()
 
 if __name__ == "__main__":
-    app = VideoDownloaderApp()
+    parser = argparse.ArgumentParser(description=AppConfig.APP_NAME)
+    parser.add_argument('--record-trace', metavar='FILE',
+                        help="Записывать события прогресса в FILE (для python benchmarks.py gui --replay FILE)")
+    args = parser.parse_args()
+
+    setup_logging(get_profile().section('logging'))
+    get_profile().add_listener(lambda profile: apply_levels(profile.section('logging')))
+    app = VideoDownloaderApp(trace_path=args.record_trace)
     app.root.mainloop()
\ No newline at end of file
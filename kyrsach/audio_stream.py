@@ -0,0 +1,253 @@
+﻿import logging
+import os
+import subprocess
+import threading
+import time
+
+from yt_dlp.networking import Request
+from yt_dlp.postprocessor import FFmpegPostProcessor
+from yt_dlp.utils import ContentTooShortError
+
+from disk_space import preallocate
+
+logger = logging.getLogger(__name__)
+
+STREAMABLE_PROTOCOLS = ('http', 'https')
+
+# Сколько раз подряд сервер может закрыть соединение, не отдав ни байта, прежде чем чтение прервется
+SHORT_READ_RETRIES = 3
+
+
+class DownloadStopped(Exception):
+    """Загрузка прервана пользователем"""
+
+
+class StreamingAudioExtractor:
+    """Потоковое извлечение MP3: байты из сети сразу уходят в ffmpeg через pipe.
+
+    Исходный аудиофайл на диск не записывается, MP3 готов сразу после
+    получения последнего байта.
+    """
+
+    def __init__(self, chunk_size=256 * 1024):
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def can_stream(ydl, info):
+        """Проверяет, можно ли обработать выбранный формат потоково"""
+        if not info or info.get('entries') is not None or info.get('requested_formats'):
+            return False
+        if info.get('protocol') not in STREAMABLE_PROTOCOLS or not info.get('url'):
+            return False
+        return FFmpegPostProcessor(ydl).available
+
+    @staticmethod
+    def get_bitrate(ydl, default='192'):
+        """Берет битрейт MP3 из профиля (настройки FFmpegExtractAudio)"""
+        for pp in ydl.params.get('postprocessors') or []:
+            if pp.get('key') == 'FFmpegExtractAudio':
+                return str(pp.get('preferredquality') or default)
+        return default
+
+    def extract(self, ydl, info, progress_hook=None, should_stop=None, checksums=None):
+        """
+        Скачивает выбранный аудиоформат и кодирует его в MP3 на лету.
+
+        Args:
+            ydl: экземпляр YoutubeDL, которым выполнялось извлечение
+            info (dict): info_dict с выбранным форматом
+            progress_hook (callable): получатель событий прогресса в формате yt-dlp
+            should_stop (callable): возвращает True, если загрузку нужно прервать
+            checksums (FileChecksums): контрольные суммы задачи; MP3 хэшируется при записи
+
+        Returns:
+            str: путь к готовому MP3
+
+        Raises:
+            ContentTooShortError: получено не столько байтов, сколько весит формат
+        """
+        filepath = os.path.splitext(ydl.prepare_filename(info))[0] + '.mp3'
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        temp_path = filepath + '.part'
+        bitrate = self.get_bitrate(ydl)
+
+        # ffmpeg пишет MP3 в stdout, а мы - в заранее выделенный файл
+        command = [
+            FFmpegPostProcessor(ydl).executable, '-hide_banner', '-nostats', '-loglevel', 'error',
+            '-i', 'pipe:0', '-vn', '-codec:a', 'libmp3lame', '-b:a', f'{bitrate}k',
+            '-f', 'mp3', 'pipe:1'
+        ]
+        process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+        output_file = open(temp_path, 'wb')
+        preallocate(output_file, self.estimate_output_size(info, bitrate))
+        checksum = checksums.writer(temp_path) if checksums is not None else None
+        written = []
+        stderr_lines = []
+        readers = [
+            threading.Thread(target=self._drain_output, args=(process.stdout, output_file, written, checksum),
+                             daemon=True),
+            threading.Thread(target=self._drain_output, args=(process.stderr, None, stderr_lines), daemon=True)
+        ]
+        for reader in readers:
+            reader.start()
+
+        total_bytes = info.get('filesize') or info.get('filesize_approx')
+        downloaded = 0
+        started = time.monotonic()
+
+        try:
+            try:
+                for chunk in self._iter_chunks(ydl, info):
+                    if should_stop and should_stop():
+                        raise DownloadStopped("Загрузка остановлена")
+                    process.stdin.write(chunk)
+                    downloaded += len(chunk)
+
+                    if progress_hook:
+                        elapsed = max(time.monotonic() - started, 1e-6)
+                        speed = downloaded / elapsed
+                        progress_hook({
+                            'status': 'downloading',
+                            'downloaded_bytes': downloaded,
+                            'total_bytes': total_bytes,
+                            'speed': speed,
+                            'eta': (total_bytes - downloaded) / speed if total_bytes and total_bytes > downloaded else None,
+                            'filename': filepath
+                        })
+                expected = info.get('filesize')
+                if expected and downloaded != expected:
+                    # Без проверки ffmpeg закончил бы обрезанный MP3, и задача считалась бы успешной
+                    raise ContentTooShortError(downloaded, expected)
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+            returncode = process.wait()
+            for reader in readers:
+                reader.join()
+            if returncode != 0:
+                stderr = b''.join(stderr_lines).decode('utf-8', 'replace')
+                raise RuntimeError(f"ffmpeg завершился с ошибкой: {stderr.strip()[-500:]}")
+
+            # Отрезаем неиспользованную часть предвыделенного места
+            output_file.truncate(sum(written))
+            output_file.close()
+        except BaseException:
+            process.kill()
+            process.wait()
+            output_file.close()
+            self._remove(temp_path)
+            raise
+
+        os.replace(temp_path, filepath)
+        if checksums is not None:
+            checksums.rename(temp_path, filepath)
+        logger.info("Потоковое MP3 готово: %s (%d байт получено)", filepath, downloaded)
+
+        if progress_hook:
+            progress_hook({
+                'status': 'finished',
+                'downloaded_bytes': downloaded,
+                'total_bytes': downloaded,
+                'filename': filepath
+            })
+        return filepath
+
+    @staticmethod
+    def estimate_output_size(info, bitrate):
+        """Оценивает размер MP3 по длительности и битрейту"""
+        duration = info.get('duration')
+        if not duration:
+            return 0
+        return int(duration * int(bitrate) * 1000 / 8)
+
+    def _drain_output(self, pipe, output_file, collected, checksum=None):
+        """Читает pipe ffmpeg: в файл (stdout) или в список (stderr)"""
+        try:
+            while True:
+                data = pipe.read(self.chunk_size) if output_file else pipe.readline()
+                if not data:
+                    break
+                if output_file:
+                    output_file.write(data)
+                    collected.append(len(data))
+                    if checksum is not None:
+                        checksum.update(data)
+                else:
+                    collected.append(data)
+        finally:
+            pipe.close()
+
+    def _iter_chunks(self, ydl, info):
+        """Читает формат из сети; при http_chunk_size запрашивает его диапазонами.
+
+        Если сервер закрыл соединение раньше известного размера файла, чтение
+        продолжается диапазоном с текущего смещения. Размер берется из метаданных
+        или из Content-Range ответа.
+        """
+        headers = dict(info.get('http_headers') or {})
+        range_size = (info.get('downloader_options') or {}).get('http_chunk_size')
+        total_bytes = info.get('filesize')
+
+        start = 0
+        empty_reads = 0
+        while total_bytes is None or start < total_bytes:
+            request_headers = dict(headers)
+            if range_size:
+                # Диапазонные запросы обходят ограничение скорости на длинных ответах (YouTube)
+                request_headers['Range'] = f'bytes={start}-{start + range_size - 1}'
+            elif start:
+                request_headers['Range'] = f'bytes={start}-'
+            received = 0
+            with ydl.urlopen(Request(info['url'], headers=request_headers)) as response:
+                partial = getattr(response, 'status', None) == 206
+                if start and not partial:
+                    # Сервер не поддерживает докачку: продолжить с середины нельзя
+                    raise ContentTooShortError(start, total_bytes)
+                if partial and total_bytes is None:
+                    total_bytes = self._content_range_total(response)
+                for chunk in self._read_response(response):
+                    received += len(chunk)
+                    yield chunk
+            start += received
+
+            if total_bytes is None:
+                # Размер неизвестен: конец - неполный диапазон или ответ целиком
+                if not range_size or not partial or received < range_size:
+                    return
+                continue
+            if start >= total_bytes:
+                return
+            if range_size and partial and received == range_size:
+                continue
+
+            # Соединение закрыто раньше конца файла (или сервер отдал файл целиком, но не весь)
+            empty_reads = empty_reads + 1 if not received else 0
+            if empty_reads >= SHORT_READ_RETRIES:
+                raise ContentTooShortError(start, total_bytes)
+            logger.warning("Сервер закрыл соединение на %d из %d байт, продолжаем с этого места",
+                           start, total_bytes)
+
+    @staticmethod
+    def _content_range_total(response):
+        """Полный размер файла из заголовка Content-Range (bytes 0-99/1234) или None"""
+        content_range = (getattr(response, 'headers', None) or {}).get('Content-Range') or ''
+        total = content_range.rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+
+    def _read_response(self, response):
+        while True:
+            chunk = response.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,253 @@
+﻿import argparse
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+from config import AppConfig
+
+logger = logging.getLogger(__name__)
+
+# Признаки ответа сервиса "слишком много запросов" (429) или отказа из-за нагрузки (403)
+THROTTLE_MARKERS = ('429', 'too many requests', 'rate limit', 'rate-limit', '403', 'forbidden')
+
+# Ошибки самого содержимого: о нагрузке на сервис они ничего не говорят
+CONTENT_MARKERS = ('private', 'not available', 'removed', 'deleted', 'copyright', '404', 'not found')
+
+SUCCESS = 'success'
+THROTTLED = 'throttled'
+ERROR = 'error'
+CONTENT = 'content'
+
+
+def classify_error(error):
+    """Относит ошибку попытки к THROTTLED, CONTENT или ERROR (сеть, таймауты и прочее)"""
+    text = str(error).lower()
+    if any(marker in text for marker in THROTTLE_MARKERS):
+        return THROTTLED
+    if any(marker in text for marker in CONTENT_MARKERS):
+        return CONTENT
+    return ERROR
+
+
+class ConcurrencyTuner:
+    """Подбор числа параллельных загрузок для каждого сервиса по схеме AIMD.
+
+    Лимит растет на additive_increase за "окно" успешных попыток (на
+    additive_increase / лимит за каждую), пока лимит действительно
+    ограничивает загрузки, и умножается на decrease_factor при 429/403,
+    при доле ошибок выше порога или когда оценка общей скорости сервиса
+    при упертом в лимит числе загрузок (EWMA скорости одной загрузки x
+    число загрузок) падает ниже congestion_ratio от лучшей недавней. После уменьшения следующее
+    возможно не раньше чем через decrease_cooldown секунд: одна волна
+    отказов дает одно уменьшение. Верхняя граница -
+    concurrency.max_parallel_downloads. Решения пишутся в лог и в файл
+    состояния, который показывает `python autotune.py`.
+    """
+
+    def __init__(self, profile, state_file=AppConfig.AUTOTUNE_STATE_FILE):
+        self.profile = profile
+        self.state_file = state_file
+        self.decisions = collections.deque(maxlen=AppConfig.AUTOTUNE_HISTORY)
+        self._services = {}
+        self._lock = threading.Lock()
+
+    def _settings(self, service):
+        return self.profile.section('autotune', service)
+
+    def _max_limit(self):
+        return self.profile.get('concurrency', 'max_parallel_downloads')
+
+    def _state(self, service, settings):
+        state = self._services.get(service)
+        if state is None:
+            state = self._services[service] = {
+                'limit': float(min(max(settings['initial_limit'], settings['min_limit']), self._max_limit())),
+                'active': 0,
+                'speed': None,
+                'best_throughput': 0.0,
+                'error_rate': 0.0,
+                'last_decrease': 0.0,
+                'attempts': 0,
+                'throttled': 0,
+                'errors': 0,
+            }
+        return state
+
+    def limit(self, service):
+        """Текущее число одновременных загрузок, разрешенное сервису"""
+        with self._lock:
+            return self._limit_locked(service)
+
+    def _limit_locked(self, service):
+        settings = self._settings(service)
+        if not settings['enabled']:
+            return self._max_limit()
+        state = self._state(service, settings)
+        return max(1, min(int(state['limit']), self._max_limit()))
+
+    def try_acquire(self, service):
+        """Занимает место сервиса; False, если лимит сервиса исчерпан"""
+        with self._lock:
+            state = self._state(service, self._settings(service))
+            if state['active'] >= self._limit_locked(service):
+                return False
+            state['active'] += 1
+            return True
+
+    def release(self, service):
+        """Освобождает место сервиса и возвращает число свободных мест"""
+        with self._lock:
+            state = self._state(service, self._settings(service))
+            state['active'] = max(0, state['active'] - 1)
+            return self._limit_locked(service) - state['active']
+
+    def free_slots(self, service):
+        with self._lock:
+            state = self._state(service, self._settings(service))
+            return self._limit_locked(service) - state['active']
+
+    def record(self, service, outcome, size=0, seconds=0.0):
+        """
+        Учитывает завершенную попытку загрузки и при необходимости меняет лимит сервиса.
+
+        Args:
+            service (str): сервис задачи
+            outcome (str): SUCCESS, THROTTLED, ERROR или CONTENT
+            size (int): байт получено успешной попыткой
+            seconds (float): длительность попытки
+        """
+        settings = self._settings(service)
+        if not settings['enabled'] or outcome == CONTENT:
+            return
+        with self._lock:
+            state = self._state(service, settings)
+            alpha = settings['ewma_alpha']
+            state['attempts'] += 1
+            state['error_rate'] = alpha * (outcome != SUCCESS) + (1 - alpha) * state['error_rate']
+
+            if outcome == THROTTLED:
+                state['throttled'] += 1
+                self._decrease(service, state, settings, "сервис ограничивает запросы (429/403)")
+                return
+            if outcome == ERROR:
+                state['errors'] += 1
+                if state['error_rate'] > settings['error_rate_threshold']:
+                    self._decrease(service, state, settings, f"ошибок {state['error_rate']:.0%}")
+                return
+
+            limit = int(state['limit'])
+            # Скорость сравнивается и лимит растет, только пока лимит сдерживает загрузки:
+            # в конце очереди загрузок просто меньше, и общая скорость падает не из-за перегрузки
+            binding = state['active'] >= limit
+            if size and seconds > 0:
+                speed = size / seconds
+                state['speed'] = speed if state['speed'] is None else alpha * speed + (1 - alpha) * state['speed']
+                if binding:
+                    # Оценка общей скорости сервиса; лучшая медленно забывается (сеть меняется в течение дня)
+                    throughput = state['speed'] * state['active']
+                    state['best_throughput'] = max(throughput, state['best_throughput'] * settings['best_decay'])
+                    if throughput < settings['congestion_ratio'] * state['best_throughput']:
+                        self._decrease(service, state, settings,
+                                       f"общая скорость упала до {throughput / 1024:.0f} КБ/с")
+                        return
+
+            if binding and limit < self._max_limit():
+                state['limit'] = min(state['limit'] + settings['additive_increase'] / state['limit'],
+                                     float(self._max_limit()))
+                if int(state['limit']) > limit:
+                    self._decide(service, state, limit, "рост: попытки успешны")
+
+    def _decrease(self, service, state, settings, reason):
+        now = time.monotonic()
+        if now - state['last_decrease'] < settings['decrease_cooldown']:
+            return
+        old = int(state['limit'])
+        state['limit'] = max(float(settings['min_limit']), state['limit'] * settings['decrease_factor'])
+        state['last_decrease'] = now
+        if int(state['limit']) != old:
+            self._decide(service, state, old, f"снижение: {reason}")
+
+    def _decide(self, service, state, old, reason):
+        decision = {
+            'time': time.time(), 'service': service, 'old': old, 'new': int(state['limit']), 'reason': reason
+        }
+        self.decisions.append(decision)
+        speed = state['speed'] / 1024 if state['speed'] else 0.0
+        logger.info("Автонастройка %s: лимит %d -> %d (%s; скорость загрузки %.0f КБ/с, ошибок %.0f%%)",
+                    service, old, decision['new'], reason, speed, state['error_rate'] * 100)
+        self._write_state()
+
+    def snapshot(self):
+        """Состояние по сервисам и последние решения (для метрик)"""
+        with self._lock:
+            return self._snapshot_locked()
+
+    def _snapshot_locked(self):
+        return {
+            'updated': time.time(),
+            'services': {
+                service: {
+                    'limit': self._limit_locked(service),
+                    'active': state['active'],
+                    'speed_kbps': round(state['speed'] / 1024, 1) if state['speed'] else None,
+                    'error_rate': round(state['error_rate'], 3),
+                    'attempts': state['attempts'],
+                    'throttled': state['throttled'],
+                    'errors': state['errors'],
+                }
+                for service, state in self._services.items()
+            },
+            'decisions': list(self.decisions),
+        }
+
+    def _write_state(self):
+        """Сохраняет состояние в файл; вызывается под блокировкой, только при смене лимита"""
+        if not self.state_file:
+            return
+        tmp_path = f"{self.state_file}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._snapshot_locked(), f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.state_file)
+        except OSError as e:
+            logger.debug("Не удалось сохранить состояние автонастройки: %s", e)
+
+
+def _print_state(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Нет данных автонастройки ({path}): {e}")
+        return
+    print(f"Обновлено: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(state['updated']))}")
+    for service, values in sorted(state['services'].items()):
+        print(f"  {service:<12} лимит {values['limit']:>2}  активно {values['active']:>2}  "
+              f"скорость {values['speed_kbps'] or 0:>8} КБ/с  ошибок {values['error_rate']:.0%}  "
+              f"попыток {values['attempts']} (429/403: {values['throttled']}, ошибок: {values['errors']})")
+    for decision in state['decisions'][-10:]:
+        print(f"  {time.strftime('%H:%M:%S', time.localtime(decision['time']))} {decision['service']}: "
+              f"{decision['old']} -> {decision['new']} ({decision['reason']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Состояние автонастройки параллельных загрузок")
+    parser.add_argument('--file', default=AppConfig.AUTOTUNE_STATE_FILE, help="Файл состояния")
+    parser.add_argument('--watch', type=float, metavar='SEC', help="Обновлять каждые SEC секунд")
+    args = parser.parse_args()
+    try:
+        while True:
+            _print_state(args.file)
+            if not args.watch:
+                break
+            time.sleep(args.watch)
+            print()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
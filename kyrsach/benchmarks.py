@@ -0,0 +1,510 @@
+﻿import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+from config import AppConfig
+
+
+def _report(title, samples):
+    """Печатает сводку по замерам в миллисекундах"""
+    samples_ms = [sample * 1000 for sample in samples]
+    print(
+        f"{title:<40} среднее {statistics.mean(samples_ms):8.3f} мс  "
+        f"медиана {statistics.median(samples_ms):8.3f} мс  "
+        f"макс {max(samples_ms):8.3f} мс"
+    )
+
+
+def bench_ydl_setup(args):
+    """Сравнивает подготовку задачи: новый YoutubeDL на каждую попытку против пула воркера"""
+    import yt_dlp
+    from ydl_pool import YoutubeDLPool, get_profile_options
+
+    services = list(AppConfig.SUPPORTED_SERVICES.keys())
+    quality = next(iter(AppConfig.VIDEO_QUALITIES))
+    hook = lambda d: None
+
+    fresh = []
+    for index in range(args.jobs):
+        service_name = services[index % len(services)]
+        started = time.perf_counter()
+        ydl_opts = get_profile_options(service_name, "Видео (MP4)", quality)
+        ydl_opts['quiet'] = True
+        ydl_opts['progress_hooks'] = [hook]
+        with yt_dlp.YoutubeDL(ydl_opts):
+            pass
+        fresh.append(time.perf_counter() - started)
+
+    pool = YoutubeDLPool(max_size=len(services))
+    pooled = []
+    for index in range(args.jobs):
+        service_name = services[index % len(services)]
+        started = time.perf_counter()
+        instance = pool.acquire(service_name, "Видео (MP4)", quality)
+        instance.prepare_job(AppConfig.DOWNLOAD_FOLDER, "benchmark", hook)
+        instance.finish_job()
+        pooled.append(time.perf_counter() - started)
+    pool.close()
+
+    print(f"Задач: {args.jobs}, сервисов: {len(services)}")
+    _report("Новый YoutubeDL на задачу", fresh)
+    _report("Пул воркера (включая прогрев)", pooled)
+    _report("Пул воркера (только повторные)", pooled[len(services):] or pooled)
+    saved = (sum(fresh) - sum(pooled)) * 1000
+    print(f"Сэкономлено на подготовке: {saved:.1f} мс ({saved / args.jobs:.3f} мс на задачу)")
+
+
+def bench_logging(args):
+    """Сравнивает стоимость логирования в цикле загрузки: синхронный вывод с f-строками против очереди"""
+    import io
+    import logging
+    import logging.handlers
+    import queue
+    import tempfile
+    from log_setup import LOG_FORMAT, DeferredQueueHandler
+
+    url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    def run(logger, lazy):
+        """Имитирует попытки загрузки: INFO на попытку, DEBUG на каждый прогресс"""
+        samples = []
+        for attempt in range(args.iterations):
+            started = time.perf_counter()
+            if lazy:
+                logger.info("Попытка %d/%d для %s", attempt % 3 + 1, 3, url)
+                for step in range(args.progress):
+                    logger.debug("Прогресс %s: %d байт", url, step * 1024)
+            else:
+                logger.info(f"Попытка {attempt % 3 + 1}/{3} для {url}")
+                for step in range(args.progress):
+                    logger.debug(f"Прогресс {url}: {step * 1024} байт")
+            samples.append(time.perf_counter() - started)
+        return samples
+
+    def sync_run(tmp, level):
+        """Было: обработчики в потоке загрузки, сообщения - f-строки"""
+        sync_logger = logging.getLogger(f'benchmark.sync.{level}')
+        sync_logger.propagate = False
+        sync_logger.setLevel(level)
+        file_handler = logging.FileHandler(os.path.join(tmp, f'sync_{level}.log'), encoding='utf-8')
+        stream_handler = logging.StreamHandler(io.StringIO())
+        for handler in (file_handler, stream_handler):
+            handler.setFormatter(formatter)
+            sync_logger.addHandler(handler)
+        samples = run(sync_logger, lazy=False)
+        file_handler.close()
+        return samples
+
+    def async_run(tmp, level):
+        """Стало: очередь + фоновый поток, ленивое форматирование"""
+        log_queue = queue.SimpleQueue()
+        async_logger = logging.getLogger(f'benchmark.async.{level}')
+        async_logger.propagate = False
+        async_logger.setLevel(level)
+        async_logger.addHandler(DeferredQueueHandler(log_queue))
+        target = logging.handlers.RotatingFileHandler(
+            os.path.join(tmp, f'async_{level}.log'), maxBytes=AppConfig.LOG_MAX_BYTES,
+            backupCount=AppConfig.LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+        target.setFormatter(formatter)
+        listener = logging.handlers.QueueListener(log_queue, target)
+        listener.start()
+        samples = run(async_logger, lazy=True)
+        listener.stop()
+        target.close()
+        return samples
+
+    level = logging.getLevelName(args.level)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Обе стороны пишут одни и те же записи: разница - только очередь и ленивое форматирование
+        sync_samples = sync_run(tmp, level)
+        async_samples = async_run(tmp, level)
+        # Отдельно: сколько дает отсечение DEBUG уровнем модуля (INFO, как в LOG_LEVELS)
+        filtered_samples = async_run(tmp, logging.INFO) if level < logging.INFO else None
+
+    print(f"Попыток: {args.iterations}, событий прогресса на попытку: {args.progress}, уровень {args.level}")
+    _report(f"Синхронно, f-строки, {args.level}", sync_samples)
+    _report(f"Очередь, ленивое форматирование, {args.level}", async_samples)
+    saved = (sum(sync_samples) - sum(async_samples)) * 1000
+    print(f"Снято с цикла загрузки: {saved:.1f} мс ({saved / args.iterations:.3f} мс на попытку)")
+    if filtered_samples is not None:
+        print("\nОтсечение по уровню (та же очередь):")
+        _report("Очередь, уровень INFO (DEBUG отброшен)", filtered_samples)
+        saved = (sum(async_samples) - sum(filtered_samples)) * 1000
+        print(f"Дает уровень INFO: {saved:.1f} мс ({saved / args.iterations:.3f} мс на попытку)")
+
+
+def bench_history(args):
+    """Время поиска по истории загрузок на синтетической базе"""
+    import tempfile
+    from history import HistoryStore
+
+    services = list(AppConfig.SUPPORTED_SERVICES.keys())
+    words = ["концерт", "лекция", "tutorial", "music", "обзор", "stream", "podcast", "trailer", "новости", "gameplay"]
+    rng = random.Random(42)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = HistoryStore(os.path.join(tmp, 'history.sqlite3'))
+        now = time.time()
+        started = time.perf_counter()
+        batch = []
+        for index in range(args.rows):
+            title = " ".join(rng.choice(words) for _ in range(4)) + f" {index}"
+            failed = index % 17 == 0
+            batch.append({
+                'id': f"{index:08x}",
+                'url': f"https://example.com/watch?v=v{index:07d}",
+                'service': services[index % len(services)],
+                'type': "Видео (MP4)",
+                'status': 'Ошибка' if failed else 'Завершено',
+                'title': title,
+                'filename': None if failed else f"{title}.mp4",
+                'error': "Ошибка: Превышено время ожидания" if failed else None,
+                'started_at': now - args.rows + index - 30,
+                'finished_at': now - args.rows + index,
+            })
+            if len(batch) == 5000:
+                store.record_many(batch)
+                batch = []
+        store.record_many(batch)
+        print(f"Записей: {store.count()}, заполнение {time.perf_counter() - started:.1f} с, FTS5: {store.fts_enabled}")
+
+        queries = [
+            ("редкое слово + префикс", lambda: store.search(f"v{rng.randrange(args.rows):07d}")),
+            ("частое слово", lambda: store.search(rng.choice(words))),
+            ("два слова", lambda: store.search(f"{rng.choice(words)} {rng.choice(words)}")),
+            ("текст ошибки", lambda: store.search("превышено время")),
+            ("точный URL", lambda: store.find_url(f"https://example.com/watch?v=v{rng.randrange(args.rows):07d}")),
+            ("страница истории", lambda: store.page_before((now - args.rows / 2, ''))),
+        ]
+        for title, query in queries:
+            samples = []
+            for _ in range(args.repeat):
+                query_started = time.perf_counter()
+                query()
+                samples.append(time.perf_counter() - query_started)
+            _report(title, samples)
+        store.close()
+
+
+def _start_hls_fixture(root, segments, segment_kb, latency_ms):
+    """Поднимает локальный HLS-сервер: плейлист и сегменты с искусственной задержкой ответа"""
+    import functools
+    import http.server
+    import threading
+
+    os.makedirs(root, exist_ok=True)
+    payload = os.urandom(segment_kb * 1024)
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:0"]
+    for index in range(segments):
+        with open(os.path.join(root, f"seg{index:05d}.ts"), 'wb') as f:
+            f.write(payload)
+        lines += ["#EXTINF:4.0,", f"seg{index:05d}.ts"]
+    lines.append("#EXT-X-ENDLIST")
+    with open(os.path.join(root, "index.m3u8"), 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        extensions_map = {**http.server.SimpleHTTPRequestHandler.extensions_map,
+                          '.m3u8': 'application/vnd.apple.mpegurl', '.ts': 'video/mp2t'}
+
+        def do_GET(self):
+            # Задержка имитирует время до первого байта у CDN
+            if self.path.endswith('.ts'):
+                time.sleep(latency_ms / 1000)
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(Handler, directory=root))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/index.m3u8"
+
+
+def bench_hls(args):
+    """Сравнивает загрузку HLS по одному фрагменту и с параллельными фрагментами"""
+    import shutil
+    import tempfile
+    import yt_dlp
+    from ydl_pool import get_profile_options
+
+    quality = next(iter(AppConfig.VIDEO_QUALITIES))
+    with tempfile.TemporaryDirectory() as tmp:
+        server, url = _start_hls_fixture(os.path.join(tmp, 'fixture'), args.segments, args.segment_kb, args.latency)
+        print(f"Фрагментов: {args.segments} по {args.segment_kb} КБ, задержка ответа {args.latency} мс")
+        try:
+            for workers in args.workers:
+                samples = []
+                for run in range(args.repeat):
+                    output_dir = os.path.join(tmp, f"out-{workers}-{run}")
+                    ydl_opts = get_profile_options('Twitch', "Видео (MP4)", quality)
+                    ydl_opts.update({
+                        'concurrent_fragment_downloads': workers,
+                        'format': 'best',
+                        'paths': {'home': output_dir},
+                        'sleep_interval': 0,
+                        'max_sleep_interval': 0,
+                        'no_warnings': True,
+                    })
+                    started = time.perf_counter()
+                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                        ydl.download([url])
+                    samples.append(time.perf_counter() - started)
+                    shutil.rmtree(output_dir, ignore_errors=True)
+                _report(f"concurrent_fragment_downloads={workers}", samples)
+        finally:
+            server.shutdown()
+
+
+def bench_sync_archive(args):
+    """Проверка «запись уже скачана» в архиве синхронизации с фильтром Блума и без него"""
+    import tempfile
+    from channel_sync import SyncArchive
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'sync.sqlite3')
+        bloom_path = os.path.join(tmp, 'sync.bloom')
+        archive = SyncArchive(db_path, bloom_path)
+        archive.register_source('youtubetab UC0', 'https://example.com/channel')
+        source_id = archive._source_id('youtubetab UC0')
+        started = time.perf_counter()
+        with archive._conn:
+            archive._conn.executemany(
+                "INSERT INTO entries (source_id, entry) VALUES (?, ?)",
+                ((source_id, f"youtube v{index:010d}") for index in range(args.entries))
+            )
+        archive.close()
+        print(f"Записей: {args.entries}, заполнение {time.perf_counter() - started:.1f} с, "
+              f"база {os.path.getsize(db_path) / 1024 ** 2:.1f} МБ")
+
+        started = time.perf_counter()
+        archive = SyncArchive(db_path, bloom_path)
+        print(f"Построение фильтра: {time.perf_counter() - started:.2f} с, "
+              f"{len(archive.bloom.bits) / 1024 ** 2:.1f} МБ, {archive.bloom.hashes} хэшей")
+        started = time.perf_counter()
+        archive.close()
+        archive = SyncArchive(db_path, bloom_path)
+        print(f"Открытие с сохраненным фильтром: {time.perf_counter() - started:.2f} с")
+
+        known = [('youtubetab UC0', f"youtube v{rng.randrange(args.entries):010d}") for _ in range(args.lookups)]
+        unknown = [('youtubetab UC0', f"youtube n{index:010d}") for index in range(args.lookups)]
+
+        def lookup_db(item):
+            return archive._conn.execute(
+                "SELECT 1 FROM entries WHERE source_id = ? AND entry = ?", (source_id, item[1])
+            ).fetchone() is not None
+
+        for title, items, check in (
+            ("известные, фильтр + SQLite", known, lambda item: item in archive),
+            ("новые, фильтр + SQLite", unknown, lambda item: item in archive),
+            ("новые, только SQLite", unknown, lookup_db),
+        ):
+            samples = []
+            for item in items:
+                lookup_started = time.perf_counter()
+                check(item)
+                samples.append(time.perf_counter() - lookup_started)
+            _report(title, samples)
+
+        false_positives = sum(archive._bloom_key(*item) in archive.bloom for item in unknown)
+        print(f"Ложных срабатываний фильтра: {false_positives / len(unknown):.4%}")
+        archive.close()
+
+
+def _virtual_display():
+    """Запускает виртуальный дисплей (необязательная зависимость pyvirtualdisplay + Xvfb), если своего нет"""
+    if os.name != 'posix' or sys.platform == 'darwin' or os.environ.get('DISPLAY'):
+        return None
+    try:
+        from pyvirtualdisplay import Display
+    except ImportError:
+        raise SystemExit("Нет дисплея: запустите через xvfb-run -a python benchmarks.py gui ... "
+                         "или установите pyvirtualdisplay и Xvfb")
+    display = Display(visible=False, size=(1280, 900))
+    display.start()
+    return display
+
+
+def bench_gui(args):
+    """Нагрузка на путь обновления интерфейса: события прогресса из потоков-воркеров в таблицу и сводную панель"""
+    import tempfile
+    import threading
+    from perf_profile import get_profile
+    from progress_trace import load_trace, synthetic_trace
+
+    display = _virtual_display()
+    threads = args.threads or get_profile().get('concurrency', 'max_parallel_downloads')
+    quality = next(iter(get_profile().section('video_qualities')))
+    # История, превью и папка загрузок бенчмарка - во временной папке (профиль уже прочитан из текущей)
+    project_dir = os.getcwd()
+    tmp = tempfile.TemporaryDirectory()
+    os.chdir(tmp.name)
+
+    from app import VideoDownloaderApp
+    from download_manager import DownloadManager
+
+    manager = DownloadManager(start_workers=False)
+    app = VideoDownloaderApp(download_manager=manager)
+    traces = load_trace(args.replay) if args.replay else None
+    trace_ids = sorted({event[1] for events in traces.values() for event in events}) if traces else range(args.jobs)
+
+    # Строки добавляются так же, как при нажатии "Скачать"
+    ids = {}
+    for index, trace_id in enumerate(trace_ids):
+        url = f"https://www.youtube.com/watch?v=bench{index:06d}"
+        download_id = manager.add_download(url, "Видео (MP4)", quality, tmp.name)
+        app.download_items[download_id] = app.downloads_tree.insert('', 'end', values=(
+            'YouTube', url, "Видео (MP4)", 'Ожидает', '0%', '0 KB/s', 'Ожидает...'
+        ))
+        ids[trace_id] = download_id
+    if traces is None:
+        traces = synthetic_trace(list(ids.values()), threads, args.rate, args.duration)
+        ids = {download_id: download_id for download_id in ids.values()}
+        target_rate = args.jobs * args.rate
+    else:
+        events = sum(len(thread_events) for thread_events in traces.values())
+        span = max((thread_events[-1][0] for thread_events in traces.values() if thread_events), default=0.0)
+        target_rate = events / (span / args.speed) if span else 0.0
+
+    call_times, lateness, frame_lags = [], [], []
+    state = {'dropped': 0, 'frames': 0, 'running': True}
+    stop = threading.Event()
+
+    def produce(thread_events, started):
+        """Отправляет события в интерфейс по расписанию, как воркер менеджера загрузок"""
+        for event in thread_events:
+            delay = started + event[0] / args.speed - time.perf_counter()
+            if delay > 0 and stop.wait(delay) or stop.is_set():
+                return
+            lateness.append(max(-delay, 0.0))
+            download_id, kind = ids[event[1]], event[2]
+            call_started = time.perf_counter()
+            if kind == 'progress':
+                progress, speed, status, filename = event[3:]
+                manager.throughput.update(download_id, speed * 1024)
+                app.update_progress(download_id, progress, speed, status, filename)
+            else:
+                manager.throughput.finish(download_id)
+                app.download_completed(download_id, *event[3:])
+            call_times.append(time.perf_counter() - call_started)
+
+    frame_ms = max(1, round(1000 / args.fps))
+
+    def tick(expected):
+        """Кадр цикла событий: опоздание и число целиком пропущенных кадров"""
+        now = time.perf_counter()
+        late = max(now - expected, 0.0)
+        frame_lags.append(late)
+        state['frames'] += 1
+        state['dropped'] += int(late * 1000 // frame_ms)
+        if state['running']:
+            app.root.after(frame_ms, tick, time.perf_counter() + frame_ms / 1000)
+
+    producers = []
+
+    def start():
+        started = time.perf_counter()
+        state['cpu'], state['started'] = time.process_time(), started
+        for name, thread_events in traces.items():
+            producer = threading.Thread(target=produce, args=(thread_events, started), name=name, daemon=True)
+            producer.start()
+            producers.append(producer)
+        app.root.after(frame_ms, tick, time.perf_counter() + frame_ms / 1000)
+        app.root.after(200, check_done)
+
+    def check_done():
+        if any(producer.is_alive() for producer in producers):
+            app.root.after(200, check_done)
+            return
+        state['elapsed'] = time.perf_counter() - state['started']
+        state['cpu'] = time.process_time() - state['cpu']
+        state['running'] = False
+        app.root.quit()
+
+    # Первые кадры окна (отрисовка таблицы) в замер не входят
+    app.root.after(500, start)
+    try:
+        app.root.mainloop()
+    except KeyboardInterrupt:
+        stop.set()
+        raise
+    finally:
+        stop.set()
+        app.watchdog.stop()
+        app.thumbnails.close()
+        app.root.destroy()
+        if display is not None:
+            display.stop()
+        os.chdir(project_dir)
+        tmp.cleanup()
+
+    events, elapsed = len(call_times), state['elapsed']
+    print(f"Задач {len(ids)}, потоков {len(traces)}, событий {events} за {elapsed:.1f} с: "
+          f"{events / elapsed:.0f} в секунду (по расписанию {target_rate:.0f})")
+    _report("Вызов обработчика из потока", call_times)
+    _report("Опоздание событий от расписания", lateness)
+    _report(f"Задержка кадра ({args.fps} кадров/с)", frame_lags)
+    lags_ms = sorted(lag * 1000 for lag in frame_lags)
+    print(f"Кадров {state['frames']}, пропущено {state['dropped']}; задержка кадра p95 "
+          f"{lags_ms[int(len(lags_ms) * 0.95)]:.1f} мс, p99 {lags_ms[int(len(lags_ms) * 0.99)]:.1f} мс")
+    print(f"CPU процесса: {state['cpu'] / max(events, 1) * 1e6:.0f} мкс на событие, "
+          f"{state['cpu'] / elapsed:.0%} одного ядра")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки Video Downloader Pro")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ydl_setup = subparsers.add_parser('ydl-setup', help="Накладные расходы на подготовку YoutubeDL для задачи")
+    ydl_setup.add_argument('--jobs', type=int, default=200, help="Количество задач")
+    ydl_setup.set_defaults(func=bench_ydl_setup)
+
+    logging_bench = subparsers.add_parser('logging', help="Стоимость логирования в цикле загрузки")
+    logging_bench.add_argument('--iterations', type=int, default=500, help="Количество попыток загрузки")
+    logging_bench.add_argument('--progress', type=int, default=50, help="Событий прогресса на попытку")
+    logging_bench.add_argument('--level', choices=('DEBUG', 'INFO'), default='DEBUG',
+                               help="Уровень обоих логгеров при сравнении")
+    logging_bench.set_defaults(func=bench_logging)
+
+    history_bench = subparsers.add_parser('history', help="Поиск по истории загрузок")
+    history_bench.add_argument('--rows', type=int, default=200000, help="Размер синтетической истории")
+    history_bench.add_argument('--repeat', type=int, default=50, help="Повторов каждого запроса")
+    history_bench.set_defaults(func=bench_history)
+
+    hls_bench = subparsers.add_parser('hls', help="Параллельная загрузка фрагментов HLS на локальном сервере")
+    hls_bench.add_argument('--segments', type=int, default=120, help="Количество фрагментов")
+    hls_bench.add_argument('--segment-kb', type=int, default=256, help="Размер фрагмента, КБ")
+    hls_bench.add_argument('--latency', type=int, default=40, help="Задержка ответа на фрагмент, мс")
+    hls_bench.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8], help="Значения параллельности")
+    hls_bench.add_argument('--repeat', type=int, default=3, help="Повторов каждого варианта")
+    hls_bench.set_defaults(func=bench_hls)
+
+    sync_bench = subparsers.add_parser('sync-archive', help="Проверка принадлежности архиву синхронизации каналов")
+    sync_bench.add_argument('--entries', type=int, default=1000000, help="Записей в архиве")
+    sync_bench.add_argument('--lookups', type=int, default=20000, help="Проверок каждого вида")
+    sync_bench.set_defaults(func=bench_sync_archive)
+
+    gui_bench = subparsers.add_parser(
+        'gui', help="Сколько событий прогресса успевает показать интерфейс (нужен дисплей, например xvfb-run)"
+    )
+    gui_bench.add_argument('--jobs', type=int, default=200, help="Одновременных синтетических загрузок")
+    gui_bench.add_argument('--rate', type=float, default=10, help="Событий прогресса в секунду на загрузку")
+    gui_bench.add_argument('--duration', type=float, default=20, help="Длительность синтетической загрузки, с")
+    gui_bench.add_argument('--threads', type=int, help="Потоков-отправителей (по умолчанию - воркеров профиля)")
+    gui_bench.add_argument('--replay', metavar='FILE', help="Воспроизвести запись (app.py --record-trace FILE)")
+    gui_bench.add_argument('--speed', type=float, default=1.0, help="Ускорение воспроизведения записи")
+    gui_bench.add_argument('--fps', type=int, default=60, help="Частота кадров для подсчета пропущенных")
+    gui_bench.set_defaults(func=bench_gui)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
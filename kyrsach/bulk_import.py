@@ -0,0 +1,127 @@
+﻿import logging
+import queue
+import threading
+
+from preflight import DEAD, UNKNOWN, resolved_url
+from url_validator import URLValidator
+
+logger = logging.getLogger(__name__)
+
+
+def iter_file_lines(path):
+    """Построчно читает список ссылок из файла, не загружая его в память целиком"""
+    with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+        yield from f
+
+
+def iter_text_lines(text):
+    """Построчно разбирает вставленный текст"""
+    yield from text.splitlines()
+
+
+class BulkImporter:
+    """Потоковый импорт больших списков ссылок.
+
+    Строки проходят валидацию, определение сервиса и удаление дубликатов
+    в фоновом потоке; GUI забирает готовые пачки через poll() и вставляет
+    их в таблицу порциями, не блокируя цикл событий.
+    """
+
+    def __init__(self, lines, clean_url, known_urls=(), chunk_size=500, preflight=False):
+        self.lines = lines
+        self.clean_url = clean_url
+        self.chunk_size = chunk_size
+        self.preflight = preflight
+        self.stats = {'lines': 0, 'accepted': 0, 'invalid': 0, 'duplicates': 0, 'unsupported': 0, 'dead': 0,
+                      'unchecked': 0}
+        self.done = False
+        self._seen = {URLValidator.canonicalize_url(url) for url in known_urls}
+        self._chunks = queue.Queue(maxsize=8)
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='bulk-import', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def _run(self):
+        chunk = []
+        try:
+            for line in self.lines:
+                if self._cancel_event.is_set():
+                    break
+                self.stats['lines'] += 1
+
+                url = self.clean_url(line)
+                if not url or url.startswith('#'):
+                    continue
+                if not URLValidator.validate_url(url):
+                    self.stats['invalid'] += 1
+                    continue
+                # Разные записи одной ссылки (youtu.be, shorts, метки отслеживания) - дубликаты
+                canonical = URLValidator.canonicalize_url(url)
+                if canonical in self._seen:
+                    self.stats['duplicates'] += 1
+                    continue
+                self._seen.add(canonical)
+
+                service_name, service_info = URLValidator.detect_service(url)
+                if not service_info:
+                    self.stats['unsupported'] += 1
+                    continue
+
+                chunk.append((url, service_name))
+                if len(chunk) >= self.chunk_size:
+                    self._emit(chunk)
+                    chunk = []
+
+            if chunk and not self._cancel_event.is_set():
+                self._emit(chunk)
+        except Exception as e:
+            logger.error("Ошибка импорта списка ссылок: %s", e)
+        finally:
+            self.done = True
+
+    def _emit(self, chunk):
+        """Отправляет пачку в GUI, при необходимости отсеяв недоступные ссылки.
+
+        Отсеиваются только точно недоступные ссылки; ссылки, которые не удалось
+        проверить (429, 403, 5xx, таймаут), остаются - их судьба решится в yt-dlp.
+        Короткие ссылки заменяются конечным адресом.
+        """
+        if self.preflight:
+            results = URLValidator.preflight_urls(url for url, _ in chunk)
+            live = []
+            for url, service in chunk:
+                result = results[url]
+                if result['state'] == DEAD:
+                    self.stats['dead'] += 1
+                    continue
+                if result['state'] == UNKNOWN:
+                    self.stats['unchecked'] += 1
+                live.append((resolved_url(result), service))
+            chunk = live
+
+        self.stats['accepted'] += len(chunk)
+        # Очередь ограничена: если GUI не успевает, чтение файла приостанавливается
+        while not self._cancel_event.is_set():
+            try:
+                self._chunks.put(chunk, timeout=0.2)
+                return
+            except queue.Full:
+                continue
+
+    def poll(self):
+        """Возвращает следующую готовую пачку или None"""
+        try:
+            return self._chunks.get_nowait()
+        except queue.Empty:
+            return None
+
+    @property
+    def finished(self):
+        """Все строки обработаны и все пачки забраны"""
+        return self.done and self._chunks.empty()
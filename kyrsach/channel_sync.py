@@ -0,0 +1,395 @@
+﻿import argparse
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+import yt_dlp
+
+from config import AppConfig
+from log_setup import ytdlp_logger
+
+logger = logging.getLogger(__name__)
+
+# Заголовок файла фильтра: сигнатура, емкость, размер в битах, число хэшей, число элементов
+BLOOM_MAGIC = b'VDBLOOM2'
+BLOOM_HEADER = struct.Struct('<8sQQQQ')
+
+# Источники, которые yt-dlp отдает от новых записей к старым: вкладки каналов YouTube
+# (ID канала UC..., плейлист загрузок UU...) и ленты пользователей сервисов
+NEWEST_FIRST_EXTRACTORS = {'TikTokUser', 'InstagramUser', 'SoundcloudUser', 'TwitchVideos', 'VimeoUser'}
+YOUTUBE_CHANNEL_PREFIXES = ('UC', 'UU')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    url TEXT NOT NULL,
+    title TEXT,
+    last_sync REAL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    source_id INTEGER NOT NULL,
+    entry TEXT NOT NULL,
+    PRIMARY KEY (source_id, entry)
+) WITHOUT ROWID;
+"""
+
+
+class BloomFilter:
+    """Фильтр Блума: быстрый ответ «точно нет» без обращения к диску.
+
+    Позиции битов получаются двойным хэшированием одного blake2b.
+    При capacity элементов доля ложных срабатываний около error_rate.
+    """
+
+    def __init__(self, capacity, error_rate=AppConfig.SYNC_BLOOM_ERROR_RATE):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def save(self, path):
+        """Записывает фильтр атомарно (через временный файл)"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(BLOOM_HEADER.pack(BLOOM_MAGIC, self.capacity, self.size, self.hashes, self.count))
+            f.write(self.bits)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Читает фильтр с параметрами из заголовка файла; None, если файла нет или он поврежден"""
+        try:
+            with open(path, 'rb') as f:
+                magic, capacity, size, hashes, count = BLOOM_HEADER.unpack(f.read(BLOOM_HEADER.size))
+                bits = bytearray(f.read())
+        except (OSError, struct.error):
+            return None
+        if magic != BLOOM_MAGIC or not capacity or not size or not hashes or len(bits) != (size + 7) // 8:
+            return None
+        bloom = cls.__new__(cls)
+        bloom.capacity = capacity
+        bloom.error_rate = None
+        bloom.size = size
+        bloom.hashes = hashes
+        bloom.bits = bits
+        bloom.count = count
+        return bloom
+
+
+class SyncArchive:
+    """Архив уже скачанных записей каналов и плейлистов.
+
+    Записи хранятся компактно в SQLite (ID источника + ID записи, без rowid),
+    перед базой стоит фильтр Блума: для новых записей проверка не трогает
+    диск, для старых подтверждается одним запросом по первичному ключу.
+    Фильтр сохраняется рядом с базой вместе со своими емкостью и числом
+    хэшей и перестраивается, только если число записей в нем и в базе
+    разошлось (например, после аварийного завершения) или архив перерос
+    емкость фильтра; capacity задает емкость нового фильтра.
+    """
+
+    def __init__(self, path=AppConfig.SYNC_ARCHIVE_DB, bloom_path=AppConfig.SYNC_BLOOM_FILE,
+                 capacity=AppConfig.SYNC_BLOOM_CAPACITY, error_rate=AppConfig.SYNC_BLOOM_ERROR_RATE):
+        self.path = path
+        self.bloom_path = bloom_path
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._source_ids = {}
+        self._dirty = False
+
+        total = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        self.bloom = BloomFilter.load(bloom_path)
+        if self.bloom is None or self.bloom.count != total or total > self.bloom.capacity:
+            self._rebuild(max(capacity, total * 2))
+
+    def _rebuild(self, capacity):
+        """Перестраивает фильтр по базе"""
+        started = time.perf_counter()
+        bloom = BloomFilter(capacity, self.error_rate)
+        cursor = self._conn.execute(
+            "SELECT s.key, e.entry FROM entries e JOIN sources s ON s.id = e.source_id"
+        )
+        for source_key, entry in cursor:
+            bloom.add(self._bloom_key(source_key, entry))
+        self.bloom = bloom
+        self._dirty = True
+        logger.info("Фильтр архива синхронизации перестроен: %d записей за %.2f с",
+                    bloom.count, time.perf_counter() - started)
+
+    @staticmethod
+    def _bloom_key(source_key, entry):
+        return f"{source_key}\t{entry}"
+
+    def _source_id(self, source_key, url=None, title=None):
+        source_id = self._source_ids.get(source_key)
+        if source_id is not None:
+            return source_id
+        row = self._conn.execute("SELECT id FROM sources WHERE key = ?", (source_key,)).fetchone()
+        if row is None:
+            if url is None:
+                return None
+            with self._conn:
+                cursor = self._conn.execute(
+                    "INSERT INTO sources (key, url, title) VALUES (?, ?, ?)", (source_key, url, title)
+                )
+            source_id = cursor.lastrowid
+        else:
+            source_id = row[0]
+        self._source_ids[source_key] = source_id
+        return source_id
+
+    def register_source(self, source_key, url, title=None):
+        """Запоминает источник (для повторной синхронизации всех каналов)"""
+        with self._lock:
+            self._source_id(source_key, url, title)
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE sources SET url = ?, title = COALESCE(?, title), last_sync = ? WHERE key = ?",
+                    (url, title, time.time(), source_key)
+                )
+
+    def __contains__(self, item):
+        source_key, entry = item
+        if self._bloom_key(source_key, entry) not in self.bloom:
+            return False
+        with self._lock:
+            source_id = self._source_id(source_key)
+            if source_id is None:
+                return False
+            return self._conn.execute(
+                "SELECT 1 FROM entries WHERE source_id = ? AND entry = ?", (source_id, entry)
+            ).fetchone() is not None
+
+    def add(self, source_key, entry):
+        """Отмечает запись источника как скачанную"""
+        with self._lock:
+            source_id = self._source_id(source_key, source_key)
+            with self._conn:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO entries (source_id, entry) VALUES (?, ?)", (source_id, entry)
+                )
+            if cursor.rowcount:
+                self.bloom.add(self._bloom_key(source_key, entry))
+                self._dirty = True
+                if self.bloom.count > self.bloom.capacity:
+                    self._rebuild(self.bloom.capacity * 2)
+
+    def sources(self):
+        """Возвращает известные источники: (key, url, title, last_sync)"""
+        with self._lock:
+            return self._conn.execute("SELECT key, url, title, last_sync FROM sources ORDER BY id").fetchall()
+
+    def save(self):
+        """Сохраняет фильтр на диск, если он менялся"""
+        with self._lock:
+            if self._dirty:
+                self.bloom.save(self.bloom_path)
+                self._dirty = False
+
+    def close(self):
+        self.save()
+        with self._lock:
+            self._conn.close()
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_sync_archive():
+    """Возвращает общий архив синхронизации приложения"""
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = SyncArchive()
+        return _archive
+
+
+def save_sync_archive():
+    """Сохраняет фильтр общего архива, если архив открывался"""
+    with _archive_lock:
+        archive = _archive
+    if archive is not None:
+        try:
+            archive.save()
+        except OSError as e:
+            logger.warning("Не удалось сохранить фильтр архива синхронизации: %s", e)
+
+
+def _resolve_playlist(ydl, url):
+    """Извлекает плейлист без обработки записей: entries остаются ленивыми и листаются по мере чтения"""
+    result = ydl.extract_info(url, download=False, process=False)
+    # Ссылка на канал может перенаправлять на вкладку с видео
+    for _ in range(5):
+        if result.get('_type') not in ('url', 'url_transparent'):
+            break
+        result = ydl.extract_info(result['url'], ie_key=result.get('ie_key'), download=False, process=False)
+    if result.get('_type') != 'playlist':
+        raise ValueError("Ссылка не ведет на канал или плейлист")
+    return result
+
+
+def _newest_first(playlist):
+    """Известно ли, что источник отдает записи от новых к старым"""
+    extractor = playlist.get('extractor_key')
+    if extractor == 'YoutubeTab':
+        # Обычные плейлисты YouTube часто идут от старых к новым и пополняются в конце
+        return str(playlist.get('id') or '').startswith(YOUTUBE_CHANNEL_PREFIXES)
+    return extractor in NEWEST_FIRST_EXTRACTORS
+
+
+def scan_source(url, archive, stop_after_seen=AppConfig.SYNC_STOP_AFTER_SEEN, skip=()):
+    """
+    Находит новые записи канала или плейлиста.
+
+    Ленты каналов идут от новых записей к старым: после stop_after_seen подряд
+    уже скачанных записей чтение прекращается и следующие страницы не
+    запрашиваются. Остальные плейлисты могут пополняться в конце, поэтому
+    просматриваются целиком (плоско, без извлечения самих видео).
+
+    Args:
+        url (str): ссылка на канал или плейлист
+        archive (SyncArchive): архив скачанных записей
+        stop_after_seen (int): сколько известных записей подряд означает, что дальше все старое
+        skip (set): ключи (источник, запись), которые уже стоят в очереди
+
+    Returns:
+        dict: source (ключ источника), title, entries (новые записи: у лент каналов от старых
+            к новым, у плейлистов в их порядке; url, title, key) и статистика new/listed/seen/stopped_early
+    """
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'logger': ytdlp_logger,
+        'extract_flat': 'in_playlist',
+        'lazy_playlist': True,
+        'skip_download': True,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        playlist = _resolve_playlist(ydl, url)
+        source_key = f"{playlist.get('extractor_key', 'generic').lower()} {playlist.get('id')}"
+        archive.register_source(source_key, url, playlist.get('title'))
+        newest_first = _newest_first(playlist)
+
+        new_entries = []
+        listed = seen_run = seen = 0
+        stopped_early = False
+        for entry in playlist.get('entries') or []:
+            if not entry or not entry.get('id'):
+                continue
+            listed += 1
+            entry_key = f"{(entry.get('ie_key') or playlist.get('extractor_key', 'generic')).lower()} {entry['id']}"
+            if (source_key, entry_key) in archive:
+                seen += 1
+                seen_run += 1
+                if newest_first and seen_run >= stop_after_seen:
+                    stopped_early = True
+                    break
+                continue
+            seen_run = 0
+            if (source_key, entry_key) in skip:
+                continue
+            entry_url = entry.get('url') or entry.get('webpage_url')
+            if entry_url:
+                new_entries.append({'url': entry_url, 'title': entry.get('title'), 'key': (source_key, entry_key)})
+
+    archive.save()
+    if newest_first:
+        new_entries.reverse()
+    logger.info("Синхронизация %s: просмотрено %d, уже скачано %d, новых %d%s", url, listed, seen,
+                len(new_entries), ", остановлено на известных записях" if stopped_early else "")
+    return {
+        'source': source_key,
+        'title': playlist.get('title'),
+        'entries': new_entries,
+        'new': len(new_entries),
+        'listed': listed,
+        'seen': seen,
+        'stopped_early': stopped_early,
+    }
+
+
+def main():
+    """CLI: синхронизация каналов без GUI (например, по расписанию)"""
+    from download_manager import DownloadManager
+    from log_setup import setup_logging, shutdown_logging
+    from perf_profile import get_profile
+
+    parser = argparse.ArgumentParser(description="Инкрементальная синхронизация каналов и плейлистов")
+    parser.add_argument('urls', nargs='*', help="Ссылки на каналы или плейлисты")
+    parser.add_argument('--all', action='store_true', help="Синхронизировать все ранее добавленные источники")
+    parser.add_argument('--type', default="Видео (MP4)", help="Тип загрузки")
+    parser.add_argument('--quality', default="⚡ Автоматически", help="Качество (ключ video_qualities профиля)")
+    parser.add_argument('--path', default=AppConfig.DOWNLOAD_FOLDER, help="Папка сохранения")
+    parser.add_argument('--stop-after', type=int, default=AppConfig.SYNC_STOP_AFTER_SEEN,
+                        help="Сколько уже скачанных записей подряд завершает просмотр")
+    parser.add_argument('--dry-run', action='store_true', help="Только показать новые записи")
+    args = parser.parse_args()
+
+    setup_logging(get_profile().section('logging'))
+    archive = get_sync_archive()
+    urls = list(args.urls)
+    if args.all:
+        urls.extend(url for _, url, _, _ in archive.sources())
+    if not urls:
+        parser.error("нет ссылок (укажите ссылки или --all)")
+
+    manager = None
+    finished = threading.Semaphore(0)
+    queued = 0
+    try:
+        for url in dict.fromkeys(urls):
+            try:
+                result = scan_source(url, archive, args.stop_after)
+            except Exception as e:
+                logger.error("Не удалось синхронизировать %s: %s", url, e)
+                continue
+            print(f"{result['title'] or url}: новых {len(result['entries'])}")
+            if args.dry_run:
+                for entry in result['entries']:
+                    print(f"  {entry['url']}  {entry['title'] or ''}")
+                continue
+            if manager is None:
+                manager = DownloadManager(completion_callback=lambda *_: finished.release())
+            for entry in result['entries']:
+                manager.add_download(entry['url'], args.type, args.quality, args.path, archive_key=entry['key'])
+                queued += 1
+
+        for _ in range(queued):
+            finished.acquire()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if manager is not None:
+            manager.stop_all()
+        archive.close()
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
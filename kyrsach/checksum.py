@@ -0,0 +1,128 @@
+﻿import hashlib
+import logging
+import os
+import threading
+
+from config import AppConfig
+
+logger = logging.getLogger(__name__)
+
+# Дочитывать растущий файл не чаще, чем по столько байт (кроме завершения файла)
+FOLLOW_STEP = 1024 * 1024
+READ_BUFFER = 1024 * 1024
+
+
+class StreamingChecksum:
+    """Хэш файла, считаемый по мере того, как байты проходят через наш код"""
+
+    def __init__(self, algorithm=AppConfig.CHECKSUM_ALGORITHM):
+        self.algorithm = algorithm
+        self._hash = hashlib.new(algorithm)
+        self.size = 0
+
+    def update(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+
+    def value(self):
+        """Контрольная сумма в виде 'алгоритм:hex'"""
+        return f"{self.algorithm}:{self._hash.hexdigest()}"
+
+
+def hash_file(path, algorithm=AppConfig.CHECKSUM_ALGORITHM, buffer_size=READ_BUFFER):
+    """Считает контрольную сумму файла отдельным чтением (когда байты прошли мимо нас, например через ffmpeg)"""
+    checksum = StreamingChecksum(algorithm)
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(buffer_size)
+            if not data:
+                break
+            checksum.update(data)
+    return checksum
+
+
+class FileChecksums:
+    """Контрольные суммы файлов одной задачи.
+
+    Файлы, которые пишет загрузчик yt-dlp, дочитываются с хвоста по событиям
+    прогресса, пока только что записанные байты еще в кэше ОС; файлы, которые
+    пишем мы сами, хэшируются прямо при записи. Переименование (.part ->
+    готовый файл, перенос из промежуточной папки) сохраняет сумму. Файл
+    не держится открытым между событиями, чтобы не мешать переименованию в Windows.
+    """
+
+    def __init__(self, algorithm=AppConfig.CHECKSUM_ALGORITHM):
+        self.algorithm = algorithm
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def writer(self, path):
+        """Возвращает сумму для файла, который будет записан нашим кодом"""
+        checksum = StreamingChecksum(self.algorithm)
+        with self._lock:
+            self._files[os.path.abspath(path)] = checksum
+        return checksum
+
+    def follow(self, path, final=False):
+        """Дочитывает в хэш байты, дописанные в файл с прошлого вызова"""
+        key = os.path.abspath(path)
+        try:
+            size = os.path.getsize(key)
+        except OSError:
+            return
+        with self._lock:
+            checksum = self._files.get(key)
+            if checksum is None:
+                checksum = self._files[key] = StreamingChecksum(self.algorithm)
+            if size < checksum.size:
+                # Файл перезаписан с начала - считаем заново
+                checksum = self._files[key] = StreamingChecksum(self.algorithm)
+            if size - checksum.size < (1 if final else FOLLOW_STEP):
+                return
+            try:
+                with open(key, 'rb') as f:
+                    f.seek(checksum.size)
+                    remaining = size - checksum.size
+                    while remaining > 0:
+                        data = f.read(min(READ_BUFFER, remaining))
+                        if not data:
+                            break
+                        checksum.update(data)
+                        remaining -= len(data)
+            except OSError as e:
+                logger.debug("Не удалось дочитать %s для контрольной суммы: %s", key, e)
+
+    def rename(self, src, dst):
+        """Переносит сумму на новое имя файла"""
+        with self._lock:
+            checksum = self._files.pop(os.path.abspath(src), None)
+            if checksum is not None:
+                self._files[os.path.abspath(dst)] = checksum
+
+    def get(self, path):
+        """Возвращает сумму, если она покрывает файл целиком, иначе None"""
+        key = os.path.abspath(path)
+        with self._lock:
+            checksum = self._files.get(key)
+        if checksum is None:
+            return None
+        try:
+            size = os.path.getsize(key)
+        except OSError:
+            return None
+        return checksum if checksum.size == size else None
+
+    def finalize(self, path):
+        """
+        Возвращает контрольную сумму готового файла.
+
+        Если байты файла прошли мимо нас (файл собран ffmpeg), файл читается
+        один раз сразу после записи, пока он в кэше ОС.
+        """
+        checksum = self.get(path)
+        if checksum is None:
+            logger.debug("Контрольная сумма %s считается отдельным чтением", path)
+            checksum = hash_file(path, self.algorithm)
+            with self._lock:
+                self._files[os.path.abspath(path)] = checksum
+        return checksum.value()
@@ -1,6 +1,8 @@
 ﻿import tkinter as tk
 from tkinter import ttk
 import math
+import os
+import tempfile
 
 
 class AppConfig:
@@ -8,6 +10,80 @@ class AppConfig:
     VERSION = "2.1.0"
     AUTHOR = "Курсовая работа 2025"
     DOWNLOAD_FOLDER = "downloads"
+    # Промежуточная папка для незавершенных файлов (лучше на локальном SSD/tmpfs); None - писать сразу в папку вывода
+    STAGING_FOLDER = os.path.join(tempfile.gettempdir(), "video_downloader_staging")
+    # Профиль производительности (JSON или TOML), перечитывается при изменении
+    PERFORMANCE_PROFILE = "performance.json"
+
+    # Логирование: файлы с ротацией и уровни по модулям ('' - корневой логгер)
+    LOG_FILE = "video_downloader.log"
+    YTDLP_LOG_FILE = "yt_dlp.log"
+    LOG_MAX_BYTES = 5 * 1024 * 1024
+    LOG_BACKUP_COUNT = 3
+    LOG_LEVELS = {
+        '': 'INFO',
+        'url_validator': 'WARNING',
+        'yt_dlp': 'DEBUG'
+    }
+
+    # Профилирование: папка для профилей и файл управления для CLI (python profiling.py on/off)
+    PROFILE_FOLDER = "profiles"
+    PROFILING_CONTROL_FILE = "profiling.json"
+    PROFILING_POLL_MS = 2000
+
+    # Сторож цикла событий Tk: период пульса, порог зависания и число снимков стека на одно зависание
+    WATCHDOG_INTERVAL_MS = 100
+    WATCHDOG_LAG_THRESHOLD_MS = 250
+    WATCHDOG_MAX_STACKS = 3
+
+    # История загрузок: в таблице остаются последние завершенные строки, остальные - только в базе
+    HISTORY_DB = "history.sqlite3"
+    HISTORY_RETAIN_ROWS = 200
+    HISTORY_RETAIN_SECONDS = 6 * 60 * 60
+    HISTORY_PAGE_SIZE = 100
+    HISTORY_TRIM_INTERVAL_MS = 60 * 1000
+    HISTORY_SEARCH_LIMIT = 500
+
+    # Распределенный режим (worker.py): общая очередь SQLite, аренда задачи и период пульса воркера
+    JOB_QUEUE_DB = "jobs.sqlite3"
+    JOB_LEASE_SECONDS = 120
+    JOB_HEARTBEAT_SECONDS = 15
+    JOB_POLL_SECONDS = 2
+    JOB_MAX_ATTEMPTS = 3
+
+    # Синхронизация каналов: архив скачанных записей, фильтр Блума перед ним и условие остановки просмотра
+    SYNC_ARCHIVE_DB = "sync_archive.sqlite3"
+    SYNC_BLOOM_FILE = "sync_archive.bloom"
+    SYNC_BLOOM_CAPACITY = 1_000_000
+    SYNC_BLOOM_ERROR_RATE = 0.001
+    SYNC_STOP_AFTER_SEEN = 5
+
+    # Автонастройка параллельных загрузок по сервисам: файл состояния и число хранимых решений
+    AUTOTUNE_STATE_FILE = "autotune.json"
+    AUTOTUNE_HISTORY = 50
+
+    # Сводная скорость и ETA очереди: история скорости задачи (ячеек по SPEED_SAMPLE_SECONDS),
+    # постоянная времени сглаживания, ширина спарклайна в строке и период обновления панели
+    SPEED_HISTORY_SIZE = 60
+    SPEED_SAMPLE_SECONDS = 1.0
+    SPEED_EWMA_SECONDS = 5.0
+    SPARKLINE_WIDTH = 16
+    THROUGHPUT_REFRESH_MS = 1000
+
+    # Контрольная сумма готовых файлов (любой алгоритм hashlib, например 'sha256' или 'blake2b')
+    CHECKSUM_ALGORITHM = "sha256"
+
+    # Превью в таблице загрузок (нужен Pillow): размер, кэш в памяти и на диске
+    THUMBNAIL_SIZE = (48, 27)
+    THUMBNAIL_CACHE = "thumbnail_cache"
+    THUMBNAIL_MEMORY_MB = 8
+    THUMBNAIL_DISK_MB = 100
+    THUMBNAIL_TK_IMAGES = 1024
+
+    # Пакетный импорт ссылок
+    BULK_INSERT_BATCH = 200
+    BULK_IMPORT_INTERVAL_MS = 15
+    BULK_IMPORT_PREFLIGHT = True
     
     # Обновленная цветовая схема с градиентами
     COLORS = {
@@ -0,0 +1,138 @@
+﻿import logging
+import os
+import shutil
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientDiskSpace(Exception):
+    """Задача не поместится на диск даже без других резервов"""
+
+
+def estimate_output_size(info):
+    """Оценивает размер итогового файла по filesize/filesize_approx (0, если неизвестен)"""
+    if not info:
+        return 0
+    formats = info.get('requested_formats') or [info]
+    return sum(fmt.get('filesize') or fmt.get('filesize_approx') or 0 for fmt in formats)
+
+
+def estimate_job_size(info, download_type):
+    """
+    Оценивает место на диске, необходимое задаче во время загрузки и обработки.
+
+    Args:
+        info (dict): info_dict после извлечения
+        download_type (str): тип загрузки
+
+    Returns:
+        int: оценка в байтах (0, если размер неизвестен)
+    """
+    size = estimate_output_size(info)
+
+    if download_type == 'Только аудио (MP3)':
+        return size
+    # Ремукс/перекодирование временно держат на диске и исходник, и результат
+    return size * 2
+
+
+def preallocate(fileobj, size):
+    """Заранее выделяет место под файл, чтобы уменьшить фрагментацию (только POSIX)"""
+    if not size or not hasattr(os, 'posix_fallocate'):
+        return False
+    try:
+        os.posix_fallocate(fileobj.fileno(), 0, size)
+        return True
+    except OSError as e:
+        logger.debug("Не удалось выделить место под файл: %s", e)
+        return False
+
+
+class DiskSpaceGuard:
+    """Контроль допуска задач по свободному месту на целевом томе.
+
+    Перед загрузкой задача резервирует оценку своего размера. Если с учетом
+    уже зарезервированного места на томе останется меньше запаса,
+    задача ждет, пока другие задачи не освободят резерв. Записанные задачей
+    байты уже вычтены из свободного места, поэтому в резерве учитывается
+    только остаток: задача сообщает записанное через written().
+    """
+
+    def __init__(self, free_margin_bytes, poll_interval=2.0):
+        self.free_margin_bytes = free_margin_bytes
+        self.poll_interval = poll_interval
+        self._reservations = {}
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def _volume_key(path):
+        return os.stat(path).st_dev
+
+    def _reserved_on(self, volume):
+        """Сколько еще займут на томе задачи с резервом: оценка минус уже записанное"""
+        return sum(max(size - written, 0) for vol, size, written in self._reservations.values() if vol == volume)
+
+    def reserve(self, job_id, path, size_bytes, should_stop=None, on_wait=None):
+        """
+        Резервирует место под задачу, ожидая освобождения при необходимости.
+
+        Args:
+            job_id (str): ID задачи
+            path (str): целевая папка
+            size_bytes (int): оценка размера
+            should_stop (callable): прерывает ожидание, если вернул True
+            on_wait (callable): вызывается один раз, когда задача начинает ждать
+
+        Returns:
+            bool: True, если место зарезервировано; False, если ожидание прервано
+        """
+        volume = self._volume_key(path)
+        waiting = False
+
+        while True:
+            with self._condition:
+                free = shutil.disk_usage(path).free
+                if size_bytes + self.free_margin_bytes > free + self._reserved_on(volume):
+                    raise InsufficientDiskSpace(
+                        f"Недостаточно места на диске: нужно {size_bytes // 1024 ** 2} МБ, "
+                        f"свободно {free // 1024 ** 2} МБ"
+                    )
+
+                if free - self._reserved_on(volume) - size_bytes >= self.free_margin_bytes:
+                    self._reservations[job_id] = (volume, size_bytes, 0)
+                    return True
+
+                if should_stop and should_stop():
+                    return False
+                if waiting:
+                    self._condition.wait(self.poll_interval)
+                    continue
+                waiting = True
+                logger.info("Задача %s ждет места на диске (%d МБ)", job_id, size_bytes // 1024 ** 2)
+
+            # Обработчик обновляет интерфейс (а в процессе загрузки пишет в канал) - не под блокировкой,
+            # иначе он задерживает резервирование и освобождение места другими задачами
+            if on_wait:
+                on_wait()
+
+    def written(self, job_id, written_bytes):
+        """
+        Отмечает, сколько байтов задача уже записала в зарезервированное место.
+
+        Значение не уменьшается: у плейлиста счетчик сбрасывается на каждой записи,
+        и резерв лучше оставить с запасом. Ожидающие задачи увидят освободившийся
+        резерв при следующей проверке (раз в poll_interval).
+        """
+        if not written_bytes:
+            return
+        with self._condition:
+            reservation = self._reservations.get(job_id)
+            if reservation is not None and written_bytes > reservation[2]:
+                self._reservations[job_id] = (reservation[0], reservation[1], written_bytes)
+
+    def release(self, job_id):
+        """Снимает резерв задачи и будит ожидающие задачи"""
+        with self._condition:
+            if self._reservations.pop(job_id, None) is not None:
+                self._condition.notify_all()
@@ -1,33 +1,112 @@
 ﻿import threading
 import queue
+import collections
 import os
 import uuid
 from pathlib import Path
-import yt_dlp
 from config import AppConfig
 from url_validator import URLValidator
+from preflight import DEAD, resolved_url
+from ydl_pool import YoutubeDLPool
+from remux import VideoOutputProcessor, TARGET_CONTAINER
+from audio_stream import StreamingAudioExtractor, DownloadStopped
+from disk_space import DiskSpaceGuard, InsufficientDiskSpace, estimate_job_size, estimate_output_size
+from staging import StagingArea
+from prefetch import MetadataPrefetcher
+from perf_profile import get_profile
+from profiling import get_profiler
+from history import get_history, HistoryStore
+from thumbnails import pick_thumbnail_url
+from stream_merge import StreamProgress, download_and_merge, needs_merge
+from process_pool import WorkerProcess, WorkerCrashed
+from checksum import FileChecksums
+from channel_sync import get_sync_archive, save_sync_archive
+from autotune import ConcurrencyTuner, classify_error, SUCCESS
+from throughput import ThroughputMonitor
 import logging
 import time
 import random
 import subprocess
 import sys
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
 class DownloadManager:
-    def __init__(self, progress_callback=None, completion_callback=None):
+    def __init__(self, progress_callback=None, completion_callback=None, start_workers=True):
         self.progress_callback = progress_callback
         self.completion_callback = completion_callback
         self.download_queue = queue.Queue()
         self.active_downloads = {}
         self._stop_event = threading.Event()
+        self.perf = get_profile()
+        self.video_processor = VideoOutputProcessor()
+        self.audio_streamer = StreamingAudioExtractor()
+        self.disk_guard = DiskSpaceGuard(self.perf.get('disk', 'free_margin_mb') * 1024 ** 2)
+        self.staging = StagingArea(AppConfig.STAGING_FOLDER) if AppConfig.STAGING_FOLDER else None
+        self.prefetcher = MetadataPrefetcher()
+        self.profiler = get_profiler()
+        self.history = get_history()
+        # Сглаженная скорость идущих задач для сводной панели и ETA очереди
+        self.throughput = ThroughputMonitor()
+        # Идущие задачи по ключу (каноническая ссылка, тип, качество, папка) и присоединенные к ним ID
+        self._jobs_by_key = {}
+        self._attached = {}
+        self._jobs_lock = threading.Lock()
         Path(AppConfig.DOWNLOAD_FOLDER).mkdir(exist_ok=True)
+        # Внутри процесса загрузки архив синхронизации ведет родительский менеджер
+        self.isolated_child = not start_workers
+        # Лимиты сервисов тоже ведет родительский менеджер: итоги попыток процесс возвращает вместе с задачей
+        self.tuner = None if self.isolated_child else ConcurrencyTuner(self.perf)
+        # Задачи сервисов, упершихся в лимит; возвращаются в очередь, когда у сервиса освобождается место
+        self._parked = collections.defaultdict(collections.deque)
+        self._parked_lock = threading.Lock()
+        if not start_workers:
+            # Менеджер внутри процесса загрузки: задачи по одной передает родительский процесс
+            return
 
         # Проверяем и обновляем yt-dlp при запуске
         self._check_and_update_ytdlp()
 
+        # Набор воркеров, каждый со своим пулом экземпляров YoutubeDL; размер задается профилем
+        self._workers = {}
+        self._workers_lock = threading.Lock()
+        self._apply_profile(self.perf)
+        self.perf.add_listener(self._apply_profile)
+        self.perf.start_watching()
+
+    def _apply_profile(self, profile):
+        """Применяет профиль производительности без перезапуска активных загрузок"""
+        self.disk_guard.free_margin_bytes = profile.get('disk', 'free_margin_mb') * 1024 ** 2
+        self.audio_streamer.chunk_size = profile.get('chunks', 'stream_chunk_size')
+        if self.staging:
+            self.staging.copy_buffer_size = profile.get('chunks', 'copy_buffer_size')
+
+        preflight = URLValidator.get_preflight()
+        preflight.timeout = profile.get('timeouts', 'preflight_timeout')
+        preflight.max_workers = profile.get('concurrency', 'preflight_workers')
+        preflight.per_host_connections = profile.get('concurrency', 'preflight_per_host')
+
+        self._resize_workers()
+        # Лимиты сервисов могли вырасти - отложенные задачи получают освободившиеся места
+        self._wake_parked()
+
+    def _resize_workers(self):
+        """Запускает недостающих воркеров; лишние завершатся после текущей задачи"""
+        with self._workers_lock:
+            for index in range(self.perf.get('concurrency', 'max_parallel_downloads')):
+                worker = self._workers.get(index)
+                if worker is not None and worker.is_alive():
+                    continue
+                worker = threading.Thread(
+                    target=self._worker_loop,
+                    args=(index,),
+                    name=f"download-worker-{index}",
+                    daemon=True
+                )
+                worker.start()
+                self._workers[index] = worker
+
     def _check_and_update_ytdlp(self):
         """Проверяет и обновляет yt-dlp до последней версии"""
         try:
@@ -37,17 +116,24 @@ class DownloadManager:
             if result.returncode == 0:
                 logger.info("yt-dlp успешно обновлен")
             else:
-                logger.warning(f"Не удалось обновить yt-dlp: {result.stderr}")
+                logger.warning("Не удалось обновить yt-dlp: %s", result.stderr)
         except Exception as e:
-            logger.warning(f"Ошибка при обновлении yt-dlp: {e}")
+            logger.warning("Ошибка при обновлении yt-dlp: %s", e)
 
     def start_download(self, url: str, output_path: str, is_audio: bool, quality: str):
         """Запускает новую загрузку и возвращает её ID"""
         download_type = "Только аудио (MP3)" if is_audio else "Видео (MP4)"
         return self.add_download(url, download_type, quality, output_path)
 
-    def add_download(self, url: str, download_type: str, quality: str, custom_path: str = None):
-        """Добавляет новую загрузку"""
+    def add_download(self, url: str, download_type: str, quality: str, custom_path: str = None,
+                     archive_key: tuple = None):
+        """
+        Добавляет новую загрузку; archive_key (источник, запись) отмечается в архиве синхронизации после успеха.
+
+        Если то же видео (по канонической ссылке) с теми же типом, качеством и папкой уже
+        в очереди или качается, новая загрузка не создается: возвращенный ID присоединяется
+        к идущей задаче и получает ее прогресс и завершение.
+        """
         download_id = str(uuid.uuid4())[:8]
 
         service_name, service_info = URLValidator.detect_service(url)
@@ -62,21 +148,112 @@ class DownloadManager:
             'progress': 0,
             'speed': 0.0,
             'eta': '',
+            'downloaded_bytes': 0,
+            'total_bytes': None,
             'filename': '',
             'service': service_name,
-            'service_icon': service_info['icon'] if service_info else '🌐'
+            'service_icon': service_info['icon'] if service_info else '🌐',
+            'video_path': None,
+            'cpu_saved': 0.0,
+            'title': None,
+            'error': None,
+            'size': None,
+            'added_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'thumbnail': None,
+            'streams': None,
+            'checksums': None,
+            'checksum': None,
+            'files': [],
+            'archive_key': archive_key,
+            # Итоги попыток для автонастройки лимитов: исход, байты, длительность
+            'attempts': [],
+            # ID, которым уходят уведомления: сама задача и присоединенные к ней повторные ссылки
+            'subscribers': [download_id]
         }
 
-        self.active_downloads[download_id] = download_info
+        key = self._job_key(download_info)
+        with self._jobs_lock:
+            existing = self._jobs_by_key.get(key)
+            if existing is not None and existing['finished_at'] is None and existing['subscribers']:
+                existing['subscribers'].append(download_id)
+                existing['archive_key'] = existing['archive_key'] or archive_key
+                self._attached[download_id] = existing
+                logger.info("Ссылка %s уже загружается задачей %s, %s присоединена к ней",
+                            url, existing['id'], download_id)
+                return download_id
+            self._jobs_by_key[key] = download_info
+            self.active_downloads[download_id] = download_info
+
+        self.download_queue.put(download_info)
 
-        thread = threading.Thread(
-            target=self._download_worker,
-            args=(download_info,),
-            daemon=True
+        return download_id
+
+    @staticmethod
+    def _job_key(download_info):
+        """Ключ, по которому совпадающие загрузки сводятся в одну задачу"""
+        return (
+            URLValidator.canonicalize_url(download_info['url']),
+            download_info['type'],
+            download_info['quality'],
+            os.path.normcase(os.path.abspath(download_info['path']))
         )
-        thread.start()
 
-        return download_id
+    def get_download(self, download_id):
+        """Возвращает задачу по ее ID или по ID присоединенной к ней загрузки"""
+        return self.active_downloads.get(download_id) or self._attached.get(download_id)
+
+    def detach(self, download_id):
+        """
+        Отказывается от загрузки: ее ID перестает получать уведомления.
+
+        Задача, у которой не осталось получателей, снимается из активных
+        (еще не начатая пропускается воркером); если к ней присоединены
+        другие загрузки, она продолжается для них.
+        """
+        with self._jobs_lock:
+            download_info = self.active_downloads.get(download_id) or self._attached.pop(download_id, None)
+            if download_info is None:
+                return
+            if download_id in download_info['subscribers']:
+                download_info['subscribers'].remove(download_id)
+            if not download_info['subscribers']:
+                self._forget_locked(download_info)
+
+    def _forget(self, download_info):
+        """Убирает завершенную задачу из активных вместе с присоединенными к ней ID"""
+        with self._jobs_lock:
+            self._forget_locked(download_info)
+
+    def _forget_locked(self, download_info):
+        self.active_downloads.pop(download_info['id'], None)
+        self.throughput.finish(download_info['id'])
+        for download_id in download_info['subscribers']:
+            self._attached.pop(download_id, None)
+        key = self._job_key(download_info)
+        if self._jobs_by_key.get(key) is download_info:
+            del self._jobs_by_key[key]
+
+    def add_downloads(self, urls, download_type: str, quality: str, custom_path: str = None, preflight: bool = True):
+        """Добавляет пакет загрузок; точно недоступные ссылки отсеиваются до постановки в очередь.
+
+        Ссылки, которые не удалось проверить (ограничение запросов, таймаут), ставятся
+        в очередь; короткие ссылки качаются по конечному адресу.
+        """
+        urls = [self._clean_url(url) for url in urls]
+        dead = {}
+        results = {}
+        if preflight:
+            results = URLValidator.preflight_urls(urls)
+            dead = {url: result for url, result in results.items() if result['state'] == DEAD}
+
+        download_ids = {}
+        for url in dict.fromkeys(urls):
+            if url not in dead:
+                target = resolved_url(results[url]) if url in results else url
+                download_ids[url] = self.add_download(target, download_type, quality, custom_path)
+        return download_ids, dead
 
     def _get_user_agent(self):
         """Возвращает случайный User-Agent"""
@@ -95,7 +272,125 @@ class DownloadManager:
         cleaned_url = ''.join(char for char in url if ord(char) >= 32 and char not in ['\r', '\n', '\t'])
         return cleaned_url.strip()
 
-    def _download_worker(self, download_info):
+    def _worker_loop(self, index):
+        """Цикл воркера: берет задачи из очереди и переиспользует свои экземпляры YoutubeDL"""
+        ydl_pool = YoutubeDLPool()
+        # Процесс загрузки воркера (режим изоляции из профиля); запускается при первой задаче
+        process = None
+        try:
+            while not self._stop_event.is_set():
+                if index >= self.perf.get('concurrency', 'max_parallel_downloads'):
+                    # Профиль уменьшил число параллельных загрузок
+                    break
+                try:
+                    download_info = self.download_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+
+                try:
+                    if download_info['id'] not in self.active_downloads:
+                        continue
+                    if not self._take_slot(download_info):
+                        continue
+                    try:
+                        if self.perf.get('isolation', 'use_processes'):
+                            if process is None:
+                                process = WorkerProcess(f"download-process-{index}", self.perf.section('logging'))
+                            self._run_isolated(download_info, process)
+                        else:
+                            if process is not None:
+                                process.stop("режим изоляции выключен")
+                                process = None
+                            with self.profiler.profile_job(download_info['id'], download_info['service']), \
+                                    self.video_processor.job():
+                                self._download_worker(download_info, ydl_pool)
+                    finally:
+                        self._release_slot(download_info['service'])
+                finally:
+                    self.download_queue.task_done()
+        finally:
+            ydl_pool.close()
+            if process is not None:
+                process.stop()
+
+    def _take_slot(self, download_info):
+        """Занимает место сервиса задачи; при исчерпанном лимите откладывает задачу, воркер берет следующую"""
+        with self._parked_lock:
+            if self.tuner.try_acquire(download_info['service']):
+                return True
+            self._parked[download_info['service']].append(download_info)
+            logger.debug("Задача %s ждет места: лимит %s - %d", download_info['id'],
+                         download_info['service'], self.tuner.limit(download_info['service']))
+            return False
+
+    def _release_slot(self, service):
+        with self._parked_lock:
+            self.tuner.release(service)
+        self._wake_parked([service])
+
+    def _wake_parked(self, services=None):
+        """Возвращает в очередь столько отложенных задач сервиса, сколько у него свободных мест"""
+        with self._parked_lock:
+            for service in services or list(self._parked):
+                parked = self._parked.get(service)
+                free = self.tuner.free_slots(service)
+                while parked and free > 0:
+                    self.download_queue.put(parked.popleft())
+                    free -= 1
+
+    def _record_attempt(self, download_info, outcome, size=0, seconds=0.0):
+        """Запоминает итог попытки; в процессе загрузки итоги уходят родителю вместе с задачей"""
+        attempt = {'outcome': outcome, 'size': size, 'seconds': seconds}
+        download_info['attempts'].append(attempt)
+        if self.tuner is not None:
+            self.tuner.record(download_info['service'], **attempt)
+
+    def _run_isolated(self, download_info, process):
+        """Выполняет задачу в отдельном процессе; историю пишет сам процесс, кроме случая его падения"""
+        download_id = download_info['id']
+        settings = self.perf.section('isolation')
+        # Профилируется дочерний процесс: здесь поток только ждет его сообщений
+        profiling = dict(self.profiler.settings) if self.profiler.should_profile(
+            download_id, download_info['service']) else None
+        rss = None
+        try:
+            success, message, rss = process.run(
+                download_info,
+                lambda: self._notify_progress(download_id),
+                self._stop_event,
+                settings['hang_timeout'],
+                self.disk_guard,
+                prefetched=self.prefetcher.get(self._clean_url(download_info['url'])),
+                profiling=profiling,
+                processing_timeout=settings['processing_timeout']
+            )
+        except WorkerCrashed as e:
+            success, message = False, str(e)
+            download_info['status'] = 'Ошибка'
+            download_info['progress'] = 0
+            download_info['error'] = message
+            logger.error("Ошибка загрузки %s: %s", download_id, message)
+            self._notify_progress(download_id)
+            if self.staging:
+                self.staging.cleanup(download_id)
+            self._archive(download_info)
+        finally:
+            # Упавший процесс не успел снять свои резервы места
+            self.disk_guard.release(download_id)
+            self.disk_guard.release(f"{download_id}:output")
+
+        # Попытки прошли в процессе загрузки - их итоги учитываются здесь
+        for attempt in download_info['attempts']:
+            self.tuner.record(download_info['service'], **attempt)
+
+        if self._stop_event.is_set():
+            # Задачу завершает stop_all
+            return
+        self._notify_completion(download_info, success, message)
+        self._forget(download_info)
+        process.recycle_if_needed(settings['max_jobs_per_process'], settings['max_memory_mb'] * 1024 ** 2, rss)
+
+    def _download_worker(self, download_info, ydl_pool):
         """Воркер для загрузки файлов"""
         download_id = download_info['id']
 
@@ -103,212 +398,117 @@ class DownloadManager:
             if self._stop_event.is_set():
                 download_info['status'] = 'Остановлено'
                 self._notify_progress(download_id)
-                if self.completion_callback:
-                    self.completion_callback(download_id, False, "Загрузка остановлена")
+                self._notify_completion(download_info, False, "Загрузка остановлена")
                 return
 
             download_info['status'] = 'Загружается'
+            download_info['started_at'] = time.time()
             self._notify_progress(download_id)
 
             # Очищаем URL
             clean_url = self._clean_url(download_info['url'])
-            logger.info(f"Очищенный URL: {clean_url}")
-
-            # Добавляем случайную задержку
-            time.sleep(random.uniform(0.5, 2.0))
-
-
-
-            # Базовые настройки
-            ydl_opts = {
-                'outtmpl': os.path.join(download_info['path'], '%(title)s.%(ext)s'),
-                'noplaylist': True,
-                'progress_hooks': [lambda d: self._progress_hook(d, download_id)],
-                'quiet': False,  # Включаем вывод для диагностики
-                'no_warnings': False,
-                'fragment_retries': 10,
-                'retries': 5,
-                'http_headers': {
-                    'User-Agent': self._get_user_agent(),
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                    'Accept-Language': 'en-us,en;q=0.5',
-                    'Accept-Encoding': 'gzip, deflate',
-                    'DNT': '1',
-                    'Connection': 'keep-alive',
-                    'Upgrade-Insecure-Requests': '1',
-                    'Sec-Fetch-Dest': 'document',
-                    'Sec-Fetch-Mode': 'navigate',
-                    'Sec-Fetch-Site': 'none'
-                },
-                'socket_timeout': 30,
-                'nocheckcertificate': True,
-                'geo_bypass': True,
-                'extractor_retries': 3,
-                'file_access_retries': 3,
-                'sleep_interval': 1,
-                'max_sleep_interval': 5,
-                'writesubtitles': False,
-                'writeautomaticsub': False,
-                'ignoreerrors': False,
-                'no_check_certificates': True,
-                'prefer_insecure': False,
-                # Отключаем прокси принудительно
-                'proxy': '',
-                'source_address': None
-            }
+            logger.info("Очищенный URL: %s", clean_url)
 
             service_name = download_info['service']
+            rate_limits = self.perf.section('rate_limits', service_name)
 
-            # Специальные настройки для разных сервисов
-            if service_name == 'YouTube':
-                ydl_opts.update({
-                    'http_headers': {
-                        **ydl_opts['http_headers'],
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                        'Referer': 'https://www.youtube.com/',
-                        'Origin': 'https://www.youtube.com',
-                    },
-                    'extractor_args': {
-                        'youtube': {
-                            'player_client': ['web'],  # Используем только web клиент
-                            'skip': ['hls'],
-                            'formats': 'missing_pot'  # Разрешаем форматы без PO Token
-                        }
-                    },
-                    # Упрощенные настройки формата
-                    'format': 'best[ext=mp4]/best',
-                    'no_check_certificates': True,
-                    'ignoreerrors': False,
-                })
-            elif service_name == 'TikTok':
-                ydl_opts.update({
-                    'http_headers': {
-                        **ydl_opts['http_headers'],
-                        'Referer': 'https://www.tiktok.com/',
-                        'Origin': 'https://www.tiktok.com',
-                        'Authority': 'www.tiktok.com',
-                        'Cache-Control': 'max-age=0',
-                        'Sec-Ch-Ua': '"Not A(Brand";v="99", "Google Chrome";v="121", "Chromium";v="121"',
-                        'Sec-Ch-Ua-Mobile': '?0',
-                        'Sec-Ch-Ua-Platform': '"macOS"'
-                    },
-                    'extractor_args': {
-                        'tiktok': {
-                            'webpage_url_basename': 'video',
-                            'api_hostname': 'api.tiktokv.com'
-                        }
-                    }
-                })
-            elif service_name == 'Instagram':
-                ydl_opts.update({
-                    'http_headers': {
-                        **ydl_opts['http_headers'],
-                        'Referer': 'https://www.instagram.com/',
-                        'Origin': 'https://www.instagram.com',
-                        'X-Instagram-AJAX': '1',
-                        'X-Requested-With': 'XMLHttpRequest'
-                    }
-                })
-
-            # Обработка аудио загрузок
-            if download_info['type'] == 'Только аудио (MP3)':
-                if service_name == 'SoundCloud':
-                    ydl_opts.update({
-                        'format': 'bestaudio/best',
-                        'postprocessors': [{
-                            'key': 'FFmpegExtractAudio',
-                            'preferredcodec': 'mp3',
-                            'preferredquality': '320'
-                        }]
-                    })
-                else:
-                    ydl_opts.update({
-                        'format': 'bestaudio[ext=m4a]/bestaudio/best',
-                        'postprocessors': [{
-                            'key': 'FFmpegExtractAudio',
-                            'preferredcodec': 'mp3',
-                            'preferredquality': '192'
-                        }]
-                    })
-            else:
-                # Обработка видео загрузок
-                quality_format = AppConfig.VIDEO_QUALITIES.get(
-                    download_info['quality'], 'best'
-                )
-
-                if service_name == 'YouTube':
-                    # Специальные форматы для YouTube
-                    format_map = {
-                        'best[height<=2160]': 'best[height<=2160][ext=mp4]/best[height<=2160]/best[ext=mp4]/best',
-                        'best[height<=1080]': 'best[height<=1080][ext=mp4]/best[height<=1080]/best[ext=mp4]/best',
-                        'best[height<=720]': 'best[height<=720][ext=mp4]/best[height<=720]/best[ext=mp4]/best',
-                        'best[height<=480]': 'best[height<=480][ext=mp4]/best[height<=480]/best[ext=mp4]/best',
-                        'best[height<=360]': 'best[height<=360][ext=mp4]/best[height<=360]/best[ext=mp4]/best',
-                        'best': 'best[ext=mp4]/best'
-                    }
-                    ydl_opts['format'] = format_map.get(quality_format, format_map['best'])
-                elif service_name == 'TikTok':
-                    ydl_opts['format'] = 'best[ext=mp4]/best'
-                else:
-                    if quality_format == 'best':
-                        ydl_opts['format'] = 'best[ext=mp4]/best'
-                    else:
-                        ydl_opts['format'] = f'{quality_format}[ext=mp4]/{quality_format}/best[ext=mp4]/best'
-
-                # Постпроцессор для видео
-                if 'postprocessors' not in ydl_opts:
-                    ydl_opts['postprocessors'] = []
-
-                ydl_opts['postprocessors'].append({
-                    'key': 'FFmpegVideoConvertor',
-                    'preferedformat': 'mp4'
-                })
+            # Добавляем случайную задержку
+            time.sleep(random.uniform(*rate_limits['start_delay']))
 
             # Выполняем загрузку с повторными попытками
-            max_attempts = 3
+            max_attempts = self.perf.get('retries', 'max_attempts', service_name)
             last_error = None
 
             for attempt in range(max_attempts):
+                attempt_started = time.monotonic()
                 try:
                     if self._stop_event.is_set():
                         break
 
-                    logger.info(f"Попытка {attempt + 1}/{max_attempts} для загрузки {download_id}")
+                    logger.info("Попытка %d/%d для загрузки %s", attempt + 1, max_attempts, download_id)
 
-                    # Обновляем User-Agent для каждой попытки
-                    ydl_opts['http_headers']['User-Agent'] = self._get_user_agent()
+                    # Берем теплый экземпляр из пула воркера и обновляем User-Agent для каждой попытки
+                    pooled = ydl_pool.acquire(service_name, download_info['type'], download_info['quality'])
+                    # Контрольные суммы считаются по ходу записи файлов этой попытки
+                    download_info['checksums'] = FileChecksums()
+                    # Незавершенные файлы пишутся в промежуточную папку задачи
+                    work_dir = self.staging.job_dir(download_id) if self.staging else download_info['path']
+                    pooled.prepare_job(
+                        work_dir,
+                        self._get_user_agent(),
+                        lambda d: self._progress_hook(d, download_id)
+                    )
 
                     # Используем очищенный URL
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        ydl.download([clean_url])
+                    try:
+                        # Первая попытка использует метаданные, предзагруженные при вводе ссылки
+                        prefetched = self.prefetcher.get(clean_url) if attempt == 0 else None
+                        if prefetched:
+                            info = pooled.ydl.process_ie_result(prefetched, download=False)
+                        else:
+                            info = pooled.ydl.extract_info(clean_url, download=False)
+                        download_info['title'] = info.get('title')
+                        download_info['thumbnail'] = pick_thumbnail_url(info)
+                        overwrite = bool(pooled.ydl.params.get('overwrites'))
+                        existing = None if overwrite else self._existing_output(pooled.ydl, info, download_info)
+                        if existing:
+                            # Как "has already been downloaded" в yt-dlp: файл не качается заново
+                            logger.info("Файл %s уже есть в папке вывода, загрузка не нужна", existing)
+                            self._publish(download_info, [existing])
+                        else:
+                            self._admit(download_info, info, work_dir)
+                            try:
+                                if download_info['type'] == 'Только аудио (MP3)':
+                                    filepaths = self._download_audio(pooled.ydl, info, download_info)
+                                elif needs_merge(info):
+                                    info = self._download_merged(pooled.ydl, info, download_info)
+                                    filepaths = self._finalize_video(pooled.ydl, info, download_info)
+                                else:
+                                    info = pooled.ydl.process_ie_result(info, download=True)
+                                    filepaths = self._finalize_video(pooled.ydl, info, download_info)
+                                self._publish(download_info, filepaths, overwrite)
+                            finally:
+                                self.disk_guard.release(download_id)
+                                self.disk_guard.release(f"{download_id}:output")
+                    except Exception:
+                        # После ошибки состояние экземпляра не гарантировано
+                        ydl_pool.discard(pooled)
+                        raise
+                    finally:
+                        pooled.finish_job()
 
                     # Если дошли сюда, загрузка успешна
+                    self._record_attempt(download_info, SUCCESS, download_info['size'] or 0,
+                                         time.monotonic() - attempt_started)
                     if not self._stop_event.is_set():
                         download_info['status'] = 'Завершено'
                         download_info['progress'] = 100
                         self._notify_progress(download_id)
 
-                        if self.completion_callback:
-                            self.completion_callback(download_id, True, "")
+                        self._notify_completion(download_info, True, "")
                     return
 
                 except Exception as e:
                     last_error = e
                     error_str = str(e).lower()
-                    logger.warning(f"Попытка {attempt + 1} неудачна: {str(e)}")
+                    logger.warning("Попытка %d неудачна: %s", attempt + 1, e)
+
+                    if isinstance(e, (InsufficientDiskSpace, DownloadStopped)):
+                        break
+                    self._record_attempt(download_info, classify_error(e), seconds=time.monotonic() - attempt_started)
 
                     # Специфичные ошибки, при которых нет смысла повторять
                     if any(keyword in error_str for keyword in [
                         'private', 'not available', 'removed', 'deleted',
                         'copyright', 'blocked', '404', 'forbidden', 'not found'
                     ]):
-                        logger.info(f"Критическая ошибка, не повторяем: {str(e)}")
+                        logger.info("Критическая ошибка, не повторяем: %s", e)
                         break
 
                     if attempt < max_attempts - 1:
                         # Увеличиваем задержку с каждой попыткой
-                        delay = random.uniform(3, 8) * (attempt + 1)
-                        logger.info(f"Ждем {delay:.1f} секунд перед следующей попыткой...")
+                        delay = random.uniform(*rate_limits['retry_delay']) * (attempt + 1)
+                        logger.info("Ждем %.1f секунд перед следующей попыткой...", delay)
                         time.sleep(delay)
 
             # Если все попытки неудачны
@@ -339,15 +539,152 @@ class DownloadManager:
             elif "timeout" in error_msg.lower():
                 error_msg = "Ошибка: Превышено время ожидания. Попробуйте позже"
 
-            logger.error(f"Ошибка загрузки {download_id}: {error_msg}")
+            download_info['error'] = error_msg
+            logger.error("Ошибка загрузки %s: %s", download_id, error_msg)
+
+            self._notify_progress(download_id)
+            self._notify_completion(download_info, False, error_msg)
+
+        finally:
+            download_info['checksums'] = None
+            if self.staging:
+                self.staging.cleanup(download_id)
+            self._archive(download_info)
+            self._forget(download_info)
+
+    def _admit(self, download_info, info, work_dir):
+        """Резервирует место на диске под задачу, удерживая ее, пока том почти заполнен"""
+        download_id = download_info['id']
+        output_dir = download_info['path']
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+        def on_wait():
+            download_info['status'] = 'Ожидает места на диске'
+            self._notify_progress(download_id)
+
+        # Загрузка и обработка идут в рабочей папке, в папку вывода попадает только результат
+        reservations = [(download_id, work_dir, estimate_job_size(info, download_info['type']))]
+        if os.stat(work_dir).st_dev != os.stat(output_dir).st_dev:
+            reservations.append((f"{download_id}:output", output_dir, estimate_output_size(info)))
+
+        for key, path, size in reservations:
+            if not self.disk_guard.reserve(key, path, size,
+                                           should_stop=self._stop_event.is_set, on_wait=on_wait):
+                raise DownloadStopped("Загрузка остановлена")
 
+        if download_info['status'] != 'Загружается':
+            download_info['status'] = 'Загружается'
             self._notify_progress(download_id)
-            if self.completion_callback:
-                self.completion_callback(download_id, False, error_msg)
 
+    def _download_audio(self, ydl, info, download_info):
+        """Загружает аудио: потоково через ffmpeg, если формат позволяет, иначе в два прохода"""
+        if self.audio_streamer.can_stream(ydl, info):
+            filepath = self.audio_streamer.extract(
+                ydl, info,
+                progress_hook=lambda d: self._progress_hook(d, download_info['id']),
+                should_stop=self._stop_event.is_set,
+                checksums=download_info['checksums']
+            )
+            return [filepath]
+
+        # Фрагментированные форматы и плейлисты - загрузка файла и FFmpegExtractAudio
+        info = ydl.process_ie_result(info, download=True)
+        return [entry['filepath'] for entry in self._iter_downloaded(info) if entry.get('filepath')]
+
+    def _download_merged(self, ydl, info, download_info):
+        """Качает видео и аудио одновременно; прогресс потоков сводится в одну цифру строки"""
+        download_info['streams'] = StreamProgress(info['requested_formats'])
+        download_info['filename'] = os.path.basename(ydl.prepare_filename(info))
+        try:
+            return download_and_merge(ydl, info, thread_name=f"stream-{download_info['id']}")
         finally:
-            if download_id in self.active_downloads:
-                del self.active_downloads[download_id]
+            download_info['streams'] = None
+
+    @staticmethod
+    def _iter_downloaded(info):
+        """Возвращает info_dict каждого скачанного файла (путь хранится в requested_downloads)"""
+        for entry in info.get('entries') or [info]:
+            if not entry:
+                continue
+            for downloaded in entry.get('requested_downloads') or [entry]:
+                yield {**entry, **downloaded}
+
+    def _finalize_video(self, ydl, info, download_info):
+        """Приводит загруженные видео к mp4 и запоминает выбранный путь обработки"""
+        filepaths = []
+        for entry in self._iter_downloaded(info):
+            if not entry.get('filepath'):
+                continue
+            entry, report = self.video_processor.process(ydl, entry)
+            download_info['video_path'] = report['path']
+            download_info['cpu_saved'] += report['cpu_saved']
+            if entry.get('filepath'):
+                filepaths.append(entry['filepath'])
+        return filepaths
+
+    def _existing_output(self, ydl, info, download_info):
+        """
+        Путь готового файла задачи в папке вывода, если он там уже есть.
+
+        yt-dlp сам не качает повторно уже существующий файл, но с промежуточной
+        папкой он проверяет пустую папку задачи; поэтому итоговое имя (.mp4 или
+        .mp3 после обработки) проверяется здесь. Только для одиночных видео:
+        файлы плейлиста защищает перенос без перезаписи.
+        """
+        if not self.staging or info.get('entries') is not None or info.get('_type') == 'playlist':
+            return None
+        ext = 'mp3' if download_info['type'] == 'Только аудио (MP3)' else TARGET_CONTAINER
+        name = os.path.splitext(os.path.basename(ydl.prepare_filename(info)))[0] + f'.{ext}'
+        path = os.path.join(download_info['path'], name)
+        return path if os.path.isfile(path) else None
+
+    def _publish(self, download_info, filepaths, overwrite=False):
+        """Переносит готовые файлы из промежуточной папки в папку вывода и фиксирует их контрольные суммы"""
+        checksums = download_info['checksums']
+        for filepath in filepaths:
+            if self.staging and os.path.exists(filepath):
+                filepath = self.staging.publish(filepath, download_info['path'], checksums, overwrite)
+            download_info['filename'] = os.path.basename(filepath)
+            try:
+                size = os.path.getsize(filepath)
+                checksum = checksums.finalize(filepath) if checksums is not None else None
+            except OSError as e:
+                logger.warning("Не удалось получить размер и контрольную сумму %s: %s", filepath, e)
+                continue
+            download_info['size'] = (download_info['size'] or 0) + size
+            download_info['checksum'] = checksum
+            download_info['files'].append({'path': filepath, 'size': size, 'checksum': checksum})
+            logger.info("Готов файл %s (%d байт, %s)", filepath, size, checksum)
+
+    def _notify_completion(self, download_info, success, message):
+        """
+        Фиксирует время завершения и сообщает о нем интерфейсу.
+
+        В completion_callback(download_id, success, message, result) result - словарь
+        с готовыми файлами ('files': путь, размер, контрольная сумма) и 'checksum' последнего файла.
+        Уведомление получают задача и все присоединенные к ней загрузки.
+        """
+        with self._jobs_lock:
+            # После отметки времени к задаче больше не присоединяются новые загрузки
+            download_info['finished_at'] = time.time()
+            subscribers = list(download_info['subscribers'])
+        if success and download_info.get('archive_key') and not self.isolated_child:
+            try:
+                get_sync_archive().add(*download_info['archive_key'])
+            except Exception as e:
+                logger.warning("Не удалось отметить %s в архиве синхронизации: %s", download_info['url'], e)
+        if self.completion_callback:
+            result = {'files': list(download_info['files']), 'checksum': download_info['checksum']}
+            for download_id in subscribers:
+                self.completion_callback(download_id, success, message, result)
+
+    def _archive(self, download_info):
+        """Сохраняет завершенную задачу в историю"""
+        download_info['finished_at'] = download_info['finished_at'] or time.time()
+        try:
+            self.history.record(HistoryStore.make_record(download_info))
+        except Exception as e:
+            logger.warning("Не удалось сохранить задачу %s в историю: %s", download_info['id'], e)
 
     def _progress_hook(self, d, download_id):
         """Обработчик прогресса загрузки"""
@@ -356,6 +693,26 @@ class DownloadManager:
 
         download_info = self.active_downloads[download_id]
 
+        checksums = download_info.get('checksums')
+        if checksums is not None:
+            # Хвост файла дочитывается в хэш, пока только что записанные байты в кэше ОС
+            if d['status'] == 'downloading' and d.get('tmpfilename'):
+                checksums.follow(d['tmpfilename'])
+            elif d['status'] == 'finished' and d.get('filename'):
+                checksums.rename(f"{d['filename']}.part", d['filename'])
+                checksums.follow(d['filename'], final=True)
+
+        streams = download_info.get('streams')
+        if streams is not None and streams.update(d):
+            progress, speed, eta, downloaded, total = streams.snapshot()
+            download_info['progress'] = progress
+            download_info['downloaded_bytes'] = downloaded
+            download_info['total_bytes'] = total or None
+            download_info['speed'] = speed / 1024
+            download_info['eta'] = f"{int(eta) // 60:02d}:{int(eta) % 60:02d}" if eta is not None else ''
+            self._notify_progress(download_id)
+            return
+
         if d['status'] == 'downloading':
             # Обновляем прогресс
             if 'downloaded_bytes' in d and 'total_bytes' in d and d['total_bytes']:
@@ -370,6 +727,9 @@ class DownloadManager:
                     download_info['progress'] = float(percent_str)
                 except:
                     pass
+            if d.get('downloaded_bytes') is not None:
+                download_info['downloaded_bytes'] = d['downloaded_bytes']
+            download_info['total_bytes'] = d.get('total_bytes') or d.get('total_bytes_estimate')
 
             # Обновляем скорость
             if 'speed' in d and d['speed'] is not None:
@@ -396,6 +756,8 @@ class DownloadManager:
 
         elif d['status'] == 'finished':
             download_info['progress'] = 100
+            downloaded = d.get('total_bytes') or d.get('downloaded_bytes') or download_info['downloaded_bytes']
+            download_info['downloaded_bytes'] = download_info['total_bytes'] = downloaded
             if 'filename' in d:
                 filename = os.path.basename(d['filename'])
                 if filename.endswith('.part') or filename.endswith('.ytdl'):
@@ -407,25 +769,47 @@ class DownloadManager:
             self._notify_progress(download_id)
 
     def _notify_progress(self, download_id):
-        """Уведомляет о прогрессе"""
-        if self.progress_callback and download_id in self.active_downloads:
-            download_info = self.active_downloads[download_id]
-            self.progress_callback(
-                download_id,
-                download_info['progress'],
-                download_info['speed'],
-                download_info['status'],
-                download_info['filename']
-            )
+        """Уведомляет о прогрессе задачу и присоединенные к ней загрузки"""
+        download_info = self.active_downloads.get(download_id)
+        if download_info is not None and download_info['started_at']:
+            self.throughput.update(download_id, download_info['speed'] * 1024,
+                                   download_info['downloaded_bytes'], download_info['total_bytes'])
+            # Скачанное уже занимает место на диске - в резерве остается только остаток
+            self.disk_guard.written(download_id, download_info['downloaded_bytes'])
+        if self.progress_callback and download_info is not None:
+            for subscriber in list(download_info['subscribers']):
+                self.progress_callback(
+                    subscriber,
+                    download_info['progress'],
+                    download_info['speed'],
+                    download_info['status'],
+                    download_info['filename']
+                )
+
+    def throughput_summary(self):
+        """Сводная скорость, остаток и ETA очереди (см. ThroughputMonitor.summary)"""
+        running = set(self.throughput.job_ids())
+        queued = sum(1 for download_id in list(self.active_downloads) if download_id not in running)
+        return self.throughput.summary(queued=queued)
+
+    def prefetch(self, url):
+        """Начинает фоновое извлечение метаданных для введенной ссылки"""
+        self.prefetcher.prefetch(self._clean_url(url))
+
+    def prefetched(self, url, timeout=None):
+        """Метаданные, предзагруженные для ссылки (кэш ведется по очищенной ссылке), или None"""
+        return self.prefetcher.get(self._clean_url(url), timeout=timeout)
 
     def stop_all(self):
         """Останавливает все активные загрузки"""
         self._stop_event.set()
+        self.prefetcher.close()
+        save_sync_archive()
         for download_id in list(self.active_downloads.keys()):
             download_info = self.active_downloads.get(download_id)
             if download_info:
                 download_info['status'] = 'Остановлено'
                 self._notify_progress(download_id)
-                if self.completion_callback:
-                    self.completion_callback(download_id, False, "Загрузка остановлена")
-                del self.active_downloads[download_id]
\ No newline at end of file
+                self._notify_completion(download_info, False, "Загрузка остановлена")
+                self._archive(download_info)
+                self._forget(download_info)
\ No newline at end of file
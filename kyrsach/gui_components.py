@@ -416,4 +416,105 @@ class InfoDialog:
         y = (self.dialog.winfo_screenheight() // 2) - (400 // 2)
         self.dialog.geometry(f"500x400+{x}+{y}")
 
-        self.dialog.wait_window()
\ No newline at end of file
+        self.dialog.wait_window()
+
+
+class ProfilingDialog:
+    """Диалог настройки выборочного профилирования"""
+
+    def __init__(self, parent, profiler, on_apply=None):
+        self.profiler = profiler
+        self.on_apply = on_apply
+        settings = profiler.settings
+
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("Профилирование")
+        self.dialog.configure(bg='#ffffff')
+        self.dialog.resizable(False, False)
+        self.dialog.transient(parent)
+        self.dialog.grab_set()
+
+        header_frame = tk.Frame(self.dialog, bg='#6366f1', height=60)
+        header_frame.pack(fill='x')
+        header_frame.pack_propagate(False)
+        tk.Label(
+            header_frame,
+            text="🔬 Профилирование",
+            font=('Arial', 16, 'bold'),
+            fg='white',
+            bg='#6366f1'
+        ).pack(expand=True)
+
+        content_frame = tk.Frame(self.dialog, bg='#ffffff')
+        content_frame.pack(fill='both', expand=True, padx=30, pady=20)
+
+        self.enabled_var = tk.BooleanVar(value=settings['enabled'])
+        self.tracemalloc_var = tk.BooleanVar(value=settings['tracemalloc'])
+        self.main_thread_var = tk.BooleanVar(value=settings['main_thread'])
+        self.services_var = tk.StringVar(value=", ".join(settings['services']))
+        self.job_ids_var = tk.StringVar(value=", ".join(settings['job_ids']))
+        self.sample_rate_var = tk.StringVar(value=str(settings['sample_rate']))
+
+        for text, variable in (
+            ("Включить профилирование", self.enabled_var),
+            ("Снимки аллокаций (tracemalloc)", self.tracemalloc_var),
+            ("Профилировать главный поток", self.main_thread_var),
+        ):
+            tk.Checkbutton(
+                content_frame,
+                text=text,
+                variable=variable,
+                font=('Arial', 11),
+                bg='#ffffff',
+                anchor='w'
+            ).pack(fill='x', pady=4)
+
+        for text, variable in (
+            ("Сервисы (через запятую):", self.services_var),
+            ("ID задач (через запятую):", self.job_ids_var),
+            ("Доля случайных задач (0..1):", self.sample_rate_var),
+        ):
+            tk.Label(
+                content_frame,
+                text=text,
+                font=('Arial', 11, 'bold'),
+                fg='#374151',
+                bg='#ffffff',
+                anchor='w'
+            ).pack(fill='x', pady=(8, 2))
+            tk.Entry(content_frame, textvariable=variable, font=('Arial', 11), width=40).pack(fill='x')
+
+        self.error_label = tk.Label(content_frame, text="", font=('Arial', 10), fg='#ef4444', bg='#ffffff')
+        self.error_label.pack(fill='x', pady=(8, 0))
+
+        ModernButton(
+            content_frame,
+            "Применить",
+            command=self._apply,
+            style='primary'
+        ).pack(pady=(10, 0))
+
+    @staticmethod
+    def _split(text):
+        return [item.strip() for item in text.split(',') if item.strip()]
+
+    def _apply(self):
+        try:
+            sample_rate = float(self.sample_rate_var.get().replace(',', '.') or 0)
+        except ValueError:
+            sample_rate = -1
+        if not 0.0 <= sample_rate <= 1.0:
+            self.error_label.configure(text="Доля задач должна быть числом от 0 до 1")
+            return
+
+        self.profiler.configure(
+            enabled=self.enabled_var.get(),
+            tracemalloc=self.tracemalloc_var.get(),
+            main_thread=self.main_thread_var.get(),
+            services=self._split(self.services_var.get()),
+            job_ids=self._split(self.job_ids_var.get()),
+            sample_rate=sample_rate
+        )
+        if self.on_apply:
+            self.on_apply()
+        self.dialog.destroy()
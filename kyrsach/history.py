@@ -0,0 +1,251 @@
+﻿import logging
+import re
+import sqlite3
+import threading
+import time
+
+from config import AppConfig
+
+logger = logging.getLogger(__name__)
+
+# Поля записи истории в порядке колонок таблицы
+HISTORY_FIELDS = (
+    'id', 'url', 'service', 'type', 'quality', 'status', 'title',
+    'filename', 'path', 'error', 'size', 'added_at', 'started_at', 'finished_at', 'thumbnail', 'checksum'
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    service TEXT,
+    type TEXT,
+    quality TEXT,
+    status TEXT,
+    title TEXT,
+    filename TEXT,
+    path TEXT,
+    error TEXT,
+    size INTEGER,
+    added_at REAL,
+    started_at REAL,
+    finished_at REAL NOT NULL,
+    thumbnail TEXT,
+    checksum TEXT
+);
+CREATE INDEX IF NOT EXISTS downloads_finished ON downloads (finished_at, id);
+CREATE INDEX IF NOT EXISTS downloads_url ON downloads (url);
+"""
+
+# Полнотекстовый индекс по внешнему содержимому: хранит только токены, строки берутся из downloads
+FTS_COLUMNS = ('title', 'url', 'service', 'filename', 'error')
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE downloads_fts USING fts5(
+    title, url, service, filename, error,
+    content='downloads', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER downloads_fts_insert AFTER INSERT ON downloads BEGIN
+    INSERT INTO downloads_fts (rowid, title, url, service, filename, error)
+    VALUES (new.rowid, new.title, new.url, new.service, new.filename, new.error);
+END;
+CREATE TRIGGER downloads_fts_delete AFTER DELETE ON downloads BEGIN
+    INSERT INTO downloads_fts (downloads_fts, rowid, title, url, service, filename, error)
+    VALUES ('delete', old.rowid, old.title, old.url, old.service, old.filename, old.error);
+END;
+CREATE TRIGGER downloads_fts_update AFTER UPDATE ON downloads BEGIN
+    INSERT INTO downloads_fts (downloads_fts, rowid, title, url, service, filename, error)
+    VALUES ('delete', old.rowid, old.title, old.url, old.service, old.filename, old.error);
+    INSERT INTO downloads_fts (rowid, title, url, service, filename, error)
+    VALUES (new.rowid, new.title, new.url, new.service, new.filename, new.error);
+END;
+INSERT INTO downloads_fts (downloads_fts) VALUES ('rebuild');
+"""
+
+SELECT_COLUMNS = "d.*, d.finished_at - d.started_at AS duration"
+
+
+class HistoryStore:
+    """Архив завершенных загрузок в SQLite с полнотекстовым поиском.
+
+    Одно соединение на процесс, доступ под блокировкой: записи приходят
+    из потоков загрузки по одной на задачу, чтение - из GUI постранично.
+    Поиск по названию, URL, сервису, имени файла и тексту ошибки идет
+    через индекс FTS5; если SQLite собран без FTS5 - через LIKE.
+    """
+
+    def __init__(self, path=AppConfig.HISTORY_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Для поиска без FTS5: встроенные LIKE и lower() не учитывают регистр только для ASCII
+        self._conn.create_function('casefold', 1, lambda value: value.casefold() if value else value,
+                                   deterministic=True)
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self.fts_enabled = self._ensure_fts()
+
+    def _migrate(self):
+        """Добавляет колонки, появившиеся после создания базы"""
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(downloads)")}
+        with self._conn:
+            for field in HISTORY_FIELDS:
+                if field not in columns:
+                    self._conn.execute(f"ALTER TABLE downloads ADD COLUMN {field}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS downloads_checksum ON downloads (checksum)")
+
+    def _ensure_fts(self):
+        """Создает полнотекстовый индекс, если его еще нет (и заполняет по существующим записям)"""
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'downloads_fts'"
+        ).fetchone()
+        if exists:
+            return True
+        try:
+            with self._conn:
+                self._conn.executescript(FTS_SCHEMA)
+            return True
+        except sqlite3.OperationalError as e:
+            logger.warning("FTS5 недоступен, поиск по истории будет медленнее: %s", e)
+            return False
+
+    @staticmethod
+    def make_record(download_info):
+        """Собирает запись истории из словаря задачи менеджера загрузок"""
+        record = {field: download_info.get(field) for field in HISTORY_FIELDS}
+        record['finished_at'] = record['finished_at'] or time.time()
+        return record
+
+    def record(self, entry):
+        """Сохраняет (или обновляет) запись о завершенной задаче"""
+        self.record_many([entry])
+
+    def record_many(self, entries):
+        """Сохраняет несколько записей одной транзакцией"""
+        rows = [tuple(entry.get(field) for field in HISTORY_FIELDS) for entry in entries]
+        if not rows:
+            return
+        placeholders = ", ".join("?" * len(HISTORY_FIELDS))
+        # UPSERT, а не REPLACE: замена через удаление не вызывает триггеры полнотекстового индекса
+        updates = ", ".join(f"{field} = excluded.{field}" for field in HISTORY_FIELDS if field != 'id')
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO downloads ({', '.join(HISTORY_FIELDS)}) VALUES ({placeholders}) "
+                f"ON CONFLICT (id) DO UPDATE SET {updates}",
+                rows
+            )
+
+    def page_before(self, before=None, limit=AppConfig.HISTORY_PAGE_SIZE):
+        """
+        Возвращает записи, завершенные раньше курсора, от новых к старым.
+
+        Args:
+            before (tuple): (finished_at, id) самой старой уже показанной записи; None - с самых новых
+            limit (int): размер страницы
+
+        Returns:
+            list: словари записей
+        """
+        with self._lock:
+            if before is None:
+                cursor = self._conn.execute(
+                    f"SELECT {SELECT_COLUMNS} FROM downloads d ORDER BY finished_at DESC, id DESC LIMIT ?", (limit,)
+                )
+            else:
+                cursor = self._conn.execute(
+                    f"SELECT {SELECT_COLUMNS} FROM downloads d WHERE (finished_at, id) < (?, ?) "
+                    "ORDER BY finished_at DESC, id DESC LIMIT ?",
+                    (before[0], before[1], limit)
+                )
+            return [dict(row) for row in cursor.fetchall()]
+
+    @staticmethod
+    def _fts_query(text):
+        """Превращает ввод пользователя в запрос FTS5: все слова, каждое как префикс"""
+        tokens = re.findall(r"\w+", text)
+        return " ".join(f'"{token}"*' for token in tokens)
+
+    def search(self, text, limit=AppConfig.HISTORY_PAGE_SIZE, service=None, status=None):
+        """
+        Ищет в истории по названию, URL, сервису, имени файла и тексту ошибки.
+
+        Args:
+            text (str): слова для поиска (каждое ищется как префикс)
+            limit (int): максимальное число результатов
+            service (str): ограничить сервисом
+            status (str): ограничить статусом ('Завершено', 'Ошибка', ...)
+
+        Returns:
+            list: словари записей от новых к старым, с полем duration (секунды)
+        """
+        conditions, params = [], []
+        query = self._fts_query(text)
+        if service:
+            conditions.append("d.service = ?")
+            params.append(service)
+        if status:
+            conditions.append("d.status = ?")
+            params.append(status)
+
+        if query and self.fts_enabled:
+            # Обход индекса по убыванию rowid (порядок записи = порядок завершения) останавливается на LIMIT,
+            # не собирая все совпадения частого слова
+            conditions.insert(0, "downloads_fts MATCH ?")
+            params.insert(0, query)
+            sql = (f"SELECT {SELECT_COLUMNS} FROM downloads_fts JOIN downloads d ON d.rowid = downloads_fts.rowid "
+                   f"WHERE {' AND '.join(conditions)} ORDER BY downloads_fts.rowid DESC LIMIT ?")
+        else:
+            # Те же правила, что у FTS5: каждое слово должно встретиться хотя бы в одном поле
+            for token in re.findall(r"\w+", text):
+                pattern = "%" + re.sub(r"([\\%_])", r"\\\1", token.casefold()) + "%"
+                conditions.append(
+                    "(" + " OR ".join(f"casefold(d.{column}) LIKE ? ESCAPE '\\'" for column in FTS_COLUMNS) + ")"
+                )
+                params.extend([pattern] * len(FTS_COLUMNS))
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            sql = f"SELECT {SELECT_COLUMNS} FROM downloads d {where} ORDER BY d.finished_at DESC, d.id DESC LIMIT ?"
+
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, (*params, limit)).fetchall()]
+
+    def find_url(self, url):
+        """Возвращает записи с точно таким URL (по индексу), от новых к старым"""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT {SELECT_COLUMNS} FROM downloads d WHERE d.url = ? ORDER BY d.finished_at DESC", (url,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+
+    def find_checksum(self, checksum):
+        """Возвращает записи с файлом той же контрольной суммы (поиск дубликатов без чтения файлов)"""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT {SELECT_COLUMNS} FROM downloads d WHERE d.checksum = ? ORDER BY d.finished_at DESC",
+                (checksum,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM downloads").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_history():
+    """Возвращает общее хранилище истории приложения"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore()
+        return _store
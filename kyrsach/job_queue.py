@@ -0,0 +1,304 @@
+﻿import argparse
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import AppConfig
+
+logger = logging.getLogger(__name__)
+
+# Состояния задачи в общей очереди
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    type TEXT NOT NULL,
+    quality TEXT NOT NULL,
+    path TEXT,
+    state TEXT NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    speed REAL NOT NULL DEFAULT 0,
+    status TEXT,
+    filename TEXT,
+    message TEXT,
+    checksum TEXT,
+    enqueued_at REAL NOT NULL,
+    updated_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, enqueued_at);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    host TEXT,
+    pid INTEGER,
+    seen_at REAL NOT NULL
+);
+"""
+
+
+class JobQueue:
+    """Общая очередь загрузок для нескольких процессов и машин в файле SQLite.
+
+    Воркер арендует задачу на lease_seconds и продлевает аренду пульсом,
+    отправляя вместе с ним прогресс. Если воркер умер и пульс прекратился,
+    аренда истекает и задача выдается другому воркеру; после max_attempts
+    выдач она помечается ошибкой. Завершить задачу может только тот воркер,
+    который держит аренду, поэтому опоздавший воркер не затрет чужой результат.
+
+    Файл должен лежать на диске, где SQLite корректно блокирует файлы
+    (локальный диск или общий том, а не сетевая папка без блокировок).
+    """
+
+    def __init__(self, path=AppConfig.JOB_QUEUE_DB, busy_timeout=30.0):
+        self.path = path
+        self._lock = threading.Lock()
+        # Транзакции открываем сами (BEGIN IMMEDIATE), чтобы выборка и аренда были атомарны между процессами
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Добавляет колонки, появившиеся после создания файла очереди"""
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if 'checksum' not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN checksum TEXT")
+
+    def _write(self, func, *args):
+        """Выполняет func(conn, *args) в транзакции с блокировкой записи"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self._conn, *args)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def enqueue(self, url, download_type, quality, custom_path=None, max_attempts=AppConfig.JOB_MAX_ATTEMPTS):
+        """Ставит задачу в очередь и возвращает ее ID"""
+        return self.enqueue_many([url], download_type, quality, custom_path, max_attempts)[0]
+
+    def enqueue_many(self, urls, download_type, quality, custom_path=None, max_attempts=AppConfig.JOB_MAX_ATTEMPTS):
+        """Ставит пакет задач одной транзакцией"""
+        now = time.time()
+        rows = [(uuid.uuid4().hex[:12], url, download_type, quality, custom_path, PENDING, max_attempts, now)
+                for url in urls]
+
+        def insert(conn):
+            conn.executemany(
+                "INSERT INTO jobs (id, url, type, quality, path, state, max_attempts, enqueued_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+        self._write(insert)
+        return [row[0] for row in rows]
+
+    def lease(self, worker_id, limit=1, lease_seconds=AppConfig.JOB_LEASE_SECONDS):
+        """
+        Арендует до limit задач: ожидающие и те, чья аренда истекла.
+
+        Returns:
+            list: словари задач (id, url, type, quality, path, attempts)
+        """
+        def take(conn):
+            now = time.time()
+            # Задачи умерших воркеров, исчерпавшие попытки, больше не выдаются
+            conn.execute(
+                "UPDATE jobs SET state = ?, worker = NULL, message = ?, finished_at = ?, updated_at = ? "
+                "WHERE state = ? AND lease_until < ? AND attempts >= max_attempts",
+                (FAILED, "Аренда истекла: воркер не отвечал", now, now, LEASED, now)
+            )
+            rows = conn.execute(
+                "SELECT id FROM jobs WHERE state = ? OR (state = ? AND lease_until < ?) "
+                "ORDER BY enqueued_at, id LIMIT ?",
+                (PENDING, LEASED, now, limit)
+            ).fetchall()
+            ids = [row['id'] for row in rows]
+            if not ids:
+                return []
+            marks = ", ".join("?" * len(ids))
+            conn.execute(
+                f"UPDATE jobs SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1, "
+                f"progress = 0, speed = 0, status = NULL, updated_at = ? WHERE id IN ({marks})",
+                (LEASED, worker_id, now + lease_seconds, now, *ids)
+            )
+            return [dict(row) for row in conn.execute(
+                f"SELECT id, url, type, quality, path, attempts FROM jobs WHERE id IN ({marks}) "
+                "ORDER BY enqueued_at, id", ids
+            )]
+
+        jobs = self._write(take)
+        for job in jobs:
+            if job['attempts'] > 1:
+                logger.info("Задача %s выдана повторно воркеру %s (попытка %d)", job['id'], worker_id, job['attempts'])
+        return jobs
+
+    def heartbeat(self, worker_id, reports, lease_seconds=AppConfig.JOB_LEASE_SECONDS):
+        """
+        Продлевает аренду задач воркера и сохраняет их прогресс.
+
+        Args:
+            worker_id (str): ID воркера
+            reports (dict): job_id -> dict(progress, speed, status, filename)
+            lease_seconds (float): новое время аренды от текущего момента
+
+        Returns:
+            set: ID задач, аренду которых воркер потерял (истекла и выдана другому)
+        """
+        def beat(conn):
+            now = time.time()
+            conn.execute(
+                "INSERT INTO workers (id, host, pid, seen_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET seen_at = excluded.seen_at",
+                (worker_id, socket.gethostname(), os.getpid(), now)
+            )
+            lost = set()
+            for job_id, report in reports.items():
+                cursor = conn.execute(
+                    "UPDATE jobs SET lease_until = ?, progress = ?, speed = ?, status = ?, filename = ?, "
+                    "updated_at = ? WHERE id = ? AND worker = ? AND state = ?",
+                    (now + lease_seconds, report.get('progress', 0), report.get('speed', 0),
+                     report.get('status'), report.get('filename'), now, job_id, worker_id, LEASED)
+                )
+                if cursor.rowcount == 0:
+                    lost.add(job_id)
+            return lost
+
+        return self._write(beat)
+
+    def complete(self, job_id, worker_id, success, message="", checksum=None):
+        """Фиксирует результат и контрольную сумму файла; False, если аренда уже принадлежит другому воркеру"""
+        def finish(conn):
+            now = time.time()
+            if success:
+                state = DONE
+            else:
+                # Ошибку повторяем на другом воркере, пока не кончатся попытки
+                row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                state = PENDING if row and row['attempts'] < row['max_attempts'] else FAILED
+            cursor = conn.execute(
+                "UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, message = ?, checksum = ?, "
+                "updated_at = ?, finished_at = ?, progress = ? WHERE id = ? AND worker = ? AND state = ?",
+                (state, message, checksum, now, None if state == PENDING else now, 100 if success else 0,
+                 job_id, worker_id, LEASED)
+            )
+            return cursor.rowcount > 0
+
+        accepted = self._write(finish)
+        if not accepted:
+            logger.warning("Результат задачи %s от воркера %s отброшен: аренда потеряна", job_id, worker_id)
+        return accepted
+
+    def release(self, job_id, worker_id):
+        """Возвращает незавершенную задачу в очередь (при штатной остановке воркера), не тратя попытку"""
+        def give_back(conn):
+            conn.execute(
+                "UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, attempts = MAX(attempts - 1, 0), "
+                "updated_at = ? WHERE id = ? AND worker = ? AND state = ?",
+                (PENDING, time.time(), job_id, worker_id, LEASED)
+            )
+
+        self._write(give_back)
+
+    def jobs(self, states=None, limit=200):
+        """Возвращает задачи (для координатора), от новых к старым"""
+        with self._lock:
+            if states:
+                marks = ", ".join("?" * len(states))
+                cursor = self._conn.execute(
+                    f"SELECT * FROM jobs WHERE state IN ({marks}) ORDER BY enqueued_at DESC LIMIT ?", (*states, limit)
+                )
+            else:
+                cursor = self._conn.execute("SELECT * FROM jobs ORDER BY enqueued_at DESC LIMIT ?", (limit,))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def counts(self):
+        """Возвращает число задач по состояниям"""
+        with self._lock:
+            return {row['state']: row['n'] for row in
+                    self._conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state")}
+
+    def workers(self, alive_seconds=AppConfig.JOB_LEASE_SECONDS):
+        """Возвращает воркеров, присылавших пульс за последние alive_seconds"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT * FROM workers WHERE seen_at >= ? ORDER BY id", (time.time() - alive_seconds,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _print_status(job_queue):
+    counts = job_queue.counts()
+    print("Задачи: " + ", ".join(f"{state}={counts.get(state, 0)}" for state in (PENDING, LEASED, DONE, FAILED)))
+    print("Воркеры: " + (", ".join(f"{w['id']} (pid {w['pid']})" for w in job_queue.workers()) or "нет"))
+    for job in job_queue.jobs(states=[LEASED]):
+        print(f"  {job['id']}  {job['worker']:<20} {job['progress']:5.1f}%  {job['speed']:8.1f} KB/s  "
+              f"{job['filename'] or job['url']}")
+
+
+def main():
+    """CLI координатора: постановка задач и наблюдение за очередью"""
+    parser = argparse.ArgumentParser(description="Общая очередь загрузок Video Downloader Pro")
+    parser.add_argument('--db', default=AppConfig.JOB_QUEUE_DB, help="Файл очереди SQLite")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add = subparsers.add_parser('add', help="Поставить ссылки в очередь")
+    add.add_argument('urls', nargs='*', help="Ссылки (или --file)")
+    add.add_argument('--file', help="Файл со ссылками, по одной в строке")
+    add.add_argument('--type', default="Видео (MP4)", help="Тип загрузки")
+    add.add_argument('--quality', default="⚡ Автоматически", help="Качество (ключ video_qualities профиля)")
+    add.add_argument('--path', help="Папка сохранения на воркерах")
+    add.add_argument('--max-attempts', type=int, default=AppConfig.JOB_MAX_ATTEMPTS)
+
+    status = subparsers.add_parser('status', help="Показать состояние очереди")
+    status.add_argument('--watch', type=float, metavar='SEC', help="Обновлять каждые SEC секунд")
+
+    args = parser.parse_args()
+    job_queue = JobQueue(args.db)
+    try:
+        if args.command == 'add':
+            urls = list(args.urls)
+            if args.file:
+                with open(args.file, 'r', encoding='utf-8') as f:
+                    urls.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+            if not urls:
+                parser.error("нет ссылок")
+            ids = job_queue.enqueue_many(urls, args.type, args.quality, args.path, args.max_attempts)
+            print(f"Поставлено задач: {len(ids)}")
+        else:
+            while True:
+                _print_status(job_queue)
+                if not args.watch:
+                    break
+                time.sleep(args.watch)
+                print()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        job_queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+﻿import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+from config import AppConfig
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Отдельный логгер для вывода yt-dlp: пишет только в свой ротируемый файл
+ytdlp_logger = logging.getLogger('yt_dlp')
+
+_listener = None
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке.
+
+    Стандартный QueueHandler подставляет аргументы в сообщение до постановки
+    в очередь; здесь это делает фоновый поток при записи. Поэтому аргументы
+    записи должны быть неизменяемыми (строки, числа): изменяемый объект
+    будет выведен в том состоянии, в котором его застанет фоновый поток.
+    Трассировка исключения форматируется сразу: к моменту записи кадры
+    и само исключение могут уже измениться.
+    """
+
+    _exc_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(levels=None, console=True):
+    """
+    Настраивает асинхронное логирование: все обработчики работают в фоновом потоке.
+
+    Потоки загрузки только кладут записи в очередь (QueueHandler), а
+    форматирование и запись на консоль/в файл выполняет QueueListener.
+
+    Args:
+        levels (dict): уровни логирования по модулям, '' - корневой логгер
+        console (bool): выводить ли сообщения приложения на консоль
+    """
+    global _listener
+    if _listener is not None:
+        apply_levels(levels or AppConfig.LOG_LEVELS)
+        return
+
+    log_queue = queue.SimpleQueue()
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    app_handler = logging.handlers.RotatingFileHandler(
+        AppConfig.LOG_FILE, maxBytes=AppConfig.LOG_MAX_BYTES,
+        backupCount=AppConfig.LOG_BACKUP_COUNT, encoding='utf-8'
+    )
+    app_handler.setFormatter(formatter)
+    handlers = [app_handler]
+    if console:
+        console_handler = logging.StreamHandler(sys.stderr)
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
+
+    # Записи yt-dlp уходят только в свой файл
+    ytdlp_handler = logging.handlers.RotatingFileHandler(
+        AppConfig.YTDLP_LOG_FILE, maxBytes=AppConfig.LOG_MAX_BYTES,
+        backupCount=AppConfig.LOG_BACKUP_COUNT, encoding='utf-8'
+    )
+    ytdlp_handler.setFormatter(formatter)
+    ytdlp_handler.addFilter(lambda record: record.name.startswith('yt_dlp'))
+    for handler in handlers:
+        handler.addFilter(lambda record: not record.name.startswith('yt_dlp'))
+    handlers.append(ytdlp_handler)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    apply_levels(levels or AppConfig.LOG_LEVELS)
+
+
+def apply_levels(levels):
+    """Устанавливает уровни логирования по модулям"""
+    for name, level in levels.items():
+        logging.getLogger(name or None).setLevel(level)
+
+
+def shutdown_logging():
+    """Дописывает оставшиеся записи и останавливает фоновый поток логирования"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
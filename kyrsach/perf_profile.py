@@ -0,0 +1,313 @@
+﻿import copy
+import json
+import logging
+import os
+import threading
+
+from config import AppConfig
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+
+logger = logging.getLogger(__name__)
+
+
+class PerformanceProfileError(ValueError):
+    """Ошибка в файле профиля производительности"""
+
+
+# Значения по умолчанию (единственное место, где они заданы; performance.json их переопределяет);
+# они же задают схему профиля (секции, ключи и типы)
+DEFAULT_PROFILE = {
+    'concurrency': {
+        'max_parallel_downloads': 3,
+        'preflight_workers': 32,
+        'preflight_per_host': 4,
+    },
+    'timeouts': {
+        'socket_timeout': 30,
+        'preflight_timeout': 5,
+    },
+    'retries': {
+        'max_attempts': 3,
+        'retries': 5,
+        'fragment_retries': 10,
+        'extractor_retries': 3,
+        'file_access_retries': 3,
+    },
+    'rate_limits': {
+        'start_delay': [0.5, 2.0],
+        'retry_delay': [3.0, 8.0],
+        'sleep_interval': 1,
+        'max_sleep_interval': 5,
+        'ratelimit': None,
+    },
+    'chunks': {
+        'http_chunk_size': None,
+        'stream_chunk_size': 256 * 1024,
+        'copy_buffer_size': 4 * 1024 * 1024,
+        'concurrent_fragment_downloads': 4,
+    },
+    'disk': {
+        'free_margin_mb': 512,
+    },
+    'isolation': {
+        'use_processes': False,
+        'hang_timeout': 300,
+        # Слияние и перекодирование идут без прогресса в байтах и могут быть долгими
+        'processing_timeout': 1800,
+        'max_jobs_per_process': 20,
+        'max_memory_mb': 1024,
+    },
+    'autotune': {
+        'enabled': True,
+        'initial_limit': 2,
+        'min_limit': 1,
+        'additive_increase': 1.0,
+        'decrease_factor': 0.5,
+        'decrease_cooldown': 30,
+        'error_rate_threshold': 0.5,
+        'congestion_ratio': 0.5,
+        'best_decay': 0.98,
+        'ewma_alpha': 0.3,
+    },
+    'video_qualities': dict(AppConfig.VIDEO_QUALITIES),
+    'logging': dict(AppConfig.LOG_LEVELS),
+}
+
+# Секции, которые можно переопределять для отдельного сервиса
+SERVICE_SECTIONS = ('timeouts', 'retries', 'rate_limits', 'chunks', 'autotune')
+
+# Ключи, допускающие null (ограничение отключено)
+NULLABLE_KEYS = {('rate_limits', 'ratelimit'), ('chunks', 'http_chunk_size')}
+
+# Ключи, которые должны быть целыми числами
+INTEGER_KEYS = {
+    'max_parallel_downloads', 'preflight_workers', 'preflight_per_host', 'max_attempts', 'retries',
+    'fragment_retries', 'extractor_retries', 'file_access_retries', 'http_chunk_size',
+    'stream_chunk_size', 'copy_buffer_size', 'free_margin_mb', 'concurrent_fragment_downloads',
+    'max_jobs_per_process', 'max_memory_mb', 'initial_limit', 'min_limit'
+}
+
+# Доли: значения от 0 до 1
+FRACTION_KEYS = {'decrease_factor', 'error_rate_threshold', 'congestion_ratio', 'best_decay', 'ewma_alpha'}
+
+
+def _deep_merge(base, override):
+    result = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = _deep_merge(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def _validate_section(name, section, where):
+    """Проверяет ключи и типы одной секции профиля"""
+    if not isinstance(section, dict):
+        raise PerformanceProfileError(f"{where}: секция '{name}' должна быть объектом")
+
+    if name == 'logging':
+        for module, level in section.items():
+            if level not in ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'):
+                raise PerformanceProfileError(f"{where}: неизвестный уровень логирования '{level}' для '{module}'")
+        return
+
+    if name == 'video_qualities':
+        for label, format_spec in section.items():
+            if not isinstance(format_spec, str) or not format_spec:
+                raise PerformanceProfileError(f"{where}: формат для '{label}' должен быть непустой строкой")
+        return
+
+    defaults = DEFAULT_PROFILE[name]
+    for key, value in section.items():
+        if key not in defaults:
+            raise PerformanceProfileError(f"{where}: неизвестный параметр '{name}.{key}'")
+        if value is None and (name, key) in NULLABLE_KEYS:
+            continue
+        if isinstance(defaults[key], bool):
+            if not isinstance(value, bool):
+                raise PerformanceProfileError(f"{where}: '{name}.{key}' должен быть true или false")
+            continue
+        if isinstance(defaults[key], list):
+            if (not isinstance(value, list) or len(value) != 2
+                    or not all(isinstance(v, (int, float)) and v >= 0 for v in value) or value[0] > value[1]):
+                raise PerformanceProfileError(f"{where}: '{name}.{key}' должен быть парой [мин, макс]")
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise PerformanceProfileError(f"{where}: '{name}.{key}' должен быть неотрицательным числом")
+        if key in INTEGER_KEYS and not isinstance(value, int):
+            raise PerformanceProfileError(f"{where}: '{name}.{key}' должен быть целым числом")
+        if key in ('max_parallel_downloads', 'max_attempts', 'preflight_workers', 'preflight_per_host',
+                   'concurrent_fragment_downloads', 'hang_timeout', 'processing_timeout', 'initial_limit', 'min_limit') and value < 1:
+            raise PerformanceProfileError(f"{where}: '{name}.{key}' должен быть не меньше 1")
+        if key in FRACTION_KEYS and (value > 1 or (value == 0 and key in ('decrease_factor', 'ewma_alpha'))):
+            raise PerformanceProfileError(f"{where}: '{name}.{key}' должен быть долей от 0 до 1")
+
+
+def validate_profile(data):
+    """
+    Проверяет профиль производительности и возвращает его, дополненный значениями по умолчанию.
+
+    Args:
+        data (dict): содержимое файла профиля
+
+    Returns:
+        dict: полный профиль
+
+    Raises:
+        PerformanceProfileError: если профиль некорректен
+    """
+    if not isinstance(data, dict):
+        raise PerformanceProfileError("Профиль должен быть объектом")
+
+    services = data.get('services', {})
+    for name, section in data.items():
+        if name == 'services':
+            continue
+        if name not in DEFAULT_PROFILE:
+            raise PerformanceProfileError(f"Неизвестная секция '{name}'")
+        _validate_section(name, section, "профиль")
+
+    if not isinstance(services, dict):
+        raise PerformanceProfileError("Секция 'services' должна быть объектом")
+    for service_name, overrides in services.items():
+        if not isinstance(overrides, dict):
+            raise PerformanceProfileError(f"services.{service_name}: ожидается объект")
+        for name, section in overrides.items():
+            if name not in SERVICE_SECTIONS:
+                raise PerformanceProfileError(
+                    f"services.{service_name}: секцию '{name}' нельзя переопределять для сервиса"
+                )
+            _validate_section(name, section, f"services.{service_name}")
+
+    profile = _deep_merge(DEFAULT_PROFILE, {k: v for k, v in data.items() if k != 'services'})
+    if 'video_qualities' in data:
+        # Таблица качеств заменяется целиком, а не сливается
+        profile['video_qualities'] = dict(data['video_qualities'])
+    profile['services'] = copy.deepcopy(services)
+    return profile
+
+
+class PerformanceProfile:
+    """Профиль производительности, загружаемый из JSON/TOML с горячей перезагрузкой.
+
+    Каждая успешная загрузка увеличивает version; уже запущенные задачи
+    продолжают работать со своими настройками, новые получают свежие.
+    Некорректный файл при перезагрузке отклоняется, действующий профиль
+    сохраняется.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.version = 0
+        self._data = validate_profile({})
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._watcher = None
+        self._stop_event = threading.Event()
+
+    def load(self):
+        """Загружает профиль из файла (при отсутствии файла - значения по умолчанию)"""
+        if not self.path or not os.path.exists(self.path):
+            data, mtime = {}, None
+        else:
+            mtime = os.path.getmtime(self.path)
+            data = self._read_file(self.path)
+
+        profile = validate_profile(data)
+        with self._lock:
+            self._data = profile
+            self._mtime = mtime
+            self.version += 1
+        logger.info("Профиль производительности загружен (версия %d): %s", self.version, self.path or "по умолчанию")
+
+        for listener in list(self._listeners):
+            try:
+                listener(self)
+            except Exception as e:
+                logger.error("Ошибка обработчика перезагрузки профиля: %s", e)
+        return self
+
+    @staticmethod
+    def _read_file(path):
+        try:
+            if path.endswith('.toml'):
+                if tomllib is None:
+                    raise PerformanceProfileError("Для TOML-профиля нужен Python 3.11+")
+                with open(path, 'rb') as f:
+                    return tomllib.load(f)
+            with open(path, 'r', encoding='utf-8-sig') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            if isinstance(e, PerformanceProfileError):
+                raise
+            raise PerformanceProfileError(f"Не удалось прочитать профиль {path}: {e}")
+
+    def reload_if_changed(self):
+        """Перезагружает профиль, если файл изменился; возвращает True при перезагрузке"""
+        if not self.path:
+            return False
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if mtime == self._mtime:
+            return False
+        try:
+            self.load()
+            return True
+        except PerformanceProfileError as e:
+            # Запоминаем время, чтобы не повторять ошибку до следующего изменения файла
+            self._mtime = mtime
+            logger.error("Профиль не перезагружен, используется предыдущий: %s", e)
+            return False
+
+    def start_watching(self, interval=2.0):
+        """Запускает фоновую проверку файла профиля на изменения"""
+        if self._watcher:
+            return
+
+        def watch():
+            while not self._stop_event.wait(interval):
+                self.reload_if_changed()
+
+        self._watcher = threading.Thread(target=watch, name='perf-profile-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop_event.set()
+
+    def add_listener(self, listener):
+        """Регистрирует функцию, вызываемую после каждой успешной загрузки"""
+        self._listeners.append(listener)
+
+    def section(self, name, service=None):
+        """Возвращает копию секции с учетом переопределений для сервиса"""
+        with self._lock:
+            values = dict(self._data[name])
+            if service:
+                values.update(self._data['services'].get(service, {}).get(name, {}))
+        return values
+
+    def get(self, name, key, service=None):
+        """Возвращает одно значение профиля"""
+        return self.section(name, service)[key]
+
+
+_profile = None
+_profile_lock = threading.Lock()
+
+
+def get_profile():
+    """Возвращает общий профиль производительности приложения"""
+    global _profile
+    with _profile_lock:
+        if _profile is None:
+            _profile = PerformanceProfile(AppConfig.PERFORMANCE_PROFILE)
+            try:
+                _profile.load()
+            except PerformanceProfileError as e:
+                logger.error("%s; используются значения по умолчанию", e)
+        return _profile
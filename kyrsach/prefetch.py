@@ -0,0 +1,134 @@
+﻿import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, CancelledError, TimeoutError
+
+from url_validator import URLValidator
+from ydl_pool import YoutubeDLPool
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataPrefetcher:
+    """Фоновое извлечение метаданных, пока пользователь вводит или вставляет ссылку.
+
+    Извлечение выполняется без выбора форматов (process=False), поэтому
+    результат подходит для любого типа и качества загрузки. Одновременно
+    выполняется не более одного извлечения; новая ссылка отменяет ожидающее,
+    а результат уже начатого устаревшего извлечения отбрасывается.
+    """
+
+    def __init__(self, max_entries=64, ttl=900):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._pending_url = None
+        self._pending_future = None
+        # Один поток - значит, и пул экземпляров YoutubeDL используется только им
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        self._ydl_pool = YoutubeDLPool(max_size=2)
+
+    def prefetch(self, url, on_ready=None):
+        """
+        Запускает фоновое извлечение для URL, отменяя предыдущее.
+
+        Args:
+            url (str): проверенный URL
+            on_ready (callable): вызывается с info_dict в фоновом потоке, если URL не устарел
+        """
+        with self._lock:
+            if url == self._pending_url or self._fresh(url):
+                return
+            self._cancel_locked()
+            self._generation += 1
+            generation = self._generation
+            self._pending_url = url
+            self._pending_future = self._executor.submit(self._extract, url, generation, on_ready)
+
+    def cancel(self):
+        """Отменяет текущее извлечение (текст в поле ввода изменился)"""
+        with self._lock:
+            self._cancel_locked()
+            self._generation += 1
+
+    def _cancel_locked(self):
+        if self._pending_future is not None:
+            self._pending_future.cancel()
+        self._pending_future = None
+        self._pending_url = None
+
+    def _fresh(self, url):
+        entry = self._cache.get(url)
+        return entry is not None and entry[0] + self.ttl > time.monotonic()
+
+    def _extract(self, url, generation, on_ready):
+        with self._lock:
+            if generation != self._generation:
+                return None
+
+        service_name, _ = URLValidator.detect_service(url)
+        pooled = self._ydl_pool.acquire(service_name, "Видео (MP4)", "⚡ Автоматически")
+        pooled.ydl.params['quiet'] = True
+        try:
+            info = pooled.ydl.extract_info(url, download=False, process=False)
+        except Exception as e:
+            self._ydl_pool.discard(pooled)
+            logger.debug("Предзагрузка метаданных не удалась для %s: %s", url, e)
+            return None
+
+        with self._lock:
+            if generation != self._generation:
+                logger.debug("Предзагрузка устарела, результат отброшен: %s", url)
+                return None
+            self._cache[url] = (time.monotonic(), info)
+            self._cache.move_to_end(url)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+            self._pending_url = None
+            self._pending_future = None
+
+        logger.debug("Метаданные предзагружены: %s", url)
+        if on_ready:
+            on_ready(info)
+        return info
+
+    def get(self, url, timeout=None):
+        """
+        Возвращает копию предзагруженного info_dict для URL.
+
+        Args:
+            url (str): URL
+            timeout (float): сколько ждать, если извлечение этого URL еще идет
+
+        Returns:
+            Optional[dict]: info_dict без выбора форматов или None
+        """
+        with self._lock:
+            if self._fresh(url):
+                return copy.deepcopy(self._cache[url][1])
+            future = self._pending_future if url == self._pending_url else None
+
+        if future is None or not timeout:
+            return None
+        try:
+            info = future.result(timeout=timeout)
+        except (CancelledError, TimeoutError):
+            return None
+        return copy.deepcopy(info) if info else None
+
+    def put(self, url, info):
+        """Кладет в кэш метаданные, извлеченные в другом месте (родительским процессом)"""
+        with self._lock:
+            self._cache[url] = (time.monotonic(), info)
+            self._cache.move_to_end(url)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def close(self):
+        """Останавливает фоновое извлечение"""
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
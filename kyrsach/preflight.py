@@ -0,0 +1,193 @@
+﻿import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Короткие ссылки, которые нужно развернуть до конечного адреса
+SHORT_LINK_HOSTS = ('youtu.be', 'vm.tiktok.com', 'vt.tiktok.com', 'fb.watch', 'instagr.am')
+
+# Состояния ссылки после проверки: доступна, неизвестно (сервис ограничивает запросы,
+# не отвечает на HEAD или не успел ответить - решает yt-dlp) и точно недоступна
+ALIVE = 'ok'
+UNKNOWN = 'unknown'
+DEAD = 'dead'
+
+# Ответы, которые сервисы отдают на HEAD и запросы, похожие на ботов, при живой ссылке
+UNKNOWN_STATUSES = (401, 403, 405, 408, 429)
+
+# Страницы согласия и входа, на которые редиректят короткие ссылки вместо самого видео
+INTERSTITIAL_HOST_PREFIXES = ('consent.', 'accounts.', 'login.')
+
+PREFLIGHT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+}
+
+
+class URLPreflight:
+    """Массовая предварительная проверка доступности URL.
+
+    Запросы к одному хосту идут через общую keep-alive сессию с ограниченным
+    числом параллельных соединений, редиректы и короткие ссылки
+    разворачиваются, результаты кэшируются на cache_ttl секунд (устаревшие
+    удаляются). Недоступной считается только ссылка, которой точно нет
+    (404, 410, ошибка соединения); ограничение запросов, ошибки сервера и
+    таймауты дают состояние UNKNOWN.
+    """
+
+    def __init__(self, max_workers=32, per_host_connections=4, timeout=5, cache_ttl=600):
+        self.max_workers = max_workers
+        self.per_host_connections = per_host_connections
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self._sessions = {}
+        self._host_limits = {}
+        self._cache = {}
+        self._last_eviction = time.time()
+        self._lock = threading.Lock()
+
+    def _session_for(self, host):
+        """Возвращает keep-alive сессию и семафор для хоста"""
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.headers.update(PREFLIGHT_HEADERS)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.per_host_connections)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+                self._host_limits[host] = threading.Semaphore(self.per_host_connections)
+            return session, self._host_limits[host]
+
+    def _cached(self, url):
+        with self._lock:
+            entry = self._cache.get(url)
+            if entry is None:
+                return None
+            if entry['checked_at'] + self.cache_ttl > time.time():
+                return entry
+            del self._cache[url]
+        return None
+
+    def _evict_expired(self, now):
+        """Удаляет устаревшие результаты; вызывается под self._lock не чаще раза за cache_ttl"""
+        if now - self._last_eviction < self.cache_ttl:
+            return
+        self._last_eviction = now
+        expired = [url for url, entry in self._cache.items() if entry['checked_at'] + self.cache_ttl <= now]
+        for url in expired:
+            del self._cache[url]
+
+    def check(self, url, timeout=None):
+        """
+        Проверяет один URL с учетом кэша.
+
+        Args:
+            url (str): URL для проверки
+            timeout (float): таймаут запроса в секундах
+
+        Returns:
+            Dict[str, Any]: url, final_url, state (ALIVE, UNKNOWN или DEAD), ok (state == ALIVE),
+                status, error, is_short_link, checked_at
+        """
+        cached = self._cached(url)
+        if cached:
+            return cached
+
+        host = urlparse(url).netloc.lower()
+        session, host_limit = self._session_for(host)
+        result = {
+            'url': url,
+            'final_url': url,
+            'state': DEAD,
+            'ok': False,
+            'status': None,
+            'error': None,
+            'is_short_link': host.split(':')[0] in SHORT_LINK_HOSTS,
+            'checked_at': time.time()
+        }
+
+        try:
+            with host_limit:
+                response = session.head(url, timeout=timeout or self.timeout, allow_redirects=True)
+                if response.status_code in (403, 405, 501):
+                    # Некоторые сервисы не отвечают на HEAD - проверяем GET без чтения тела
+                    response = session.get(url, timeout=timeout or self.timeout,
+                                           allow_redirects=True, stream=True)
+                    response.close()
+            result['status'] = response.status_code
+            result['final_url'] = response.url
+            if response.status_code < 400:
+                result['state'] = ALIVE
+            elif response.status_code in UNKNOWN_STATUSES or response.status_code >= 500:
+                result['state'] = UNKNOWN
+        except requests.Timeout as e:
+            result['state'] = UNKNOWN
+            result['error'] = str(e)
+            logger.info("URL не ответил за отведенное время, проверку оставляем yt-dlp %s: %s", url, e)
+        except requests.RequestException as e:
+            result['error'] = str(e)
+            logger.warning("URL недоступен %s: %s", url, e)
+        result['ok'] = result['state'] == ALIVE
+
+        with self._lock:
+            self._evict_expired(result['checked_at'])
+            self._cache[url] = result
+            # Конечный адрес тоже считаем проверенным
+            if result['ok'] and result['final_url'] != url:
+                self._cache.setdefault(result['final_url'], {**result, 'url': result['final_url']})
+        return result
+
+    def check_many(self, urls, progress_callback=None):
+        """
+        Проверяет набор URL параллельно.
+
+        Args:
+            urls (Iterable[str]): URL для проверки (дубликаты проверяются один раз)
+            progress_callback (callable): вызывается с (проверено, всего) по мере проверки
+
+        Returns:
+            Dict[str, Dict[str, Any]]: результат проверки для каждого URL
+        """
+        unique_urls = list(dict.fromkeys(urls))
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='preflight') as executor:
+            for done, result in enumerate(executor.map(self.check, unique_urls), start=1):
+                results[result['url']] = result
+                if progress_callback:
+                    progress_callback(done, len(unique_urls))
+
+        dead = sum(1 for result in results.values() if result['state'] == DEAD)
+        unknown = sum(1 for result in results.values() if result['state'] == UNKNOWN)
+        logger.info("Предварительная проверка: %d URL, недоступно %d, не удалось проверить %d",
+                    len(results), dead, unknown)
+        return results
+
+    def close(self):
+        """Закрывает все сессии"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+def resolved_url(result):
+    """
+    Ссылка для загрузки по результату проверки: развернутая для коротких ссылок.
+
+    Конечный адрес берется, только если короткая ссылка ответила успешно и привела
+    не на страницу согласия или входа; иначе остается исходная ссылка.
+    """
+    if not result['is_short_link'] or result['state'] != ALIVE:
+        return result['url']
+    final = urlparse(result['final_url'])
+    if final.netloc.lower().startswith(INTERSTITIAL_HOST_PREFIXES) or final.path in ('', '/'):
+        return result['url']
+    return result['final_url']
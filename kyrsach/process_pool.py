@@ -0,0 +1,399 @@
+﻿import logging
+import multiprocessing
+import pickle
+import threading
+import time
+
+from disk_space import InsufficientDiskSpace
+
+logger = logging.getLogger(__name__)
+
+# Текущий объем памяти процесса (необязательная зависимость psutil)
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Процессы запускаются через spawn: fork процесса с Tk и потоками небезопасен
+_context = multiprocessing.get_context('spawn')
+
+# Не чаще, чем раз в столько секунд, дочерний процесс отправляет прогресс (кроме смены статуса)
+PROGRESS_INTERVAL = 0.1
+
+# Раз в столько секунд дочерний процесс сообщает, что жив, и присылает отметку прогресса задачи:
+# пульс идет из отдельного потока, поэтому сам по себе не доказывает, что задача продвигается
+HEARTBEAT_INTERVAL = 5.0
+
+# Поля задачи, которые не передаются между процессами
+LOCAL_FIELDS = ('streams', 'checksums', 'subscribers')
+
+
+class WorkerCrashed(Exception):
+    """Процесс загрузки упал или завис и был убит, не завершив задачу"""
+
+
+class _ChildConnection:
+    """Канал дочернего процесса: сообщения отправляют несколько потоков (лог, прогресс потоков, пульс)"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._send_lock = threading.Lock()
+
+    def send(self, message):
+        with self._send_lock:
+            self.conn.send(message)
+
+    def recv(self):
+        return self.conn.recv()
+
+
+class _RemoteDiskGuard:
+    """Резервирование места через родительский процесс.
+
+    Резервы всех процессов загрузки должны быть видны одному DiskSpaceGuard,
+    иначе параллельные задачи в разных процессах не учитывают друг друга.
+    Вызывается только из основного потока дочернего процесса, который
+    в это время больше ничего не читает из канала.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.free_margin_bytes = 0
+
+    def reserve(self, job_id, path, size_bytes, should_stop=None, on_wait=None):
+        # Ожидание и его отображение в строке задачи ведет родитель
+        self.conn.send(('reserve', job_id, path, size_bytes))
+        _, reserved, error = self.conn.recv()
+        if error:
+            raise InsufficientDiskSpace(error)
+        return reserved
+
+    def written(self, job_id, written_bytes):
+        # Записанное родитель учитывает по сообщениям прогресса
+        pass
+
+    def release(self, job_id):
+        self.conn.send(('release', job_id))
+
+
+def _rss_bytes():
+    """Память процесса: текущая через psutil или пиковая через resource; None, если узнать нечем"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if resource is not None:
+        # ru_maxrss в Linux - в килобайтах
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def _portable(download_info):
+    """Копия словаря задачи без полей, которые нельзя передать через канал"""
+    return {key: value for key, value in download_info.items() if key not in LOCAL_FIELDS}
+
+
+class _PipeLogHandler(logging.Handler):
+    """Пересылает записи лога дочернего процесса в родительский"""
+
+    def __init__(self, conn):
+        super().__init__()
+        self.conn = conn
+
+    def emit(self, record):
+        try:
+            # Сообщение форматируется здесь: аргументы и исключения могут не пережить pickle
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.conn.send(('log', record))
+        except Exception:
+            self.handleError(record)
+
+
+def _progress_mark(download_info):
+    """Отметка прогресса задачи: меняется, пока задача продвигается (байты, процент, статус)"""
+    if download_info is None:
+        return None
+    return (download_info.get('status'), download_info.get('downloaded_bytes'), download_info.get('progress'))
+
+
+def _in_processing(mark):
+    """Загрузка завершена, идут слияние, перекодирование или запись MP3 - без прогресса в байтах"""
+    return mark is not None and (mark[2] or 0) >= 100
+
+
+def _heartbeat(conn, stopped, current):
+    """Поток дочернего процесса: сообщает родителю, что процесс жив, и отметку прогресса текущей задачи.
+
+    Отметка берется прямо из задачи: обновления прогресса прореживаются, пульс доносит последнее.
+    """
+    while not stopped.wait(HEARTBEAT_INTERVAL):
+        try:
+            conn.send(('alive', _progress_mark(current.get('job'))))
+        except (OSError, ValueError):
+            return
+
+
+def _child_main(conn, log_levels):
+    """Точка входа процесса загрузки: выполняет задачи по одной, пока родитель не пришлет stop"""
+    # Импорт здесь: модуль менеджера сам импортирует этот модуль
+    from download_manager import DownloadManager
+    from log_setup import apply_levels
+    from ydl_pool import YoutubeDLPool
+
+    conn = _ChildConnection(conn)
+
+    # Записи yt-dlp тоже доходят до корневого логгера и уходят родителю
+    logging.getLogger().handlers[:] = [_PipeLogHandler(conn)]
+    apply_levels(log_levels)
+
+    last_sent = {'time': 0.0, 'status': None}
+
+    def on_progress(download_id, progress, speed, status, filename):
+        now = time.monotonic()
+        if status == last_sent['status'] and now - last_sent['time'] < PROGRESS_INTERVAL:
+            return
+        last_sent.update(time=now, status=status)
+        download_info = manager.active_downloads.get(download_id)
+        if download_info is not None:
+            conn.send(('progress', download_id, _portable(download_info)))
+
+    results = {}
+
+    def on_completion(download_id, success, message, result):
+        # Файлы и контрольные суммы уходят родителю вместе с полями задачи
+        results[download_id] = (success, message)
+
+    manager = DownloadManager(on_progress, on_completion, start_workers=False)
+    manager.disk_guard = _RemoteDiskGuard(conn)
+    ydl_pool = YoutubeDLPool()
+    stopped = threading.Event()
+    current = {}
+    threading.Thread(target=_heartbeat, args=(conn, stopped, current), name='heartbeat', daemon=True).start()
+    try:
+        while True:
+            message = conn.recv()
+            if message[0] == 'stop':
+                break
+            _, download_info, prefetched, profiling = message
+            download_id = download_info['id']
+            download_info['streams'] = None
+            download_info['checksums'] = None
+            download_info['subscribers'] = [download_id]
+            manager.active_downloads[download_id] = download_info
+            if prefetched:
+                # Метаданные, предзагруженные родителем при вводе ссылки
+                manager.prefetcher.put(manager._clean_url(download_info['url']), prefetched)
+            if profiling:
+                # Решение о профилировании и его настройки - родительские (их меняет GUI)
+                manager.profiler.configure(**profiling)
+            last_sent['status'] = None
+            current['job'] = download_info
+            try:
+                with manager.profiler.profile_job(download_id, download_info['service'], selected=bool(profiling)):
+                    manager._download_worker(download_info, ydl_pool)
+            finally:
+                current.pop('job', None)
+            success, text = results.pop(download_id, (False, "Загрузка прервана"))
+            conn.send(('done', download_id, success, text, _portable(download_info), _rss_bytes()))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        stopped.set()
+        ydl_pool.close()
+        manager.prefetcher.close()
+
+
+class WorkerProcess:
+    """Один процесс загрузки из пула, обслуживаемый одним потоком менеджера.
+
+    Задача уходит в процесс по каналу, обратно идут записи лога, прогресс,
+    запросы резерва места на диске и результат. Зависшим считается процесс,
+    переставший присылать сигнал "жив", и задача, прогресс которой (байты,
+    процент, статус) долго не меняется, хотя процесс жив: застрявший
+    экстрактор или сокет не мешают потоку пульса. Такой процесс убивается;
+    процесс пересоздается после max_jobs задач или когда его память превысила
+    лимит. Падение процесса (в том числе аварийное завершение экстрактора)
+    превращается в ошибку одной задачи.
+    """
+
+    def __init__(self, name, log_levels, target=_child_main):
+        self.name = name
+        self.log_levels = dict(log_levels)
+        self.target = target
+        self.process = None
+        self.conn = None
+        self.jobs_done = 0
+
+    def _spawn(self):
+        parent_conn, child_conn = _context.Pipe()
+        process = _context.Process(
+            target=self.target, args=(child_conn, self.log_levels), name=self.name, daemon=True
+        )
+        try:
+            process.start()
+        except BaseException:
+            parent_conn.close()
+            raise
+        finally:
+            child_conn.close()
+        # Состояние меняется только после успешного запуска: stop() и kill() не видят полузапущенный процесс
+        self.process = process
+        self.conn = parent_conn
+        self.jobs_done = 0
+        logger.info("Запущен процесс загрузки %s (pid %s)", self.name, self.process.pid)
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def run(self, download_info, on_progress, stop_event, hang_timeout, disk_guard,
+            prefetched=None, profiling=None, processing_timeout=None):
+        """
+        Выполняет задачу в процессе и ждет результата.
+
+        Args:
+            download_info (dict): задача менеджера; обновляется данными из процесса
+            on_progress (callable): вызывается после каждого обновления прогресса
+            stop_event (threading.Event): остановка менеджера; процесс при этом убивается
+            hang_timeout (float): сколько секунд без продвижения задачи (или без сигналов "жив") считать зависанием
+            disk_guard (DiskSpaceGuard): общий для всех процессов контроль места на диске
+            prefetched (dict): предзагруженные метаданные ссылки или None
+            profiling (dict): настройки профилирования, если задача выбрана для него, иначе None
+            processing_timeout (float): то же для слияния и перекодирования после загрузки; по умолчанию hang_timeout
+
+        Returns:
+            Tuple[bool, str, int]: (успех, сообщение, память процесса в байтах или None)
+
+        Raises:
+            WorkerCrashed: процесс упал или завис; он уже убит и будет запущен заново
+        """
+        if not self.alive:
+            self._spawn()
+
+        try:
+            self.conn.send(('job', _portable(download_info), prefetched, profiling))
+        except (TypeError, AttributeError, pickle.PicklingError) as e:
+            # Метаданные плейлиста могут содержать ленивые списки записей; процесс извлечет их сам
+            logger.debug("Предзагруженные метаданные не передаются в процесс: %s", e)
+            self.conn.send(('job', _portable(download_info), None, profiling))
+        processing_timeout = processing_timeout or hang_timeout
+        # Пульс доказывает только, что процесс жив; зависание задачи определяется по ее прогрессу
+        last_alive = last_progress = time.monotonic()
+        mark = None
+        while True:
+            if stop_event.is_set():
+                self.kill("остановка менеджера")
+                return False, "Загрузка остановлена", None
+
+            # Проверки идут на каждой итерации: пульс приходит чаще, чем истекает любой из сроков
+            now = time.monotonic()
+            if now - last_alive > hang_timeout:
+                self.kill(f"нет ответа {hang_timeout:.0f} с")
+                raise WorkerCrashed("Ошибка: Процесс загрузки перестал отвечать и был прерван")
+            limit = processing_timeout if _in_processing(mark) else hang_timeout
+            if now - last_progress > limit:
+                self.kill(f"нет прогресса {limit:.0f} с")
+                raise WorkerCrashed("Ошибка: Загрузка зависла и была прервана")
+
+            try:
+                ready = self.conn.poll(0.5)
+                message = self.conn.recv() if ready else None
+            except (EOFError, OSError):
+                # Даем процессу завершиться, чтобы узнать код выхода
+                self.process.join(1.0)
+                code = self.process.exitcode
+                self.kill("канал закрыт")
+                raise WorkerCrashed(f"Ошибка: Процесс загрузки аварийно завершился (код {code})")
+            if message is None:
+                continue
+
+            now = last_alive = time.monotonic()
+            kind = message[0]
+            new_mark = None
+            if kind == 'alive':
+                new_mark = message[1]
+            elif kind == 'reserve':
+                self._reserve(message, download_info, on_progress, stop_event, disk_guard)
+                # Ожидание места - не зависание
+                last_alive = last_progress = time.monotonic()
+            elif kind == 'release':
+                disk_guard.release(message[1])
+            elif kind == 'log':
+                record = message[1]
+                logging.getLogger(record.name).handle(record)
+            elif kind == 'progress':
+                download_info.update(message[2])
+                on_progress()
+                new_mark = _progress_mark(message[2])
+            elif kind == 'done':
+                _, _, success, text, fields, rss = message
+                download_info.update(fields)
+                self.jobs_done += 1
+                return success, text, rss
+
+            if new_mark is not None and new_mark != mark:
+                mark = new_mark
+                last_progress = now
+
+    def _reserve(self, message, download_info, on_progress, stop_event, disk_guard):
+        """Резервирует место по запросу процесса и отвечает ему"""
+        _, key, path, size = message
+
+        def on_wait():
+            download_info['status'] = 'Ожидает места на диске'
+            on_progress()
+
+        try:
+            reserved = disk_guard.reserve(key, path, size, should_stop=stop_event.is_set, on_wait=on_wait)
+            reply = ('reserved', reserved, None)
+        except InsufficientDiskSpace as e:
+            reply = ('reserved', False, str(e))
+        if download_info['status'] == 'Ожидает места на диске':
+            download_info['status'] = 'Загружается'
+            on_progress()
+        self.conn.send(reply)
+
+    def recycle_if_needed(self, max_jobs, max_memory_bytes, rss):
+        """Перезапускает процесс после max_jobs задач или при превышении памяти"""
+        if not self.alive:
+            return
+        if max_jobs and self.jobs_done >= max_jobs:
+            self.stop(f"выполнено задач: {self.jobs_done}")
+        elif max_memory_bytes and rss and rss > max_memory_bytes:
+            self.stop(f"память {rss / 1024 ** 2:.0f} МБ")
+
+    def stop(self, reason="", timeout=5.0):
+        """Штатно завершает процесс; если он не выходит - убивает"""
+        if self.process is None:
+            return
+        logger.info("Перезапуск процесса загрузки %s: %s", self.name, reason or "остановка")
+        if self.conn is not None:
+            try:
+                self.conn.send(('stop',))
+            except (OSError, ValueError):
+                pass
+        self.process.join(timeout)
+        self.kill(reason)
+
+    def kill(self, reason=""):
+        """Немедленно убивает процесс (зависание, остановка приложения)"""
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            logger.warning("Процесс загрузки %s (pid %s) убит: %s", self.name, self.process.pid, reason)
+            self.process.kill()
+        self.process.join(1.0)
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except OSError:
+                pass
+        self.process = None
+        self.conn = None
@@ -0,0 +1,279 @@
+﻿import argparse
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from config import AppConfig
+
+logger = logging.getLogger(__name__)
+
+# Настройки по умолчанию: профилирование выключено
+DEFAULT_SETTINGS = {
+    'enabled': False,
+    'job_ids': [],
+    'services': [],
+    'sample_rate': 0.0,
+    'tracemalloc': True,
+    'main_thread': False,
+}
+
+# Сколько строк попадает в текстовую сводку
+SUMMARY_LINES = 30
+
+
+class JobProfiler:
+    """Выборочное профилирование задач загрузки и главного потока Tk.
+
+    Задача профилируется, если профилирование включено и совпал ее ID,
+    сервис или сработала выборка с заданной вероятностью. Результат
+    сохраняется в папку профилей: .prof (cProfile, открывается pstats/snakeviz),
+    .tracemalloc (снимок аллокаций) и .txt с краткой сводкой.
+
+    Настройки меняются на лету через configure() из GUI или через файл
+    управления, который пишет CLI (python profiling.py on ...).
+    """
+
+    def __init__(self, output_dir=AppConfig.PROFILE_FOLDER, control_file=AppConfig.PROFILING_CONTROL_FILE):
+        self.output_dir = output_dir
+        self.control_file = control_file
+        self.settings = dict(DEFAULT_SETTINGS)
+        self._lock = threading.Lock()
+        self._control_mtime = None
+        self._tracemalloc_users = 0
+        self._tracemalloc_owned = False
+        self._main_profile = None
+        self._main_started = None
+        self.reload_if_changed()
+
+    def configure(self, **settings):
+        """Меняет настройки профилирования во время работы"""
+        with self._lock:
+            for key, value in settings.items():
+                if key not in DEFAULT_SETTINGS:
+                    raise ValueError(f"Неизвестный параметр профилирования '{key}'")
+                self.settings[key] = value
+        logger.info("Профилирование: %s", self.settings)
+
+    def reload_if_changed(self):
+        """Подхватывает файл управления, если он изменился; возвращает True при изменении"""
+        try:
+            mtime = os.stat(self.control_file).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._control_mtime:
+            return False
+        self._control_mtime = mtime
+
+        try:
+            with open(self.control_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            settings = {key: data[key] for key in DEFAULT_SETTINGS if key in data}
+            self.configure(**settings)
+            return True
+        except (OSError, ValueError) as e:
+            logger.warning("Не удалось прочитать файл управления профилированием %s: %s", self.control_file, e)
+            return False
+
+    @property
+    def enabled(self):
+        return self.settings['enabled']
+
+    def should_profile(self, job_id, service):
+        """Решает, профилировать ли задачу"""
+        settings = self.settings
+        if not settings['enabled']:
+            return False
+        if job_id in settings['job_ids'] or service in settings['services']:
+            return True
+        return settings['sample_rate'] > 0 and random.random() < settings['sample_rate']
+
+    def _output_prefix(self, name):
+        os.makedirs(self.output_dir, exist_ok=True)
+        return os.path.join(self.output_dir, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}")
+
+    def _start_tracemalloc(self):
+        """Запускает tracemalloc; он общий для процесса, поэтому считаем пользователей"""
+        with self._lock:
+            if not self.settings['tracemalloc']:
+                return None
+            if self._tracemalloc_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+                self._tracemalloc_owned = True
+            self._tracemalloc_users += 1
+        return tracemalloc.take_snapshot()
+
+    def _stop_tracemalloc(self):
+        with self._lock:
+            self._tracemalloc_users -= 1
+            if self._tracemalloc_users == 0 and self._tracemalloc_owned:
+                tracemalloc.stop()
+                self._tracemalloc_owned = False
+
+    @staticmethod
+    def _start_cprofile():
+        """Включает cProfile для текущего потока; None, если профилировщик уже занят"""
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Начиная с Python 3.12 в процессе может работать только один cProfile
+            logger.warning("cProfile недоступен: %s", e)
+            return None
+        return profile
+
+    def _save(self, prefix, profile, snapshot_before, elapsed, title):
+        """Сохраняет профиль, снимок аллокаций и текстовую сводку"""
+        summary = io.StringIO()
+        summary.write(f"{title}\nДлительность: {elapsed:.3f} с\n\n")
+
+        if profile is not None:
+            profile.dump_stats(f"{prefix}.prof")
+            stats = pstats.Stats(profile, stream=summary)
+            stats.sort_stats('cumulative').print_stats(SUMMARY_LINES)
+
+        if snapshot_before is not None:
+            snapshot = tracemalloc.take_snapshot()
+            snapshot.dump(f"{prefix}.tracemalloc")
+            summary.write("\nРост памяти по строкам:\n")
+            for stat in snapshot.compare_to(snapshot_before, 'lineno')[:SUMMARY_LINES]:
+                summary.write(f"{stat}\n")
+
+        with open(f"{prefix}.txt", 'w', encoding='utf-8') as f:
+            f.write(summary.getvalue())
+        logger.info("Профиль сохранен: %s.*", prefix)
+
+    @contextmanager
+    def profile_job(self, job_id, service, selected=None):
+        """
+        Оборачивает выполнение задачи в cProfile и tracemalloc, если она выбрана.
+
+        selected - уже принятое решение (процесс загрузки получает его от родителя);
+        None - решить по настройкам через should_profile.
+        """
+        if selected is None:
+            selected = self.should_profile(job_id, service)
+        if not selected:
+            yield None
+            return
+
+        prefix = self._output_prefix(f"job_{job_id}_{service or 'unknown'}")
+        snapshot_before = self._start_tracemalloc()
+        profile = self._start_cprofile()
+        started = time.perf_counter()
+        try:
+            yield prefix
+        finally:
+            if profile is not None:
+                profile.disable()
+            try:
+                self._save(prefix, profile, snapshot_before, time.perf_counter() - started,
+                           f"Задача {job_id} ({service})")
+            except Exception as e:
+                logger.warning("Не удалось сохранить профиль задачи %s: %s", job_id, e)
+            finally:
+                if snapshot_before is not None:
+                    self._stop_tracemalloc()
+
+    @property
+    def main_thread_active(self):
+        return self._main_profile is not None
+
+    def start_main_thread(self):
+        """Начинает профилирование главного потока; вызывать из потока Tk"""
+        if self._main_profile is not None:
+            return
+        snapshot_before = self._start_tracemalloc()
+        profile = self._start_cprofile()
+        if profile is None:
+            if snapshot_before is not None:
+                self._stop_tracemalloc()
+            return
+        self._main_profile = (profile, snapshot_before)
+        self._main_started = time.perf_counter()
+
+    def stop_main_thread(self):
+        """Завершает профилирование главного потока и возвращает префикс файлов"""
+        if self._main_profile is None:
+            return None
+        profile, snapshot_before = self._main_profile
+        profile.disable()
+        self._main_profile = None
+
+        prefix = self._output_prefix("main_thread")
+        try:
+            self._save(prefix, profile, snapshot_before, time.perf_counter() - self._main_started, "Главный поток Tk")
+        finally:
+            if snapshot_before is not None:
+                self._stop_tracemalloc()
+        return prefix
+
+    def sync_main_thread(self):
+        """Включает или выключает профилирование главного потока согласно настройкам"""
+        wanted = self.settings['enabled'] and self.settings['main_thread']
+        if wanted and not self.main_thread_active:
+            self.start_main_thread()
+        elif not wanted and self.main_thread_active:
+            return self.stop_main_thread()
+        return None
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler():
+    """Возвращает общий профилировщик приложения"""
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = JobProfiler()
+        return _profiler
+
+
+def _write_control(settings):
+    with open(AppConfig.PROFILING_CONTROL_FILE, 'w', encoding='utf-8') as f:
+        json.dump(settings, f, ensure_ascii=False, indent=4)
+
+
+def main():
+    """CLI для включения профилирования в работающем приложении"""
+    parser = argparse.ArgumentParser(description="Управление профилированием Video Downloader Pro")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    enable = subparsers.add_parser('on', help="Включить профилирование")
+    enable.add_argument('--job', action='append', default=[], help="ID задачи (можно несколько раз)")
+    enable.add_argument('--service', action='append', default=[], help="Сервис (можно несколько раз)")
+    enable.add_argument('--sample-rate', type=float, default=0.0, help="Доля случайно выбранных задач, 0..1")
+    enable.add_argument('--main-thread', action='store_true', help="Профилировать главный поток Tk")
+    enable.add_argument('--no-tracemalloc', action='store_true', help="Не собирать снимки аллокаций")
+
+    subparsers.add_parser('off', help="Выключить профилирование")
+
+    args = parser.parse_args()
+    if args.command == 'on':
+        if not 0.0 <= args.sample_rate <= 1.0:
+            parser.error("--sample-rate должен быть в диапазоне 0..1")
+        settings = {
+            'enabled': True,
+            'job_ids': args.job,
+            'services': args.service,
+            'sample_rate': args.sample_rate,
+            'tracemalloc': not args.no_tracemalloc,
+            'main_thread': args.main_thread,
+        }
+    else:
+        settings = dict(DEFAULT_SETTINGS)
+    _write_control(settings)
+    print(f"Настройки записаны в {AppConfig.PROFILING_CONTROL_FILE}; приложение подхватит их в течение нескольких секунд")
+
+
+if __name__ == "__main__":
+    main()
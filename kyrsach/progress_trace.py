@@ -0,0 +1,119 @@
+﻿import heapq
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Сколько событий буферизовать перед записью на диск (завершение задачи сбрасывает буфер сразу)
+FLUSH_EVERY = 200
+
+
+class ProgressTraceRecorder:
+    """Записывает события прогресса и завершения в файл JSON lines.
+
+    Каждая строка - одно событие с временем от начала записи и именем
+    потока, который его отправил; `python benchmarks.py gui --replay`
+    воспроизводит такую запись с исходными интервалами и раскладкой по потокам.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'w', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._pending = 0
+        logger.info("Запись событий прогресса в %s", path)
+
+    def _write(self, record, flush=False):
+        record['t'] = round(time.monotonic() - self._started, 4)
+        record['thread'] = threading.current_thread().name
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + '\n')
+            self._pending += 1
+            if flush or self._pending >= FLUSH_EVERY:
+                self._file.flush()
+                self._pending = 0
+
+    def wrap(self, progress_callback, completion_callback):
+        """Возвращает обработчики прогресса и завершения, которые сначала пишут событие в файл"""
+        def on_progress(download_id, progress, speed, status, filename):
+            self._write({'event': 'progress', 'id': download_id, 'progress': progress, 'speed': speed,
+                         'status': status, 'filename': filename})
+            progress_callback(download_id, progress, speed, status, filename)
+
+        def on_completion(download_id, success, message, result=None):
+            self._write({'event': 'completed', 'id': download_id, 'success': success, 'message': message},
+                        flush=True)
+            completion_callback(download_id, success, message, result)
+
+        return on_progress, on_completion
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def load_trace(path):
+    """
+    Читает запись событий и раскладывает ее по потокам-источникам.
+
+    Returns:
+        Dict[str, List[tuple]]: имя потока -> события (t, id, 'progress', progress, speed, status, filename)
+            или (t, id, 'completed', success, message), упорядоченные по времени
+    """
+    threads = defaultdict(list)
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if record['event'] == 'progress':
+                    event = (record['t'], record['id'], 'progress', record['progress'], record['speed'],
+                             record['status'], record['filename'])
+                else:
+                    event = (record['t'], record['id'], 'completed', record['success'], record['message'])
+            except (ValueError, KeyError) as e:
+                logger.warning("%s:%d: пропущена некорректная строка (%s)", path, line_number, e)
+                continue
+            threads[record.get('thread') or 'main'].append(event)
+    for events in threads.values():
+        events.sort(key=lambda event: event[0])
+    return dict(threads)
+
+
+def _synthetic_job(download_id, rate, duration, offset, speed_kb):
+    """События одной синтетической загрузки: rate обновлений в секунду в течение duration и завершение"""
+    updates = max(int(rate * duration), 1)
+    filename = f"{download_id}.mp4"
+    for index in range(updates):
+        progress = (index + 1) / updates * 100
+        yield (offset + index / rate, download_id, 'progress', progress, speed_kb, 'Загружается', filename)
+    yield (offset + updates / rate, download_id, 'completed', True, "")
+
+
+def synthetic_trace(download_ids, threads, rate, duration, speed_kb=2048.0):
+    """
+    Синтетические события, разложенные по потокам так же, как задачи по воркерам менеджера.
+
+    Загрузки одного потока идут одновременно, их начала сдвинуты равномерно
+    в пределах одного интервала обновления. События генерируются лениво, память
+    не зависит от длительности.
+
+    Returns:
+        Dict[str, Iterator[tuple]]: имя потока -> события в формате load_trace
+    """
+    per_thread = defaultdict(list)
+    for index, download_id in enumerate(download_ids):
+        per_thread[f"download-worker-{index % threads}"].append(
+            _synthetic_job(download_id, rate, duration, (index / max(len(download_ids), 1)) / rate, speed_kb)
+        )
+    return {name: heapq.merge(*jobs, key=lambda event: event[0]) for name, jobs in per_thread.items()}
@@ -0,0 +1,246 @@
+﻿import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from yt_dlp.postprocessor import FFmpegPostProcessor, FFmpegVideoRemuxerPP
+from yt_dlp.utils import PostProcessingError, prepend_extension, replace_extension
+
+logger = logging.getLogger(__name__)
+
+# Пути обработки видео
+PATH_NOOP = 'noop'
+PATH_REMUX = 'remux'
+PATH_TRANSCODE = 'transcode'
+
+TARGET_CONTAINER = 'mp4'
+
+# Кодеки, которые можно положить в MP4 без перекодирования
+MP4_VIDEO_CODECS = ('avc1', 'avc3', 'h264', 'hev1', 'hvc1', 'h265', 'hevc', 'av01', 'vp09', 'vp9', 'mp4v')
+MP4_AUDIO_CODECS = ('mp4a', 'aac', 'mp3', 'ac-3', 'ec-3', 'alac', 'opus')
+
+# Во что перекодируются потоки, которые нельзя положить в MP4 как есть
+TRANSCODE_VIDEO_ARGS = ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '20']
+TRANSCODE_AUDIO_ARGS = ['-c:a', 'aac', '-b:a', '192k']
+
+
+def _codec_family(codec):
+    """Нормализует строку кодека: 'avc1.64001F' -> 'avc1', 'none'/None -> None"""
+    if not codec or codec in ('none', 'unknown'):
+        return None
+    return codec.split('.')[0].lower()
+
+
+def _codecs(info):
+    """Семейства видео- и аудиокодеков выбранных форматов"""
+    formats = info.get('requested_formats') or [info]
+    video_codecs = [_codec_family(fmt.get('vcodec')) for fmt in formats]
+    audio_codecs = [_codec_family(fmt.get('acodec')) for fmt in formats]
+    return [codec for codec in video_codecs if codec], [codec for codec in audio_codecs if codec]
+
+
+def transcode_args(info):
+    """Аргументы ffmpeg для перекодирования: совместимые с MP4 потоки копируются, остальные (и неизвестные) кодируются"""
+    video_codecs, audio_codecs = _codecs(info)
+    video_ok = bool(video_codecs) and all(codec in MP4_VIDEO_CODECS for codec in video_codecs)
+    audio_ok = bool(audio_codecs) and all(codec in MP4_AUDIO_CODECS for codec in audio_codecs)
+    return ((['-c:v', 'copy'] if video_ok else TRANSCODE_VIDEO_ARGS)
+            + (['-c:a', 'copy'] if audio_ok else TRANSCODE_AUDIO_ARGS)
+            + ['-movflags', '+faststart'])
+
+
+class FFmpegTranscodePP(FFmpegPostProcessor):
+    """Перекодирование в mp4 с явными кодеками.
+
+    FFmpegVideoConvertorPP пропускает файлы, расширение которых уже mp4,
+    и mp4 с несовместимым кодеком "перекодировал" бы вхолостую. Здесь
+    ffmpeg запускается всегда и пишет во временный файл рядом с итоговым.
+    """
+
+    def run(self, info):
+        filename = info['filepath']
+        outpath = replace_extension(filename, TARGET_CONTAINER, info.get('ext'))
+        temp_path = prepend_extension(outpath, 'temp')
+        try:
+            self.run_ffmpeg(filename, temp_path, transcode_args(info))
+            os.replace(temp_path, outpath)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        info['filepath'] = outpath
+        info['ext'] = TARGET_CONTAINER
+        # Исходный файл удаляется, только если итоговый записан под другим именем
+        return ([filename] if outpath != filename else []), info
+
+
+def choose_video_path(info):
+    """
+    Выбирает путь обработки видео по кодекам и контейнеру выбранного формата.
+
+    Args:
+        info (dict): info_dict после загрузки
+
+    Returns:
+        Tuple[str, str]: (путь обработки, причина выбора)
+    """
+    video_codecs, audio_codecs = _codecs(info)
+    container = (info.get('ext') or '').lower()
+
+    if not video_codecs and not audio_codecs:
+        # Кодеки неизвестны: пробуем ремукс, при неудаче будет перекодирование
+        if container == TARGET_CONTAINER:
+            return PATH_NOOP, "контейнер уже mp4, кодеки неизвестны"
+        return PATH_REMUX, "кодеки неизвестны, пробуем смену контейнера"
+
+    incompatible = [codec for codec in video_codecs if codec not in MP4_VIDEO_CODECS]
+    incompatible += [codec for codec in audio_codecs if codec not in MP4_AUDIO_CODECS]
+    if incompatible:
+        return PATH_TRANSCODE, f"кодеки несовместимы с mp4: {', '.join(incompatible)}"
+
+    if container == TARGET_CONTAINER:
+        return PATH_NOOP, "кодеки и контейнер уже подходят"
+    return PATH_REMUX, f"смена контейнера {container} -> {TARGET_CONTAINER} без перекодирования"
+
+
+class TranscodeCostModel:
+    """Оценка стоимости перекодирования в секундах CPU на секунду медиа.
+
+    Калибруется по фактически выполненным перекодированиям (EWMA),
+    чтобы оценивать сэкономленное время для noop и remux.
+    """
+
+    def __init__(self, cpu_per_media_second=1.5, alpha=0.2):
+        self.cpu_per_media_second = cpu_per_media_second
+        self.alpha = alpha
+        self._lock = threading.Lock()
+
+    def observe_transcode(self, cpu_seconds, duration):
+        if not duration or cpu_seconds <= 0:
+            return
+        with self._lock:
+            sample = cpu_seconds / duration
+            self.cpu_per_media_second += self.alpha * (sample - self.cpu_per_media_second)
+
+    def estimate(self, duration):
+        with self._lock:
+            return (duration or 0) * self.cpu_per_media_second
+
+
+def _children_cpu_time():
+    """Суммарное CPU-время завершенных дочерних процессов всего процесса; на Windows всегда 0"""
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class VideoPathStats:
+    """Счетчики выбранных путей обработки и сэкономленного CPU-времени"""
+
+    def __init__(self):
+        self.counts = {PATH_NOOP: 0, PATH_REMUX: 0, PATH_TRANSCODE: 0}
+        self.cpu_seconds_saved = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, path, cpu_saved):
+        with self._lock:
+            self.counts[path] += 1
+            self.cpu_seconds_saved += cpu_saved
+
+    def snapshot(self):
+        with self._lock:
+            return {'counts': dict(self.counts), 'cpu_seconds_saved': self.cpu_seconds_saved}
+
+
+class VideoOutputProcessor:
+    """Приводит загруженное видео к mp4 самым дешевым подходящим способом.
+
+    CPU-время ffmpeg считается по os.times() - это сумма по всем дочерним
+    процессам. Оно относится к этой обработке, только если за время ее
+    выполнения не шли другие задачи (их слияния, кодирование MP3 и
+    перекодирования тоже дочерние процессы). Поэтому задачи отмечаются
+    через job(), а при параллельных задачах модель стоимости не
+    калибруется и вместо CPU берется время выполнения.
+    """
+
+    def __init__(self, cost_model=None, stats=None):
+        self.cost_model = cost_model or TranscodeCostModel()
+        self.stats = stats or VideoPathStats()
+        self._jobs_lock = threading.Lock()
+        self._running_jobs = 0
+        # Меняется при каждом начале и конце задачи
+        self._jobs_epoch = 0
+
+    @contextmanager
+    def job(self):
+        """Отмечает выполнение задачи, которая может запускать дочерние процессы"""
+        with self._jobs_lock:
+            self._running_jobs += 1
+            self._jobs_epoch += 1
+        try:
+            yield
+        finally:
+            with self._jobs_lock:
+                self._running_jobs -= 1
+                self._jobs_epoch += 1
+
+    def _jobs_state(self):
+        with self._jobs_lock:
+            return self._running_jobs, self._jobs_epoch
+
+    def process(self, ydl, info):
+        """
+        Выполняет выбранный путь обработки для одного загруженного видео.
+
+        Args:
+            ydl: экземпляр YoutubeDL, которым выполнялась загрузка
+            info (dict): info_dict загруженного видео
+
+        Returns:
+            Tuple[dict, dict]: (обновленный info_dict, отчет о выбранном пути)
+        """
+        path, reason = choose_video_path(info)
+        duration = info.get('duration') or 0
+
+        started_wall = time.perf_counter()
+        started_cpu = _children_cpu_time()
+        running, epoch = self._jobs_state()
+
+        if path == PATH_REMUX:
+            try:
+                info = ydl.run_pp(FFmpegVideoRemuxerPP(ydl, preferedformat=TARGET_CONTAINER), info)
+            except PostProcessingError as e:
+                logger.warning("Ремукс не удался (%s), выполняем перекодирование", e)
+                path, reason = PATH_TRANSCODE, f"ремукс не удался: {e}"
+        if path == PATH_TRANSCODE:
+            info = ydl.run_pp(FFmpegTranscodePP(ydl), info)
+
+        cpu_seconds = _children_cpu_time() - started_cpu
+        # Других задач не было ни в начале, ни в течение обработки
+        exclusive = running <= 1 and self._jobs_state() == (running, epoch)
+        measured = exclusive and cpu_seconds > 0
+        if not measured and path != PATH_NOOP:
+            # Нет учета CPU дочерних процессов (Windows) или в нем есть чужие ffmpeg - используем время выполнения
+            cpu_seconds = time.perf_counter() - started_wall
+        elif not exclusive:
+            cpu_seconds = 0.0
+
+        transcode_estimate = self.cost_model.estimate(duration)
+        if path == PATH_TRANSCODE:
+            if measured:
+                self.cost_model.observe_transcode(cpu_seconds, duration)
+            cpu_saved = 0.0
+        else:
+            cpu_saved = max(transcode_estimate - cpu_seconds, 0.0)
+
+        self.stats.record(path, cpu_saved)
+        report = {
+            'path': path,
+            'reason': reason,
+            'cpu_seconds': cpu_seconds,
+            'cpu_measured': measured,
+            'cpu_saved': cpu_saved
+        }
+        logger.info("Обработка видео %s: %s (%s), CPU %.1f с, сэкономлено ~%.1f с",
+                    info.get('id'), path, reason, cpu_seconds, cpu_saved)
+        return info, report
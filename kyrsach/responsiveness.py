@@ -0,0 +1,159 @@
+﻿import bisect
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from config import AppConfig
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограммы задержки, мс; последняя корзина - все, что больше
+LAG_BUCKETS_MS = (16, 33, 50, 100, 250, 500, 1000, 2500)
+
+
+class LagHistogram:
+    """Гистограмма задержек цикла событий с фиксированными корзинами"""
+
+    def __init__(self, bounds=LAG_BUCKETS_MS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.max_ms = 0.0
+
+    def add(self, lag_ms):
+        self.counts[bisect.bisect_left(self.bounds, lag_ms)] += 1
+        self.total += 1
+        if lag_ms > self.max_ms:
+            self.max_ms = lag_ms
+
+    def percentile(self, fraction):
+        """Оценка перцентиля сверху: граница корзины, в которую он попал"""
+        if not self.total:
+            return 0.0
+        target = fraction * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return float(self.bounds[index]) if index < len(self.bounds) else self.max_ms
+        return self.max_ms
+
+    def as_dict(self):
+        labels = [f"<={bound}" for bound in self.bounds] + [f">{self.bounds[-1]}"]
+        return dict(zip(labels, self.counts))
+
+
+class EventLoopWatchdog:
+    """Измеряет отзывчивость главного потока Tk.
+
+    Пульс через root.after с фиксированным интервалом: задержка - на сколько
+    позже запланированного выполнился обратный вызов. Отдельный поток
+    следит за временем последнего пульса и, если главный поток завис дольше
+    порога, пишет в лог стек главного потока прямо во время зависания.
+    """
+
+    def __init__(self, root, interval_ms=AppConfig.WATCHDOG_INTERVAL_MS,
+                 threshold_ms=AppConfig.WATCHDOG_LAG_THRESHOLD_MS,
+                 max_stacks=AppConfig.WATCHDOG_MAX_STACKS, on_update=None, update_every_ms=1000):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.threshold_ms = threshold_ms
+        self.max_stacks = max_stacks
+        self.on_update = on_update
+        self.update_every_ms = update_every_ms
+        self.histogram = LagHistogram()
+        self.current_lag_ms = 0.0
+        self.stalls = 0
+        self._expected = None
+        self._last_beat = time.perf_counter()
+        self._last_update = 0.0
+        self._window_max = 0.0
+        self._after_id = None
+        self._main_ident = threading.main_thread().ident
+        self._stop_event = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        """Запускает пульс и поток снятия стеков; вызывать из главного потока"""
+        self._main_ident = threading.get_ident()
+        self._stop_event.clear()
+        self._last_beat = time.perf_counter()
+        self._schedule()
+        self._sampler = threading.Thread(target=self._sample_loop, name="tk-watchdog", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        """Останавливает наблюдение и пишет итоговую статистику в лог"""
+        self._stop_event.set()
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+        if self.histogram.total:
+            logger.info("Отзывчивость GUI: %s", self.summary())
+
+    def _schedule(self):
+        self._expected = time.perf_counter() + self.interval_ms / 1000
+        self._after_id = self.root.after(self.interval_ms, self._beat)
+
+    def _beat(self):
+        now = time.perf_counter()
+        self._last_beat = now
+        lag_ms = max(0.0, (now - self._expected) * 1000)
+        self.current_lag_ms = lag_ms
+        self.histogram.add(lag_ms)
+        if lag_ms > self._window_max:
+            self._window_max = lag_ms
+
+        # Обновляем статусную строку не на каждом пульсе
+        if self.on_update and (now - self._last_update) * 1000 >= self.update_every_ms:
+            self._last_update = now
+            window_max, self._window_max = self._window_max, 0.0
+            self.on_update(lag_ms, window_max)
+
+        if not self._stop_event.is_set():
+            self._schedule()
+
+    def _sample_loop(self):
+        """Ждет зависания главного потока и снимает его стек, пока оно длится"""
+        threshold = self.threshold_ms / 1000
+        poll = min(threshold / 2, 0.05)
+        stall_started = None
+        samples = 0
+        while not self._stop_event.wait(poll):
+            silence = time.perf_counter() - self._last_beat - self.interval_ms / 1000
+            if silence < threshold:
+                stall_started = None
+                continue
+            if stall_started != self._last_beat:
+                stall_started = self._last_beat
+                samples = 0
+                self.stalls += 1
+            if samples >= self.max_stacks:
+                continue
+            # Следующий снимок того же зависания - через порог, чтобы увидеть, где оно продолжается
+            if samples and silence < threshold * (samples + 1):
+                continue
+            samples += 1
+            frame = sys._current_frames().get(self._main_ident)
+            if frame is None:
+                continue
+            stack = ''.join(traceback.format_stack(frame))
+            logger.warning("Главный поток не отвечает %.0f мс (снимок %d/%d):\n%s",
+                           silence * 1000, samples, self.max_stacks, stack)
+
+    def summary(self):
+        """Возвращает сводку: перцентили, максимум, число зависаний и гистограмму"""
+        return {
+            'beats': self.histogram.total,
+            'p50_ms': self.histogram.percentile(0.5),
+            'p95_ms': self.histogram.percentile(0.95),
+            'p99_ms': self.histogram.percentile(0.99),
+            'max_ms': round(self.histogram.max_ms, 1),
+            'stalls': self.stalls,
+            'histogram': self.histogram.as_dict(),
+        }
@@ -0,0 +1,113 @@
+﻿import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+from disk_space import preallocate
+
+logger = logging.getLogger(__name__)
+
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def atomic_move(src, output_dir, buffer_size=COPY_BUFFER_SIZE, checksum=None, overwrite=False):
+    """
+    Переносит готовый файл в папку вывода так, чтобы там никогда не было частичного файла.
+
+    На одном томе выполняется os.replace. Между томами файл копируется одной
+    последовательной записью во временный скрытый файл рядом с целью
+    и затем атомарно переименовывается.
+
+    Args:
+        src (str): путь к готовому файлу в промежуточной папке
+        output_dir (str): папка вывода
+        buffer_size (int): размер буфера копирования между томами
+        checksum (StreamingChecksum): если задан, копируемые байты попутно хэшируются
+        overwrite (bool): заменять ли файл с тем же именем в папке вывода
+
+    Returns:
+        str: итоговый путь файла
+
+    Raises:
+        FileExistsError: файл с тем же именем уже есть, а overwrite не задан
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    name = os.path.basename(src)
+    dst = os.path.join(output_dir, name)
+    if not overwrite and os.path.exists(dst):
+        raise FileExistsError(f"Файл уже существует: {dst}")
+
+    if os.stat(src).st_dev == os.stat(output_dir).st_dev:
+        os.replace(src, dst)
+        return dst
+
+    temp_dst = os.path.join(output_dir, f".{name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with open(src, 'rb') as source, open(temp_dst, 'wb') as target:
+            preallocate(target, os.fstat(source.fileno()).st_size)
+            if checksum is None:
+                shutil.copyfileobj(source, target, buffer_size)
+            else:
+                while True:
+                    data = source.read(buffer_size)
+                    if not data:
+                        break
+                    target.write(data)
+                    checksum.update(data)
+            target.flush()
+            os.fsync(target.fileno())
+        shutil.copystat(src, temp_dst)
+        os.replace(temp_dst, dst)
+    except BaseException:
+        try:
+            os.remove(temp_dst)
+        except OSError:
+            pass
+        raise
+
+    os.remove(src)
+    return dst
+
+
+class StagingArea:
+    """Быстрая промежуточная папка для .part-файлов, фрагментов и временных файлов ffmpeg.
+
+    Каждая задача получает собственную подпапку; готовые файлы переносятся
+    в папку вывода через atomic_move, подпапка удаляется после задачи.
+    """
+
+    def __init__(self, root, copy_buffer_size=COPY_BUFFER_SIZE):
+        self.root = Path(root)
+        self.copy_buffer_size = copy_buffer_size
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def job_dir(self, job_id):
+        """Возвращает (и создает) промежуточную папку задачи"""
+        path = self.root / job_id
+        path.mkdir(parents=True, exist_ok=True)
+        return str(path)
+
+    def publish(self, src, output_dir, checksums=None, overwrite=False):
+        """
+        Переносит готовый файл задачи в папку вывода; неизвестная еще сумма считается при копировании.
+
+        Как и yt-dlp без --force-overwrites, существующий файл с тем же именем
+        не заменяется: остается он, новый удаляется вместе с папкой задачи.
+        """
+        dst = os.path.join(output_dir, os.path.basename(src))
+        if os.path.abspath(src) == os.path.abspath(dst):
+            return dst
+        if not overwrite and os.path.exists(dst):
+            logger.warning("Файл %s уже есть в папке вывода, оставлен существующий", dst)
+            return dst
+        checksum = checksums.writer(src) if checksums is not None and checksums.get(src) is None else None
+        dst = atomic_move(src, output_dir, self.copy_buffer_size, checksum, overwrite)
+        if checksums is not None:
+            checksums.rename(src, dst)
+        logger.info("Файл перенесен в папку вывода: %s", dst)
+        return dst
+
+    def cleanup(self, job_id):
+        """Удаляет промежуточную папку задачи вместе с недокачанными файлами"""
+        shutil.rmtree(self.root / job_id, ignore_errors=True)
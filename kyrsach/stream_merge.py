@@ -0,0 +1,168 @@
+﻿import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+
+from yt_dlp.postprocessor import (
+    FFmpegFixupDurationPP, FFmpegFixupStretchedPP, FFmpegFixupTimestampPP, FFmpegMergerPP
+)
+from yt_dlp.utils import DownloadError, prepend_extension, replace_extension
+
+logger = logging.getLogger(__name__)
+
+
+def needs_merge(info):
+    """Выбрана ли комбинация отдельных потоков (например, bestvideo+bestaudio)"""
+    return len(info.get('requested_formats') or []) > 1
+
+
+class StreamProgress:
+    """Сводит прогресс нескольких одновременно загружаемых потоков в одну цифру.
+
+    Размер потока, который еще не начал качаться, берется из filesize
+    (или filesize_approx) формата, чтобы процент не прыгал назад.
+    """
+
+    def __init__(self, formats):
+        self._lock = threading.Lock()
+        self.streams = {
+            fmt['format_id']: {
+                'downloaded': 0,
+                'total': fmt.get('filesize') or fmt.get('filesize_approx') or 0,
+                'speed': 0.0,
+            }
+            for fmt in formats
+        }
+
+    def update(self, d):
+        """Учитывает событие прогресса yt-dlp; False, если оно не относится к потокам"""
+        stream = self.streams.get((d.get('info_dict') or {}).get('format_id'))
+        if stream is None:
+            return False
+        with self._lock:
+            total = d.get('total_bytes') or d.get('total_bytes_estimate') or stream['total']
+            if d['status'] == 'finished':
+                total = d.get('total_bytes') or d.get('downloaded_bytes') or total
+                stream.update(downloaded=total, total=total, speed=0.0)
+            else:
+                stream.update(downloaded=d.get('downloaded_bytes') or 0, total=total, speed=d.get('speed') or 0.0)
+        return True
+
+    def snapshot(self):
+        """
+        Возвращает сводный прогресс.
+
+        Returns:
+            Tuple: (процент, суммарная скорость в байтах/с, оставшееся время в секундах или None,
+                скачано байт, всего байт)
+        """
+        with self._lock:
+            downloaded = sum(stream['downloaded'] for stream in self.streams.values())
+            total = sum(stream['total'] for stream in self.streams.values())
+            speed = sum(stream['speed'] for stream in self.streams.values())
+        percent = min(downloaded / total * 100, 100.0) if total else 0.0
+        eta = (total - downloaded) / speed if speed and total > downloaded else None
+        return percent, speed, eta, downloaded, total
+
+
+class StreamCancelled(Exception):
+    """Загрузка потока прервана: другой поток той же задачи завершился ошибкой"""
+
+
+def _fixup_postprocessors(ydl, info):
+    """
+    Исправления, которые yt-dlp применяет к склеенному файлу в process_info.
+
+    Повторяет применимую к склейке часть: растянутые пиксели (stretched_ratio)
+    и метки времени потоков, полученных через websocket. Политика задается
+    параметром fixup, как в yt-dlp; загрузка всегда настоящая, поэтому
+    detect_or_warn означает исправить.
+    """
+    policy = ydl.params.get('fixup')
+    if policy in ('ignore', 'never'):
+        return []
+
+    protocols = [fmt.get('protocol') for fmt in info['requested_formats']]
+    stretched_ratio = info.get('stretched_ratio')
+    checks = [
+        (stretched_ratio not in (1, None), f"Неравномерное соотношение пикселей {stretched_ratio}",
+         FFmpegFixupStretchedPP),
+        ('websocket_frag' in protocols, "Некорректные метки времени", FFmpegFixupTimestampPP),
+        ('websocket_frag' in protocols, "Некорректная длительность", FFmpegFixupDurationPP),
+    ]
+    postprocessors = []
+    for needed, reason, cls in checks:
+        if not needed:
+            continue
+        if policy == 'warn':
+            logger.warning("%s: %s", info.get('id'), reason)
+            continue
+        postprocessor = cls(ydl)
+        if postprocessor.available:
+            postprocessors.append(postprocessor)
+        else:
+            logger.warning("%s: %s, для исправления нужен ffmpeg", info.get('id'), reason)
+    return postprocessors
+
+
+def download_and_merge(ydl, info, thread_name="stream"):
+    """
+    Качает выбранные потоки одновременно и склеивает их ffmpeg без перекодирования (-c copy).
+
+    Повторяет то, что yt-dlp делает для requested_formats в process_info,
+    но потоки загружаются параллельно, а не друг за другом. Ошибка одного
+    потока сразу прерывает остальные. После склейки применяются исправления
+    fixup из process_info; постпроцессоры этапа post_process и post_hooks
+    не выполняются (для видео приложение их не задает).
+
+    Args:
+        ydl: экземпляр YoutubeDL с настроенными путями и обработчиками прогресса
+        info (dict): info_dict после выбора формата (с requested_formats)
+        thread_name (str): префикс имен потоков загрузки
+
+    Returns:
+        dict: info_dict склеенного файла с полем filepath
+    """
+    formats = info['requested_formats']
+    target = ydl.prepare_filename(info)
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    cancelled = threading.Event()
+
+    def cancel_hook(d):
+        # Вызывается в потоке, который качает поток; исключение прерывает его загрузку
+        if cancelled.is_set():
+            raise StreamCancelled("Загрузка потока прервана: другой поток завершился ошибкой")
+
+    def fetch(fmt):
+        stream_info = dict(info)
+        del stream_info['requested_formats']
+        stream_info.update(fmt)
+        # Имя как у yt-dlp: "Название.f137.mp4", "Название.f140.m4a"
+        filepath = prepend_extension(replace_extension(target, fmt['ext']), f"f{fmt['format_id']}", fmt['ext'])
+        success, _ = ydl.dl(filepath, stream_info)
+        if not success:
+            raise DownloadError(f"Не удалось загрузить поток {fmt['format_id']}")
+        return filepath
+
+    ydl.add_progress_hook(cancel_hook)
+    try:
+        with ThreadPoolExecutor(max_workers=len(formats), thread_name_prefix=thread_name) as pool:
+            futures = [pool.submit(fetch, fmt) for fmt in formats]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            errors = [future.exception() for future in done if future.exception() is not None]
+            if errors:
+                cancelled.set()
+                raise errors[0]
+            filepaths = [future.result() for future in futures]
+    finally:
+        ydl._progress_hooks.remove(cancel_hook)
+
+    merged = dict(info)
+    merged['filepath'] = target
+    merged['__files_to_merge'] = filepaths
+    logger.info("Склейка потоков %s -> %s", ", ".join(fmt['format_id'] for fmt in formats), target)
+    # Исходные потоки удаляет run_pp после успешной склейки
+    merged = ydl.run_pp(FFmpegMergerPP(ydl), merged)
+    for postprocessor in _fixup_postprocessors(ydl, merged):
+        merged = ydl.run_pp(postprocessor, merged)
+    return merged
@@ -0,0 +1,5 @@
+﻿import os
+import sys
+
+# Модули приложения лежат плоско в папке проекта и импортируются по имени
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,85 @@
+﻿import io
+
+import pytest
+from yt_dlp.utils import ContentTooShortError
+
+import audio_stream as aus
+
+DATA = bytes(range(256)) * 40  # 10240 байт
+
+
+class _Response(io.BytesIO):
+    def __init__(self, body, status, headers=None):
+        super().__init__(body)
+        self.status = status
+        self.headers = headers or {}
+
+
+class _FakeYDL:
+    """Сервер, который обрывает первые ответы на cut байтах"""
+
+    def __init__(self, cut=None, cuts=1, ranges=True):
+        self.cut = cut
+        self.cuts = cuts
+        self.ranges = ranges
+        self.requests = []
+
+    def urlopen(self, request):
+        range_header = request.headers.get('Range')
+        self.requests.append(range_header)
+        if range_header and self.ranges:
+            first, _, last = range_header[len('bytes='):].partition('-')
+            first = int(first)
+            last = int(last) if last else len(DATA) - 1
+            body = DATA[first:last + 1]
+            response_args = (206, {'Content-Range': f"bytes {first}-{first + len(body) - 1}/{len(DATA)}"})
+        else:
+            body = DATA
+            response_args = (200, None)
+        if self.cut is not None and self.cuts:
+            self.cuts -= 1
+            body = body[:self.cut]
+        return _Response(body, *response_args)
+
+
+def _read(ydl, filesize=len(DATA), chunk_size=None):
+    info = {'url': "https://example.com/a.m4a", 'filesize': filesize}
+    if chunk_size:
+        info['downloader_options'] = {'http_chunk_size': chunk_size}
+    return b''.join(aus.StreamingAudioExtractor(chunk_size=1000)._iter_chunks(ydl, info))
+
+
+def test_ranged_read_returns_whole_file():
+    ydl = _FakeYDL()
+    assert _read(ydl, chunk_size=4096) == DATA
+    assert len(ydl.requests) == 3
+
+
+def test_short_ranged_read_is_resumed_from_offset():
+    ydl = _FakeYDL(cut=1500)
+    assert _read(ydl, chunk_size=4096) == DATA
+    assert ydl.requests[1] == 'bytes=1500-5595'
+
+
+def test_short_plain_read_is_resumed_with_range():
+    ydl = _FakeYDL(cut=3000)
+    assert _read(ydl) == DATA
+    assert ydl.requests == [None, 'bytes=3000-']
+
+
+def test_total_size_comes_from_content_range_when_unknown():
+    ydl = _FakeYDL(cut=1500)
+    assert _read(ydl, filesize=None, chunk_size=4096) == DATA
+
+
+def test_server_without_resume_support_raises():
+    ydl = _FakeYDL(cut=3000, ranges=False)
+    with pytest.raises(ContentTooShortError):
+        _read(ydl)
+
+
+def test_repeated_empty_reads_raise():
+    ydl = _FakeYDL(cut=0, cuts=10)
+    with pytest.raises(ContentTooShortError):
+        _read(ydl, chunk_size=4096)
+    assert len(ydl.requests) == aus.SHORT_READ_RETRIES
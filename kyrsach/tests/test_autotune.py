@@ -0,0 +1,132 @@
+﻿import pytest
+
+import autotune
+from autotune import CONTENT, ERROR, SUCCESS, THROTTLED, ConcurrencyTuner, classify_error
+from perf_profile import PerformanceProfile, validate_profile
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(autotune.time, 'monotonic', clock)
+    return clock
+
+
+def _tuner(autotune_settings=None, max_parallel=4):
+    profile = PerformanceProfile()
+    profile._data = validate_profile({
+        'concurrency': {'max_parallel_downloads': max_parallel},
+        'autotune': autotune_settings or {},
+    })
+    return ConcurrencyTuner(profile, state_file=None)
+
+
+def _fill(tuner, service):
+    """Занимает все места сервиса: лимит сдерживает загрузки"""
+    while tuner.try_acquire(service):
+        pass
+
+
+def test_slots_follow_the_limit():
+    tuner = _tuner({'initial_limit': 2})
+    assert tuner.try_acquire('YouTube') and tuner.try_acquire('YouTube')
+    assert not tuner.try_acquire('YouTube')
+    assert tuner.release('YouTube') == 1
+    assert tuner.free_slots('YouTube') == 1
+    # Сервисы считаются отдельно
+    assert tuner.try_acquire('TikTok')
+
+
+def test_successes_grow_the_limit_only_while_it_binds():
+    tuner = _tuner({'initial_limit': 2})
+    tuner.try_acquire('YouTube')
+    for _ in range(5):
+        tuner.record('YouTube', SUCCESS)
+    assert tuner.limit('YouTube') == 2
+
+    _fill(tuner, 'YouTube')
+    # Прирост additive_increase / лимит за успех: 2 -> 2.5 -> 2.9 -> 3.24
+    tuner.record('YouTube', SUCCESS)
+    tuner.record('YouTube', SUCCESS)
+    assert tuner.limit('YouTube') == 2
+    tuner.record('YouTube', SUCCESS)
+    assert tuner.limit('YouTube') == 3
+    assert tuner.decisions[-1]['old'] == 2 and tuner.decisions[-1]['new'] == 3
+
+
+def test_limit_never_exceeds_max_parallel_downloads():
+    tuner = _tuner({'initial_limit': 2}, max_parallel=2)
+    _fill(tuner, 'YouTube')
+    for _ in range(10):
+        tuner.record('YouTube', SUCCESS)
+    assert tuner.limit('YouTube') == 2
+
+
+def test_throttling_halves_once_per_cooldown(clock):
+    tuner = _tuner({'initial_limit': 4, 'decrease_cooldown': 30})
+    tuner.record('YouTube', THROTTLED)
+    assert tuner.limit('YouTube') == 2
+    # Та же волна отказов
+    clock.now += 5
+    tuner.record('YouTube', THROTTLED)
+    assert tuner.limit('YouTube') == 2
+    clock.now += 30
+    tuner.record('YouTube', THROTTLED)
+    assert tuner.limit('YouTube') == 1
+    clock.now += 30
+    tuner.record('YouTube', THROTTLED)
+    assert tuner.limit('YouTube') == 1
+
+
+def test_errors_decrease_only_above_threshold(clock):
+    tuner = _tuner({'initial_limit': 4, 'ewma_alpha': 0.3, 'error_rate_threshold': 0.5})
+    tuner.record('YouTube', ERROR)
+    assert tuner.limit('YouTube') == 4
+    tuner.record('YouTube', ERROR)
+    tuner.record('YouTube', ERROR)
+    # Доля ошибок 1 - 0.7^3 > 0.5
+    assert tuner.limit('YouTube') == 2
+
+
+def test_content_errors_are_ignored():
+    tuner = _tuner({'initial_limit': 4})
+    for _ in range(10):
+        tuner.record('YouTube', CONTENT)
+    assert tuner.limit('YouTube') == 4
+    assert tuner.snapshot()['services']['YouTube']['attempts'] == 0
+
+
+def test_throughput_drop_at_binding_limit_decreases(clock):
+    tuner = _tuner({'initial_limit': 2, 'ewma_alpha': 1.0, 'congestion_ratio': 0.5, 'additive_increase': 0.0})
+    _fill(tuner, 'YouTube')
+    tuner.record('YouTube', SUCCESS, size=10 * 1024 ** 2, seconds=10)
+    assert tuner.limit('YouTube') == 2
+    tuner.record('YouTube', SUCCESS, size=1024 ** 2, seconds=10)
+    assert tuner.limit('YouTube') == 1
+    assert "общая скорость" in tuner.decisions[-1]['reason']
+
+
+def test_disabled_tuner_allows_max_parallel_downloads():
+    tuner = _tuner({'enabled': False, 'initial_limit': 1}, max_parallel=3)
+    assert tuner.limit('YouTube') == 3
+    tuner.record('YouTube', THROTTLED)
+    assert tuner.limit('YouTube') == 3
+
+
+@pytest.mark.parametrize('error, outcome', [
+    ("HTTP Error 429: Too Many Requests", THROTTLED),
+    ("HTTP Error 403: Forbidden", THROTTLED),
+    ("This video is private", CONTENT),
+    ("HTTP Error 404: Not Found", CONTENT),
+    ("Read timed out", ERROR),
+])
+def test_classify_error(error, outcome):
+    assert classify_error(Exception(error)) == outcome
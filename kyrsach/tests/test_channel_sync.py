@@ -0,0 +1,153 @@
+﻿import sqlite3
+from unittest import mock
+
+import pytest
+
+import channel_sync as cs
+
+
+@pytest.fixture
+def open_archive(tmp_path):
+    archives = []
+
+    def factory(capacity=100):
+        archive = cs.SyncArchive(str(tmp_path / 'sync.sqlite3'), str(tmp_path / 'sync.bloom'), capacity=capacity)
+        archives.append(archive)
+        return archive
+
+    yield factory
+    for archive in archives:
+        try:
+            archive.close()
+        except Exception:
+            pass
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = cs.BloomFilter(1000, 0.01)
+    keys = [f"youtube {i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other {i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_bloom_filter_round_trip_keeps_parameters_from_header(tmp_path):
+    bloom = cs.BloomFilter(50, 0.01)
+    bloom.add("a")
+    path = str(tmp_path / 'f.bloom')
+    bloom.save(path)
+
+    loaded = cs.BloomFilter.load(path)
+    assert (loaded.capacity, loaded.size, loaded.hashes, loaded.count) == (50, bloom.size, bloom.hashes, 1)
+    assert "a" in loaded and "b" not in loaded
+
+
+def test_bloom_filter_load_rejects_damaged_file(tmp_path):
+    path = tmp_path / 'f.bloom'
+    assert cs.BloomFilter.load(str(path)) is None
+    cs.BloomFilter(50).save(str(path))
+    path.write_bytes(path.read_bytes()[:-1])
+    assert cs.BloomFilter.load(str(path)) is None
+
+
+def test_archive_add_and_contains(open_archive):
+    archive = open_archive()
+    archive.add("youtube UC1", "youtube a")
+    assert ("youtube UC1", "youtube a") in archive
+    assert ("youtube UC1", "youtube b") not in archive
+    assert ("youtube UC2", "youtube a") not in archive
+
+
+def test_grown_archive_loads_persisted_filter_without_rebuild(open_archive):
+    archive = open_archive(capacity=4)
+    for i in range(10):
+        archive.add("src", f"e{i}")
+    # Перерос емкость - фильтр перестроен с удвоением
+    assert archive.bloom.capacity >= 10
+    archive.close()
+
+    with mock.patch.object(cs.SyncArchive, '_rebuild') as rebuild:
+        reopened = open_archive(capacity=4)
+    rebuild.assert_not_called()
+    assert reopened.bloom.count == 10
+    assert all(("src", f"e{i}") in reopened for i in range(10))
+
+
+def test_archive_rebuilds_filter_when_counts_diverge(open_archive, tmp_path):
+    archive = open_archive()
+    archive.add("src", "e1")
+    archive.close()
+    # Запись попала в базу, а фильтр после нее не сохранился (аварийное завершение)
+    with sqlite3.connect(str(tmp_path / 'sync.sqlite3')) as conn:
+        conn.execute("INSERT INTO entries (source_id, entry) VALUES (1, 'e2')")
+    conn.close()
+
+    reopened = open_archive()
+    assert reopened.bloom.count == 2
+    assert ("src", "e2") in reopened
+
+
+class _FakeYDL:
+    def __init__(self, playlist):
+        self.playlist = playlist
+        self.listed = 0
+
+    def __call__(self, opts):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download=False, process=False, ie_key=None):
+        playlist = dict(self.playlist)
+        playlist['entries'] = self._entries(self.playlist['entries'])
+        return playlist
+
+    def _entries(self, entries):
+        for entry in entries:
+            self.listed += 1
+            yield entry
+
+
+def _playlist(extractor_key, playlist_id, ids):
+    return {
+        '_type': 'playlist', 'extractor_key': extractor_key, 'id': playlist_id, 'title': "Список",
+        'entries': [{'id': i, 'ie_key': 'Youtube', 'url': f"https://youtu.be/{i}", 'title': i} for i in ids],
+    }
+
+
+def _scan(archive, playlist):
+    fake = _FakeYDL(playlist)
+    with mock.patch.object(cs.yt_dlp, 'YoutubeDL', fake):
+        return cs.scan_source("https://www.youtube.com/x", archive, stop_after_seen=2), fake.listed
+
+
+def test_channel_feed_stops_at_known_entries(open_archive):
+    archive = open_archive()
+    source = "youtubetab UCchan"
+    for i in range(5):
+        archive.add(source, f"youtube v{i}")
+    # Новые сверху: n2, n1, затем уже скачанные v4..v0
+    result, listed = _scan(archive, _playlist('YoutubeTab', 'UCchan', ['n2', 'n1', 'v4', 'v3', 'v2', 'v1', 'v0']))
+
+    assert result['stopped_early'] is True
+    assert listed == 4
+    assert [entry['title'] for entry in result['entries']] == ['n1', 'n2']
+
+
+def test_oldest_first_playlist_is_scanned_to_the_tail(open_archive):
+    archive = open_archive()
+    source = "youtubetab PLlist"
+    for i in range(5):
+        archive.add(source, f"youtube v{i}")
+    # Плейлист от старых к новым: новые записи добавились в конец
+    result, listed = _scan(archive, _playlist('YoutubeTab', 'PLlist', ['v0', 'v1', 'v2', 'v3', 'v4', 'n1', 'n2']))
+
+    assert result['stopped_early'] is False
+    assert listed == 7
+    assert [entry['title'] for entry in result['entries']] == ['n1', 'n2']
@@ -0,0 +1,84 @@
+﻿import threading
+import time
+from collections import namedtuple
+
+import pytest
+
+import disk_space as ds
+
+MB = 1024 ** 2
+Usage = namedtuple('Usage', 'total used free')
+
+
+@pytest.fixture
+def disk(monkeypatch, tmp_path):
+    """Том с управляемым свободным местом"""
+    state = {'free': 1000 * MB}
+    monkeypatch.setattr(ds.shutil, 'disk_usage', lambda path: Usage(0, 0, state['free']))
+    state['path'] = str(tmp_path)
+    return state
+
+
+def test_reserve_within_free_space(disk):
+    guard = ds.DiskSpaceGuard(100 * MB)
+    assert guard.reserve('a', disk['path'], 400 * MB) is True
+    assert guard.reserve('b', disk['path'], 400 * MB) is True
+
+
+def test_job_larger_than_volume_fails(disk):
+    guard = ds.DiskSpaceGuard(100 * MB)
+    with pytest.raises(ds.InsufficientDiskSpace):
+        guard.reserve('a', disk['path'], 950 * MB)
+
+
+def test_waiting_job_is_admitted_after_release(disk):
+    guard = ds.DiskSpaceGuard(100 * MB, poll_interval=0.05)
+    guard.reserve('a', disk['path'], 600 * MB)
+    waits = []
+    result = {}
+
+    def on_wait():
+        # Вызывается вне блокировки: освобождение из этого потока не зависает
+        waits.append(threading.current_thread().name)
+        assert guard._condition.acquire(timeout=1)
+        guard._condition.release()
+
+    waiter = threading.Thread(
+        target=lambda: result.update(ok=guard.reserve('b', disk['path'], 600 * MB, on_wait=on_wait)))
+    waiter.start()
+    time.sleep(0.2)
+    assert waiter.is_alive() and len(waits) == 1
+
+    guard.release('a')
+    waiter.join(timeout=5)
+    assert result == {'ok': True}
+    assert len(waits) == 1
+
+
+def test_waiting_is_interrupted_by_stop(disk):
+    guard = ds.DiskSpaceGuard(100 * MB, poll_interval=0.05)
+    guard.reserve('a', disk['path'], 600 * MB)
+    stop = threading.Event()
+    threading.Timer(0.1, stop.set).start()
+    assert guard.reserve('b', disk['path'], 600 * MB, should_stop=stop.is_set) is False
+
+
+def test_written_bytes_are_not_counted_twice(disk):
+    guard = ds.DiskSpaceGuard(100 * MB, poll_interval=0.05)
+    guard.reserve('a', disk['path'], 600 * MB)
+    # Задача записала 500 МБ: свободное место уменьшилось, в резерве остаются 100 МБ
+    disk['free'] -= 500 * MB
+    guard.written('a', 500 * MB)
+    assert guard.reserve('b', disk['path'], 250 * MB, should_stop=lambda: True) is True
+
+
+def test_written_never_decreases(disk):
+    guard = ds.DiskSpaceGuard(0)
+    guard.reserve('a', disk['path'], 600 * MB)
+    guard.written('a', 500 * MB)
+    guard.written('a', 10 * MB)
+    assert guard._reserved_on(guard._volume_key(disk['path'])) == 100 * MB
+
+    guard.written('unknown', 10 * MB)
+    guard.release('a')
+    assert guard._reserved_on(guard._volume_key(disk['path'])) == 0
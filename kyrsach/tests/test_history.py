@@ -0,0 +1,73 @@
+﻿import pytest
+
+from history import HistoryStore
+
+
+def _entry(download_id, title, finished_at, service='YouTube', status='Завершено', **fields):
+    return {
+        'id': download_id, 'url': f"https://www.youtube.com/watch?v={download_id}", 'service': service,
+        'type': "Видео (MP4)", 'quality': "best", 'status': status, 'title': title,
+        'filename': f"{title}.mp4", 'started_at': finished_at - 10, 'finished_at': finished_at, **fields
+    }
+
+
+@pytest.fixture(params=[True, False], ids=['fts', 'like'])
+def store(request, tmp_path):
+    history = HistoryStore(str(tmp_path / 'history.sqlite3'))
+    if not request.param:
+        # Тот же поиск без FTS5 (SQLite, собранный без него)
+        history.fts_enabled = False
+    history.record_many([
+        _entry('a1', "Концерт в Москве", 100),
+        _entry('a2', "Лекция по физике", 200, service='Rutube'),
+        _entry('a3', "Концертная запись", 300, status='Ошибка', error="HTTP Error 403: Forbidden"),
+    ])
+    yield history
+    history.close()
+
+
+def _ids(rows):
+    return [row['id'] for row in rows]
+
+
+def test_fts_index_is_available(tmp_path):
+    history = HistoryStore(str(tmp_path / 'history.sqlite3'))
+    assert history.fts_enabled
+    history.close()
+
+
+def test_prefix_search_newest_first(store):
+    assert _ids(store.search("концерт")) == ['a3', 'a1']
+
+
+def test_all_words_must_match(store):
+    assert _ids(store.search("концерт моск")) == ['a1']
+
+
+def test_search_covers_url_service_and_error(store):
+    assert _ids(store.search("a2")) == ['a2']
+    assert _ids(store.search("rutube")) == ['a2']
+    assert _ids(store.search("forbidden")) == ['a3']
+
+
+def test_filters_and_limit(store):
+    assert _ids(store.search("концерт", status='Завершено')) == ['a1']
+    assert _ids(store.search("", service='Rutube')) == ['a2']
+    assert _ids(store.search("", limit=2)) == ['a3', 'a2']
+
+
+def test_duration_is_computed(store):
+    assert store.search("лекция")[0]['duration'] == 10
+
+
+def test_query_syntax_characters_are_plain_text(store):
+    # Кавычки, скобки и операторы FTS5 во вводе пользователя не ломают запрос
+    assert store.search('"концерт" OR (x') == []
+    assert _ids(store.search('концерт*')) == ['a3', 'a1']
+
+
+def test_update_reindexes_record(store):
+    store.record(_entry('a1', "Совсем другое название", 100))
+    assert _ids(store.search("москве")) == []
+    assert _ids(store.search("другое")) == ['a1']
+    assert store.count() == 3
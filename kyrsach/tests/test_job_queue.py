@@ -0,0 +1,123 @@
+﻿import time
+from unittest import mock
+
+import pytest
+
+import job_queue as jq
+import worker as queue_worker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    job_queue = jq.JobQueue(str(tmp_path / 'jobs.sqlite3'))
+    yield job_queue
+    job_queue.close()
+
+
+def _state(queue, job_id):
+    return next(job for job in queue.jobs() if job['id'] == job_id)
+
+
+def test_expired_lease_moves_to_another_worker(queue):
+    job_id = queue.enqueue("https://youtu.be/abc", "Видео (MP4)", "best")
+    assert [job['id'] for job in queue.lease('a', lease_seconds=0.05)] == [job_id]
+    # Пока аренда действует, задача никому не выдается
+    assert queue.lease('b', lease_seconds=60) == []
+
+    time.sleep(0.1)
+    jobs = queue.lease('b', lease_seconds=60)
+    assert [job['id'] for job in jobs] == [job_id]
+    assert jobs[0]['attempts'] == 2
+    assert _state(queue, job_id)['worker'] == 'b'
+
+
+def test_stale_worker_heartbeat_and_complete_are_rejected(queue):
+    job_id = queue.enqueue("https://youtu.be/abc", "Видео (MP4)", "best")
+    queue.lease('a', lease_seconds=0.05)
+    time.sleep(0.1)
+    queue.lease('b', lease_seconds=60)
+
+    assert queue.heartbeat('a', {job_id: {'progress': 50}}) == {job_id}
+    assert queue.complete(job_id, 'a', True, checksum="sha256:stale") is False
+    assert _state(queue, job_id)['state'] == jq.LEASED
+
+    assert queue.complete(job_id, 'b', True, checksum="sha256:good") is True
+    job = _state(queue, job_id)
+    assert (job['state'], job['checksum'], job['progress']) == (jq.DONE, "sha256:good", 100)
+
+
+def test_failed_job_is_retried_until_attempts_run_out(queue):
+    job_id = queue.enqueue("https://youtu.be/abc", "Видео (MP4)", "best", max_attempts=2)
+    queue.lease('a')
+    queue.complete(job_id, 'a', False, "сеть")
+    assert _state(queue, job_id)['state'] == jq.PENDING
+
+    queue.lease('b')
+    queue.complete(job_id, 'b', False, "сеть")
+    assert _state(queue, job_id)['state'] == jq.FAILED
+
+
+def test_expired_lease_without_attempts_left_fails(queue):
+    job_id = queue.enqueue("https://youtu.be/abc", "Видео (MP4)", "best", max_attempts=1)
+    queue.lease('a', lease_seconds=0.05)
+    time.sleep(0.1)
+    assert queue.lease('b') == []
+    assert _state(queue, job_id)['state'] == jq.FAILED
+
+
+def test_release_returns_job_without_spending_attempt(queue):
+    job_id = queue.enqueue("https://youtu.be/abc", "Видео (MP4)", "best")
+    queue.lease('a')
+    # Чужой воркер не может вернуть задачу
+    queue.release(job_id, 'b')
+    assert _state(queue, job_id)['state'] == jq.LEASED
+
+    queue.release(job_id, 'a')
+    job = _state(queue, job_id)
+    assert (job['state'], job['worker'], job['attempts']) == (jq.PENDING, None, 0)
+
+
+@pytest.fixture
+def make_worker(queue):
+    """QueueWorker с подставным менеджером: проверяется только протокол аренды"""
+    workers = []
+
+    def make(worker_id, lease_seconds=60):
+        with mock.patch.object(queue_worker, 'DownloadManager') as manager_class:
+            manager = manager_class.return_value
+            manager.perf.get.return_value = 2
+            manager.add_download.side_effect = lambda url, *args: f"{worker_id}-{url[-1]}"
+            worker = queue_worker.QueueWorker(queue, worker_id, lease_seconds=lease_seconds)
+        workers.append(worker)
+        return worker
+
+    return make
+
+
+def test_worker_detaches_job_when_lease_is_lost(queue, make_worker):
+    job_id = queue.enqueue("https://youtu.be/1", "Видео (MP4)", "best")
+    slow = make_worker('slow', lease_seconds=0.05)
+    assert slow._lease_jobs() == 1
+    time.sleep(0.1)
+    fast = make_worker('fast')
+    assert fast._lease_jobs() == 1
+
+    slow._heartbeat()
+    slow.manager.detach.assert_called_once_with('slow-1')
+    assert slow._jobs == {}
+
+    # Поздний результат снятой задачи не доходит до очереди, результат нового владельца принимается
+    slow._on_completion('slow-1', True, "", {'checksum': "sha256:stale"})
+    fast._on_completion('fast-1', True, "", {'checksum': "sha256:good"})
+    assert _state(queue, job_id)['checksum'] == "sha256:good"
+
+
+def test_worker_stop_releases_unfinished_jobs(queue, make_worker):
+    ids = queue.enqueue_many(["https://youtu.be/1", "https://youtu.be/2"], "Видео (MP4)", "best")
+    worker = make_worker('a')
+    assert worker._lease_jobs() == 2
+
+    worker.stop()
+    worker.manager.stop_all.assert_called_once_with()
+    assert {job['id']: job['state'] for job in queue.jobs()} == {job_id: jq.PENDING for job_id in ids}
+    assert queue.lease('b', limit=2)[0]['attempts'] == 1
@@ -0,0 +1,93 @@
+﻿import json
+import os
+
+import pytest
+
+from perf_profile import DEFAULT_PROFILE, PerformanceProfile, PerformanceProfileError, validate_profile
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_empty_profile_gets_defaults():
+    profile = validate_profile({})
+    assert {name: profile[name] for name in DEFAULT_PROFILE} == DEFAULT_PROFILE
+    assert profile['services'] == {}
+
+
+def test_shipped_profile_is_valid():
+    with open(os.path.join(PROJECT_DIR, 'performance.json'), 'r', encoding='utf-8-sig') as f:
+        validate_profile(json.load(f))
+
+
+def test_sections_are_merged_and_qualities_replaced():
+    profile = validate_profile({
+        'concurrency': {'max_parallel_downloads': 5},
+        'video_qualities': {'Только 720p': 'best[height<=720]'},
+    })
+    assert profile['concurrency']['max_parallel_downloads'] == 5
+    assert profile['concurrency']['preflight_workers'] == DEFAULT_PROFILE['concurrency']['preflight_workers']
+    assert profile['video_qualities'] == {'Только 720p': 'best[height<=720]'}
+
+
+def test_service_overrides_are_kept():
+    profile = validate_profile({'services': {'TikTok': {'autotune': {'initial_limit': 1}}}})
+    assert profile['services'] == {'TikTok': {'autotune': {'initial_limit': 1}}}
+
+
+@pytest.mark.parametrize('data', [
+    [],
+    {'unknown': {}},
+    {'concurrency': []},
+    {'concurrency': {'unknown': 1}},
+    {'concurrency': {'max_parallel_downloads': 0}},
+    {'concurrency': {'max_parallel_downloads': 2.5}},
+    {'concurrency': {'max_parallel_downloads': True}},
+    {'timeouts': {'socket_timeout': -1}},
+    {'timeouts': {'socket_timeout': "30"}},
+    {'rate_limits': {'start_delay': [2.0, 1.0]}},
+    {'rate_limits': {'start_delay': [1.0]}},
+    {'chunks': {'stream_chunk_size': None}},
+    {'isolation': {'use_processes': 1}},
+    {'autotune': {'decrease_factor': 0}},
+    {'autotune': {'congestion_ratio': 1.5}},
+    {'logging': {'': 'VERBOSE'}},
+    {'video_qualities': {'Лучшее': ''}},
+    {'services': []},
+    {'services': {'YouTube': {'concurrency': {'max_parallel_downloads': 1}}}},
+    {'services': {'YouTube': {'retries': {'max_attempts': 0}}}},
+])
+def test_invalid_profiles_are_rejected(data):
+    with pytest.raises(PerformanceProfileError):
+        validate_profile(data)
+
+
+def test_nullable_keys_accept_null():
+    profile = validate_profile({'rate_limits': {'ratelimit': None}, 'chunks': {'http_chunk_size': None}})
+    assert profile['rate_limits']['ratelimit'] is None
+
+
+def test_invalid_reload_keeps_previous_profile(tmp_path):
+    path = tmp_path / 'performance.json'
+    path.write_text(json.dumps({'concurrency': {'max_parallel_downloads': 4}}), encoding='utf-8')
+    profile = PerformanceProfile(str(path)).load()
+    reloads = []
+    profile.add_listener(reloads.append)
+
+    path.write_text(json.dumps({'concurrency': {'max_parallel_downloads': 0}}), encoding='utf-8')
+    os.utime(path, (1, 1))
+    assert profile.reload_if_changed() is False
+    assert profile.get('concurrency', 'max_parallel_downloads') == 4
+
+    path.write_text(json.dumps({'concurrency': {'max_parallel_downloads': 6}}), encoding='utf-8')
+    os.utime(path, (2, 2))
+    assert profile.reload_if_changed() is True
+    assert profile.get('concurrency', 'max_parallel_downloads') == 6
+    assert reloads == [profile]
+
+
+def test_section_applies_service_overrides(tmp_path):
+    path = tmp_path / 'performance.json'
+    path.write_text(json.dumps({'services': {'TikTok': {'retries': {'max_attempts': 5}}}}), encoding='utf-8')
+    profile = PerformanceProfile(str(path)).load()
+    assert profile.get('retries', 'max_attempts', 'TikTok') == 5
+    assert profile.get('retries', 'max_attempts', 'YouTube') == DEFAULT_PROFILE['retries']['max_attempts']
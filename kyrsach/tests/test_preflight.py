@@ -0,0 +1,98 @@
+﻿import threading
+
+import pytest
+import requests
+
+import preflight as pf
+
+
+class _Response:
+    def __init__(self, status_code, url):
+        self.status_code = status_code
+        self.url = url
+
+    def close(self):
+        pass
+
+
+class _Session:
+    """Отвечает заданным кодом (или исключением) и редиректом на final_url"""
+
+    def __init__(self, status_code=200, final_url=None, error=None):
+        self.status_code = status_code
+        self.final_url = final_url
+        self.error = error
+        self.calls = 0
+
+    def _respond(self, url, **kwargs):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return _Response(self.status_code, self.final_url or url)
+
+    head = get = _respond
+
+
+@pytest.fixture
+def make_preflight(monkeypatch):
+    def factory(session, cache_ttl=600):
+        checker = pf.URLPreflight(cache_ttl=cache_ttl)
+        monkeypatch.setattr(checker, '_session_for', lambda host: (session, threading.Semaphore(4)))
+        return checker
+    return factory
+
+
+@pytest.mark.parametrize('status_code, state', [
+    (200, pf.ALIVE),
+    (404, pf.DEAD),
+    (410, pf.DEAD),
+    (403, pf.UNKNOWN),
+    (429, pf.UNKNOWN),
+    (503, pf.UNKNOWN),
+])
+def test_status_codes_map_to_states(make_preflight, status_code, state):
+    result = make_preflight(_Session(status_code)).check("https://example.com/v/1")
+    assert result['state'] == state
+    assert result['ok'] is (state == pf.ALIVE)
+
+
+def test_timeout_is_unknown_and_connection_error_is_dead(make_preflight):
+    timed_out = make_preflight(_Session(error=requests.ReadTimeout("медленно"))).check("https://example.com/a")
+    refused = make_preflight(_Session(error=requests.ConnectionError("нет хоста"))).check("https://example.com/b")
+    assert timed_out['state'] == pf.UNKNOWN
+    assert refused['state'] == pf.DEAD
+
+
+def test_short_link_resolves_to_final_url(make_preflight):
+    session = _Session(200, final_url="https://www.youtube.com/watch?v=abc")
+    result = make_preflight(session).check("https://youtu.be/abc")
+    assert pf.resolved_url(result) == "https://www.youtube.com/watch?v=abc"
+
+
+def test_short_link_to_consent_page_keeps_original(make_preflight):
+    session = _Session(200, final_url="https://consent.youtube.com/m?continue=x")
+    result = make_preflight(session).check("https://youtu.be/abc")
+    assert pf.resolved_url(result) == "https://youtu.be/abc"
+
+
+def test_throttled_short_link_keeps_original(make_preflight):
+    session = _Session(429, final_url="https://www.youtube.com/watch?v=abc")
+    result = make_preflight(session).check("https://youtu.be/abc")
+    assert pf.resolved_url(result) == "https://youtu.be/abc"
+
+
+def test_expired_cache_entries_are_evicted(make_preflight, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(pf.time, 'time', lambda: now[0])
+    session = _Session(200)
+    checker = make_preflight(session, cache_ttl=10)
+
+    checker.check("https://example.com/1")
+    checker.check("https://example.com/1")
+    assert session.calls == 1
+
+    now[0] += 11
+    checker.check("https://example.com/2")
+    assert list(checker._cache) == ["https://example.com/2"]
+    checker.check("https://example.com/1")
+    assert session.calls == 3
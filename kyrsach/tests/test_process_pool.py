@@ -0,0 +1,92 @@
+﻿import threading
+import time
+
+import pytest
+
+import process_pool as pp
+
+# Дочерние процессы ниже заменяют _child_main: частый пульс с заданной отметкой прогресса.
+# Они импортируются в процессе по имени модуля, поэтому объявлены на верхнем уровне.
+PULSE = 0.05
+
+
+def _pulse(conn, seconds, mark_at):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        conn.send(('alive', mark_at(time.monotonic())))
+        time.sleep(PULSE)
+
+
+def _stalled_child(conn, log_levels):
+    """Пульс идет, прогресс стоит: экстрактор или сокет завис"""
+    _, download_info, _, _ = conn.recv()
+    _pulse(conn, 60, lambda now: ('Загружается', 1000, 10.0))
+
+
+def _silent_child(conn, log_levels):
+    """Процесс не отвечает совсем"""
+    conn.recv()
+    time.sleep(60)
+
+
+def _progressing_child(conn, log_levels):
+    """Байты растут дольше hang_timeout, затем задача завершается"""
+    _, download_info, _, _ = conn.recv()
+    _pulse(conn, 1.5, lambda now: ('Загружается', int(now * 1000), 50.0))
+    conn.send(('done', download_info['id'], True, "", {'status': 'Завершено'}, None))
+
+
+def _processing_child(conn, log_levels):
+    """После загрузки долгое слияние без прогресса - укладывается в processing_timeout"""
+    _, download_info, _, _ = conn.recv()
+    conn.send(('progress', download_info['id'], {'status': 'Загружается', 'downloaded_bytes': 10, 'progress': 100}))
+    _pulse(conn, 1.5, lambda now: ('Загружается', 10, 100))
+    conn.send(('done', download_info['id'], True, "", {'status': 'Завершено'}, None))
+
+
+class _Guard:
+    def release(self, job_id):
+        pass
+
+
+def _run(target, hang_timeout=0.5, processing_timeout=None):
+    process = pp.WorkerProcess('test-worker', {}, target=target)
+    download_info = {'id': 'job1', 'url': "https://example.com/v", 'status': 'В очереди',
+                     'progress': 0, 'downloaded_bytes': 0}
+    try:
+        result = process.run(download_info, lambda: None, threading.Event(), hang_timeout, _Guard(),
+                             processing_timeout=processing_timeout)
+    finally:
+        alive = process.alive
+        process.kill()
+    return result, alive, download_info
+
+
+def test_stalled_child_is_killed_despite_heartbeat():
+    started = time.monotonic()
+    with pytest.raises(pp.WorkerCrashed, match="зависла"):
+        _run(_stalled_child)
+    assert time.monotonic() - started < 30
+
+
+def test_silent_child_is_killed():
+    with pytest.raises(pp.WorkerCrashed, match="перестал отвечать"):
+        _run(_silent_child)
+
+
+def test_progressing_child_is_not_killed():
+    (success, _, _), _, download_info = _run(_progressing_child)
+    assert success is True
+    assert download_info['status'] == 'Завершено'
+
+
+def test_processing_phase_uses_its_own_timeout():
+    (success, _, _), _, _ = _run(_processing_child, processing_timeout=5)
+    assert success is True
+
+
+def test_stop_and_kill_without_process_are_noops():
+    process = pp.WorkerProcess('test-worker', {})
+    process.stop()
+    process.kill()
+    assert not process.alive
@@ -0,0 +1,63 @@
+﻿import pytest
+
+import remux
+
+
+@pytest.mark.parametrize('info, path', [
+    ({'ext': 'mp4', 'vcodec': 'vp09.00.40.08', 'acodec': 'opus'}, remux.PATH_NOOP),
+    ({'ext': 'webm', 'vcodec': 'vp9', 'acodec': 'opus'}, remux.PATH_REMUX),
+    ({'ext': 'mp4', 'requested_formats': [{'vcodec': 'avc1.64001F', 'acodec': 'none'},
+                                          {'vcodec': 'none', 'acodec': 'mp4a.40.2'}]}, remux.PATH_NOOP),
+    ({'ext': 'mp4', 'vcodec': 'vp8', 'acodec': 'vorbis'}, remux.PATH_TRANSCODE),
+    ({'ext': 'mkv'}, remux.PATH_REMUX),
+])
+def test_choose_video_path(info, path):
+    assert remux.choose_video_path(info)[0] == path
+
+
+def test_transcode_args_copy_compatible_streams():
+    args = remux.transcode_args({'vcodec': 'avc1.4d401f', 'acodec': 'vorbis'})
+    assert args[:2] == ['-c:v', 'copy']
+    assert remux.TRANSCODE_AUDIO_ARGS[1] in args
+
+
+def test_transcode_args_encode_unknown_codecs():
+    args = remux.transcode_args({})
+    assert remux.TRANSCODE_VIDEO_ARGS[1] in args and remux.TRANSCODE_AUDIO_ARGS[1] in args
+
+
+def _fake_ffmpeg(calls):
+    def run_ffmpeg(path, out_path, opts, **kwargs):
+        calls.append((path, out_path, opts))
+        with open(out_path, 'wb') as f:
+            f.write(b'encoded')
+    return run_ffmpeg
+
+
+def test_transcode_reencodes_file_that_is_already_mp4(tmp_path, monkeypatch):
+    source = tmp_path / 'video.mp4'
+    source.write_bytes(b'original')
+    pp = remux.FFmpegTranscodePP()
+    calls = []
+    monkeypatch.setattr(pp, 'run_ffmpeg', _fake_ffmpeg(calls))
+
+    to_delete, info = pp.run({'filepath': str(source), 'ext': 'mp4', 'vcodec': 'vp8', 'acodec': 'aac'})
+
+    assert len(calls) == 1
+    assert calls[0][1] == str(tmp_path / 'video.temp.mp4')
+    assert to_delete == []
+    assert info['filepath'] == str(source)
+    assert source.read_bytes() == b'encoded'
+    assert not (tmp_path / 'video.temp.mp4').exists()
+
+
+def test_transcode_replaces_other_container(tmp_path, monkeypatch):
+    source = tmp_path / 'video.mkv'
+    source.write_bytes(b'original')
+    pp = remux.FFmpegTranscodePP()
+    monkeypatch.setattr(pp, 'run_ffmpeg', _fake_ffmpeg([]))
+
+    to_delete, info = pp.run({'filepath': str(source), 'ext': 'mkv', 'vcodec': 'theora', 'acodec': 'vorbis'})
+
+    assert to_delete == [str(source)]
+    assert (info['filepath'], info['ext']) == (str(tmp_path / 'video.mp4'), 'mp4')
@@ -0,0 +1,106 @@
+﻿import threading
+
+import pytest
+from yt_dlp.utils import DownloadError
+
+from stream_merge import StreamProgress, download_and_merge, needs_merge
+from ydl_pool import merged_format
+
+FORMATS = [
+    {'format_id': '137', 'ext': 'mp4', 'filesize': 8000},
+    {'format_id': '140', 'ext': 'm4a', 'filesize_approx': 2000},
+]
+
+
+def _event(format_id, status='downloading', **fields):
+    return {'status': status, 'info_dict': {'format_id': format_id}, **fields}
+
+
+def test_needs_merge():
+    assert needs_merge({'requested_formats': FORMATS})
+    assert not needs_merge({'requested_formats': FORMATS[:1]})
+    assert not needs_merge({})
+
+
+def test_progress_uses_known_sizes_before_streams_start():
+    progress = StreamProgress(FORMATS)
+    assert progress.update(_event('137', downloaded_bytes=4000, total_bytes=8000, speed=1000.0))
+    percent, speed, eta, downloaded, total = progress.snapshot()
+    # Аудио еще не началось, но его размер уже в знаменателе: процент не прыгнет назад
+    assert (percent, speed, downloaded, total) == (40.0, 1000.0, 4000, 10000)
+    assert eta == 6.0
+
+
+def test_progress_sums_streams_and_finishes_at_100():
+    progress = StreamProgress(FORMATS)
+    progress.update(_event('137', downloaded_bytes=8000, total_bytes=8000, speed=1000.0))
+    progress.update(_event('140', downloaded_bytes=500, total_bytes_estimate=2500, speed=500.0))
+    assert progress.snapshot()[:2] == (pytest.approx(8500 / 10500 * 100), 1500.0)
+
+    progress.update(_event('137', status='finished', total_bytes=8000))
+    progress.update(_event('140', status='finished', downloaded_bytes=2400))
+    percent, speed, eta, downloaded, total = progress.snapshot()
+    assert (percent, speed, eta, downloaded, total) == (100.0, 0.0, None, 10400, 10400)
+
+
+def test_progress_ignores_other_formats():
+    progress = StreamProgress(FORMATS)
+    assert not progress.update(_event('999', downloaded_bytes=1))
+    assert not progress.update({'status': 'downloading'})
+    assert progress.snapshot() == (0.0, 0.0, None, 0, 10000)
+
+
+def test_progress_with_unknown_sizes():
+    progress = StreamProgress([{'format_id': 'v'}, {'format_id': 'a'}])
+    progress.update(_event('v', downloaded_bytes=100, speed=10.0))
+    # Без размеров процент не считается, но скорость и скачанные байты видны
+    assert progress.snapshot() == (0.0, 10.0, None, 100, 0)
+
+
+@pytest.mark.parametrize('quality, expected', [
+    ('best', 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best[ext=mp4]/best'),
+    ('best[height<=720]', 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=720]+bestaudio/'
+                          'best[height<=720][ext=mp4]/best[height<=720]/best'),
+    ('worst', 'worst'),
+])
+def test_merged_format(quality, expected):
+    assert merged_format(quality) == expected
+
+
+class _FakeYoutubeDL:
+    """Качает потоки по событиям прогресса; поток аудио завершается ошибкой"""
+
+    params = {}
+
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self._progress_hooks = []
+        self.video_stopped = threading.Event()
+
+    def add_progress_hook(self, hook):
+        self._progress_hooks.append(hook)
+
+    def prepare_filename(self, info):
+        return str(self.tmp_path / 'video.mp4')
+
+    def dl(self, filepath, info):
+        if info['format_id'] == '140':
+            return False, info
+        try:
+            while True:
+                for hook in list(self._progress_hooks):
+                    hook({'status': 'downloading'})
+                if self.video_stopped.wait(0.01):
+                    return True, info
+        except Exception:
+            self.video_stopped.set()
+            raise
+
+
+def test_failed_stream_cancels_the_other(tmp_path):
+    ydl = _FakeYoutubeDL(tmp_path)
+    with pytest.raises(DownloadError):
+        download_and_merge(ydl, {'id': 'x', 'requested_formats': FORMATS})
+    assert ydl.video_stopped.is_set()
+    # Временный обработчик отмены снят
+    assert ydl._progress_hooks == []
@@ -0,0 +1,97 @@
+﻿import pytest
+
+import throughput as tp
+
+
+def _history(size=5):
+    return tp.SpeedHistory(size=size, interval=1.0, tau=2.0)
+
+
+def test_first_sample_sets_speed_and_one_slot():
+    history = _history()
+    history.add(100.0, 0.0)
+    assert history.current(0.0) == 100.0
+    assert history.recent(10) == [100.0]
+
+
+def test_events_within_interval_overwrite_the_same_slot():
+    history = _history()
+    history.add(100.0, 0.0)
+    for step in range(1, 10):
+        history.add(100.0, step * 0.05)
+    assert history.count == 1
+
+
+def test_missed_intervals_are_filled_with_current_value():
+    history = _history(size=10)
+    history.add(100.0, 0.0)
+    history.add(100.0, 3.5)
+    # Слоты за 1, 2 и 3 секунду заполнены значением на момент события
+    assert history.recent(10) == pytest.approx([100.0] * 4)
+    assert history.count == 4
+
+
+def test_ring_buffer_wraps_around():
+    # Почти без сглаживания: в слот попадает последний замер
+    history = tp.SpeedHistory(size=3, interval=1.0, tau=1e-6)
+    for second in range(6):
+        history.add(float(second), float(second))
+    assert history.count == 3
+    assert history.recent(3) == pytest.approx([3.0, 4.0, 5.0])
+
+
+def test_long_gap_resets_the_whole_buffer():
+    history = _history(size=3)
+    history.add(100.0, 0.0)
+    history.add(50.0, 100.0)
+    assert history.count == 3
+    assert len(set(history.recent(3))) == 1
+
+
+def test_ewma_weight_depends_on_elapsed_time_not_event_count():
+    frequent, rare = _history(), _history()
+    frequent.add(0.0, 0.0)
+    rare.add(0.0, 0.0)
+    for step in range(1, 11):
+        frequent.add(100.0, step * 0.1)
+    rare.add(100.0, 1.0)
+    assert frequent.ewma == pytest.approx(rare.ewma)
+
+
+def test_idle_speed_decays_after_tau():
+    history = _history()
+    history.add(100.0, 0.0)
+    assert history.current(2.0) == 100.0
+    assert history.current(4.0) == pytest.approx(100.0 / 2.718281828, rel=1e-6)
+    assert history.current(60.0) < 1e-6
+
+
+def test_monitor_summary_remaining_and_eta():
+    monitor = tp.ThroughputMonitor()
+    monitor.update('a', 1000.0, downloaded=1000, total=11000, now=0.0)
+    monitor.update('b', 1000.0, downloaded=0, now=0.0)
+    summary = monitor.summary(queued=2, now=0.0)
+    assert summary['speed'] == 2000.0
+    assert summary['remaining'] == 10000
+    assert summary['unknown'] == 3
+    assert summary['eta'] == pytest.approx(5.0)
+    assert (summary['active'], summary['queued']) == (2, 2)
+
+
+def test_summary_adds_one_point_per_interval_regardless_of_polling():
+    monitor = tp.ThroughputMonitor()
+    monitor.update('a', 1000.0, now=0.0)
+    for step in range(20):
+        monitor.summary(now=step * 0.1)
+    assert monitor.total.count == 2
+
+    monitor.summary(now=2.0)
+    assert monitor.total.count == 3
+
+
+def test_finished_job_is_dropped():
+    monitor = tp.ThroughputMonitor()
+    monitor.update('a', 1000.0, now=0.0)
+    monitor.finish('a')
+    assert monitor.row('a') is None
+    assert monitor.summary(now=1.0)['active'] == 0
@@ -0,0 +1,55 @@
+﻿import os
+
+import thumbnails
+
+
+def _cache(tmp_path, max_disk_bytes):
+    return thumbnails.ThumbnailCache(cache_dir=str(tmp_path), max_disk_bytes=max_disk_bytes, max_workers=1)
+
+
+def _wait(cache):
+    # Очистка идет в пуле; один поток - задачи выполняются по порядку
+    cache._executor.submit(lambda: None).result(timeout=10)
+
+
+def _disk_usage(tmp_path):
+    return sum(os.path.getsize(path) for path in tmp_path.glob('*.png'))
+
+
+def test_disk_limit_is_enforced_during_session(tmp_path):
+    cache = _cache(tmp_path, max_disk_bytes=10_000)
+    _wait(cache)
+    try:
+        for i in range(50):
+            key = cache._key(f"https://i.example.com/{i}.jpg")
+            cache._write_disk(key, b'x' * 1000)
+            # Порядок использования для LRU
+            os.utime(cache._disk_path(key), (1000 + i, 1000 + i))
+            _wait(cache)
+        assert _disk_usage(tmp_path) <= 10_000
+        # Удалены самые старые, последние остались
+        assert os.path.exists(cache._disk_path(cache._key("https://i.example.com/49.jpg")))
+        assert not os.path.exists(cache._disk_path(cache._key("https://i.example.com/0.jpg")))
+    finally:
+        cache.close()
+
+
+def test_prune_runs_only_after_limit_is_exceeded(tmp_path, monkeypatch):
+    cache = _cache(tmp_path, max_disk_bytes=10_000)
+    _wait(cache)
+    prunes = []
+    original = cache._prune_disk
+    monkeypatch.setattr(cache, '_prune_disk', lambda: (prunes.append(1), original()))
+    try:
+        for i in range(9):
+            cache._write_disk(cache._key(str(i)), b'x' * 1000)
+        _wait(cache)
+        assert prunes == []
+
+        cache._write_disk(cache._key('9'), b'x' * 1000)
+        cache._write_disk(cache._key('10'), b'x' * 1000)
+        _wait(cache)
+        assert prunes == [1]
+        assert cache._disk_bytes == _disk_usage(tmp_path) <= 9_000
+    finally:
+        cache.close()
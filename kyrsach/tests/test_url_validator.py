@@ -0,0 +1,66 @@
+﻿import pytest
+
+from url_validator import URLValidator
+
+YOUTUBE = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+
+@pytest.mark.parametrize('url', [
+    'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+    'https://youtu.be/dQw4w9WgXcQ?si=abc',
+    'https://m.youtube.com/watch?v=dQw4w9WgXcQ&feature=share&t=42',
+    'https://www.youtube.com/shorts/dQw4w9WgXcQ',
+    'https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ?rel=0',
+    'https://music.youtube.com/watch?v=dQw4w9WgXcQ&list=RD1',
+    '  https://YOUTUBE.com/watch?utm_source=x&v=dQw4w9WgXcQ#t=10  ',
+])
+def test_youtube_variants_share_one_canonical_url(url):
+    assert URLValidator.canonicalize_url(url) == YOUTUBE
+    # ID чувствителен к регистру и не приводится к нижнему
+    assert URLValidator.extract_video_id(url) == 'dQw4w9WgXcQ'
+
+
+@pytest.mark.parametrize('url, canonical', [
+    ('https://www.tiktok.com/@user.name/video/7234567890123456789?is_from_webapp=1',
+     'https://www.tiktok.com/@/video/7234567890123456789'),
+    ('https://www.instagram.com/reel/CxYz_123/?igsh=abc', 'https://www.instagram.com/p/CxYz_123/'),
+    ('https://www.instagram.com/p/CxYz_123/', 'https://www.instagram.com/p/CxYz_123/'),
+    ('https://www.twitch.tv/videos/123456789', 'https://www.twitch.tv/videos/123456789'),
+    ('https://www.twitch.tv/streamer/clip/FunnyClip-abc', 'https://clips.twitch.tv/FunnyClip-abc'),
+    ('https://vk.com/video-12345_67890', 'https://vk.com/video-12345_67890'),
+    ('https://vk.com/feed?z=video-12345_67890%2Fpl', 'https://vk.com/video-12345_67890'),
+    ('https://rutube.ru/video/0123456789abcdef0123456789abcdef/?r=wd',
+     'https://rutube.ru/video/0123456789abcdef0123456789abcdef/'),
+    ('https://twitter.com/user/status/1234567890?s=20', 'https://x.com/i/status/1234567890'),
+    ('https://x.com/other/status/1234567890', 'https://x.com/i/status/1234567890'),
+    ('https://www.facebook.com/user/videos/1234567890/', 'https://www.facebook.com/watch/?v=1234567890'),
+    ('https://www.facebook.com/watch/?v=1234567890&ref=sharing', 'https://www.facebook.com/watch/?v=1234567890'),
+    ('https://player.vimeo.com/video/76979871', 'https://vimeo.com/76979871'),
+])
+def test_services_with_content_id(url, canonical):
+    assert URLValidator.canonicalize_url(url) == canonical
+
+
+@pytest.mark.parametrize('url, canonical', [
+    ('HTTPS://WWW.Example.COM:443/Path/?b=2&utm_source=x&a=1#frag', 'https://example.com/Path?a=1&b=2'),
+    ('https://soundcloud.com/artist/track?si=123&utm_medium=x', 'https://soundcloud.com/artist/track'),
+    ('https://www.youtube.com/playlist?list=PL123&si=x', 'https://youtube.com/playlist?list=PL123'),
+    ('https://twitter.com/user/media?s=20&t=abc', 'https://twitter.com/user/media'),
+    ('https://example.com/v?t=5&s=abc&ref=x&fbclid=1&gclid=2', 'https://example.com/v?ref=x&s=abc&t=5'),
+])
+def test_links_without_id_are_normalized(url, canonical):
+    assert URLValidator.canonicalize_url(url) == canonical
+    assert URLValidator.extract_video_id(url) is None
+
+
+def test_canonical_url_is_stable():
+    for url in ('https://youtu.be/dQw4w9WgXcQ', 'https://www.Example.com/a/?b=1&a=2'):
+        canonical = URLValidator.canonicalize_url(url)
+        assert URLValidator.canonicalize_url(canonical) == canonical
+
+
+def test_different_videos_stay_different():
+    assert (URLValidator.canonicalize_url('https://youtu.be/dQw4w9WgXcQ')
+            != URLValidator.canonicalize_url('https://youtu.be/dQw4w9WgXcq'))
+    assert (URLValidator.canonicalize_url('https://example.com/v?id=1')
+            != URLValidator.canonicalize_url('https://example.com/v?id=2'))
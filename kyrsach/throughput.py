@@ -0,0 +1,188 @@
+﻿import array
+import math
+import threading
+import time
+
+from config import AppConfig
+
+SPARK_CHARS = '▁▂▃▄▅▆▇█'
+
+
+class SpeedHistory:
+    """Сглаженная скорость и ее история в кольцевом буфере фиксированного размера.
+
+    Скорость сглаживается EWMA с постоянной времени tau: вес нового замера
+    зависит от прошедшего времени, а не от числа событий, поэтому частые
+    события прогресса не делают кривую резче. Раз в interval секунд
+    сглаженное значение записывается в следующую ячейку array('d');
+    память и время обработки не зависят от длительности загрузки.
+    """
+
+    __slots__ = ('samples', 'interval', 'tau', 'index', 'count', 'ewma', 'last_time', '_slot_time')
+
+    def __init__(self, size=AppConfig.SPEED_HISTORY_SIZE, interval=AppConfig.SPEED_SAMPLE_SECONDS,
+                 tau=AppConfig.SPEED_EWMA_SECONDS):
+        self.samples = array.array('d', bytes(8 * size))
+        self.interval = interval
+        self.tau = tau
+        self.index = 0
+        self.count = 0
+        self.ewma = 0.0
+        self.last_time = None
+        self._slot_time = None
+
+    def add(self, speed, now):
+        """Учитывает замер скорости (байт/с) в момент now (time.monotonic())"""
+        if self.last_time is None:
+            self.ewma = speed
+        elif now > self.last_time:
+            alpha = 1.0 - math.exp(-(now - self.last_time) / self.tau)
+            self.ewma += alpha * (speed - self.ewma)
+        self.last_time = now
+
+        size = len(self.samples)
+        if self._slot_time is None:
+            steps = 1
+            self._slot_time = now
+        else:
+            # Пропущенные интервалы (не было событий) заполняются текущим значением
+            steps = int((now - self._slot_time) / self.interval)
+            if steps >= size:
+                steps, self._slot_time = size, now
+            else:
+                self._slot_time += steps * self.interval
+        for _ in range(steps):
+            self.index = (self.index + 1) % size
+            self.count = min(self.count + 1, size)
+            self.samples[self.index] = self.ewma
+        if not steps:
+            self.samples[self.index] = self.ewma
+
+    def current(self, now):
+        """Сглаженная скорость; без событий дольше tau она затухает к нулю (загрузка встала)"""
+        if self.last_time is None:
+            return 0.0
+        idle = now - self.last_time
+        if idle <= self.tau:
+            return self.ewma
+        return self.ewma * math.exp(-(idle - self.tau) / self.tau)
+
+    def recent(self, count):
+        """Последние count значений истории, от старых к новым"""
+        count = min(count, self.count)
+        size = len(self.samples)
+        return [self.samples[(self.index - offset) % size] for offset in range(count - 1, -1, -1)]
+
+    def sparkline(self, width=AppConfig.SPARKLINE_WIDTH):
+        """История скорости строкой из символов ▁..█ (масштаб - максимум показанного окна)"""
+        values = self.recent(width)
+        peak = max(values, default=0.0)
+        if peak <= 0:
+            return SPARK_CHARS[0] * len(values)
+        top = len(SPARK_CHARS) - 1
+        return ''.join(SPARK_CHARS[min(top, int(value / peak * top + 0.5))] for value in values)
+
+
+class ThroughputMonitor:
+    """Сводная скорость, остаток и ETA очереди по событиям прогресса задач.
+
+    Обновляется из потоков загрузки (O(1) на событие), читается интерфейсом
+    раз в секунду (O(число идущих задач)). Состояние хранится только для
+    идущих задач и удаляется при их завершении.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.total = SpeedHistory()
+        self._total_time = None
+
+    def update(self, job_id, speed, downloaded=None, total=None, now=None):
+        """Учитывает событие прогресса задачи: скорость в байт/с, скачано и всего байт"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self._jobs[job_id] = {'history': SpeedHistory(), 'downloaded': 0, 'total': None}
+            job['history'].add(speed or 0.0, now)
+            if downloaded is not None:
+                job['downloaded'] = downloaded
+            if total:
+                job['total'] = total
+
+    def finish(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def summary(self, queued=0, now=None):
+        """
+        Сводка по очереди; вызывается периодически.
+
+        Точка в историю общей скорости добавляется не чаще раза в total.interval:
+        частота опроса интерфейсом (или лишние вызовы) не меняет ни историю, ни сглаживание.
+
+        Args:
+            queued (int): задачи, которые еще не начали качаться (их размер неизвестен)
+
+        Returns:
+            dict: speed (байт/с), remaining (байт задач с известным размером), unknown (задачи
+                без размера), eta (с или None), active, queued, sparkline
+        """
+        now = time.monotonic() if now is None else now
+        speed = remaining = 0.0
+        unknown = queued
+        with self._lock:
+            for job in self._jobs.values():
+                speed += job['history'].current(now)
+                if job['total']:
+                    remaining += max(job['total'] - job['downloaded'], 0)
+                else:
+                    unknown += 1
+            active = len(self._jobs)
+            if self._total_time is None or now - self._total_time >= self.total.interval:
+                self.total.add(speed, now)
+                self._total_time = now
+            smoothed = self.total.ewma
+        return {
+            'speed': speed,
+            'remaining': remaining,
+            'unknown': unknown,
+            # По сглаженной общей скорости: ETA не скачет от события к событию
+            'eta': remaining / smoothed if remaining and smoothed > 1 else None,
+            'active': active,
+            'queued': queued,
+            'sparkline': self.total.sparkline(),
+        }
+
+    def row(self, job_id, now=None):
+        """Возвращает (история скорости строкой, сглаженная оставшаяся секунды или None) для строки таблицы"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            speed = job['history'].current(now)
+            eta = (job['total'] - job['downloaded']) / speed if job['total'] and speed > 1 else None
+            return job['history'].sparkline(), eta
+
+    def job_ids(self):
+        with self._lock:
+            return list(self._jobs)
+
+
+def format_bytes(size):
+    """Размер в байтах строкой: КБ, МБ, ГБ"""
+    for unit in ('Б', 'КБ', 'МБ', 'ГБ'):
+        if size < 1024 or unit == 'ГБ':
+            return f"{size:.0f} {unit}" if unit == 'Б' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def format_eta(seconds):
+    """Оставшееся время как ММ:СС или Ч:ММ:СС"""
+    if seconds is None:
+        return '—'
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
@@ -0,0 +1,218 @@
+﻿import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from config import AppConfig
+
+# Уменьшение превью (необязательная зависимость Pillow)
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Без Pillow уменьшать картинки нечем - превью не показываются
+THUMBNAILS_AVAILABLE = Image is not None
+
+logger = logging.getLogger(__name__)
+
+# Очистка диска оставляет эту долю лимита, чтобы не запускаться после каждой новой картинки
+DISK_PRUNE_TARGET = 0.9
+
+
+def pick_thumbnail_url(info, min_width=AppConfig.THUMBNAIL_SIZE[0] * 2):
+    """
+    Выбирает ссылку на превью из словаря yt-dlp.
+
+    Берет самое маленькое превью не уже min_width, чтобы не качать
+    полноразмерную картинку ради иконки в строке таблицы.
+    """
+    thumbnails = [t for t in info.get('thumbnails') or [] if t.get('url')]
+    sized = [t for t in thumbnails if t.get('width') and t['width'] >= min_width]
+    if sized:
+        return min(sized, key=lambda t: t['width'])['url']
+    return info.get('thumbnail') or (thumbnails[-1]['url'] if thumbnails else None)
+
+
+class ThumbnailCache:
+    """Превью для строк таблицы загрузок.
+
+    Картинки скачиваются и уменьшаются в фоновом пуле, результат (PNG)
+    хранится в LRU в памяти, ограниченной по объему, и на диске, ограниченном
+    по размеру папки: объем записанного считается, и при превышении лимита
+    в пуле запускается очистка давно не использованных файлов. Повторный
+    показ и перезапуск приложения берут превью из кэша без сети. Объекты Tk
+    создает вызывающий код в главном потоке.
+    """
+
+    def __init__(self, cache_dir=AppConfig.THUMBNAIL_CACHE, size=AppConfig.THUMBNAIL_SIZE,
+                 max_memory_bytes=AppConfig.THUMBNAIL_MEMORY_MB * 1024 ** 2,
+                 max_disk_bytes=AppConfig.THUMBNAIL_DISK_MB * 1024 ** 2, max_workers=4, timeout=10):
+        self.cache_dir = cache_dir
+        self.size = tuple(size)
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.timeout = timeout
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._pending = {}
+        # Объем папки на диске; точное значение дает каждая очистка
+        self._disk_bytes = 0
+        self._prune_scheduled = True
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnail")
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'fetched': 0, 'failed': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._executor.submit(self._prune_disk)
+
+    def _key(self, url):
+        return hashlib.sha1(f"{url}|{self.size[0]}x{self.size[1]}".encode('utf-8')).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def _remember(self, key, data):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def get_cached(self, url):
+        """Возвращает PNG из памяти без обращения к диску и сети, иначе None"""
+        key = self._key(url)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+        return data
+
+    def request(self, url, callback):
+        """
+        Запрашивает превью; callback(url, png_bytes) вызывается из фонового потока.
+
+        При попадании в память callback вызывается сразу, при ошибке
+        загрузки png_bytes равен None. Повторные запросы одной ссылки,
+        пока она загружается, объединяются.
+        """
+        if not url or not THUMBNAILS_AVAILABLE:
+            return
+        data = self.get_cached(url)
+        if data is not None:
+            callback(url, data)
+            return
+
+        key = self._key(url)
+        with self._lock:
+            waiters = self._pending.get(key)
+            if waiters is not None:
+                waiters.append(callback)
+                return
+            self._pending[key] = [callback]
+        self._executor.submit(self._load, url, key)
+
+    def _load(self, url, key):
+        data = None
+        try:
+            data = self._read_disk(key)
+            if data is None:
+                data = self._fetch(url)
+                self._write_disk(key, data)
+            self._remember(key, data)
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.debug("Не удалось получить превью %s: %s", url, e)
+        finally:
+            with self._lock:
+                waiters = self._pending.pop(key, [])
+        for callback in waiters:
+            callback(url, data)
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        # Время доступа для LRU на диске
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.stats['disk_hits'] += 1
+        return data
+
+    def _fetch(self, url):
+        """Скачивает картинку и уменьшает ее до размера превью"""
+        response = self._session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        with Image.open(io.BytesIO(response.content)) as image:
+            image.draft('RGB', self.size)
+            image = image.convert('RGB')
+            image.thumbnail(self.size)
+            output = io.BytesIO()
+            image.save(output, format='PNG', optimize=True)
+        self.stats['fetched'] += 1
+        return output.getvalue()
+
+    def _write_disk(self, key, data):
+        path = self._disk_path(key)
+        temp_path = f"{path}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.debug("Не удалось сохранить превью в кэш: %s", e)
+            return
+        with self._lock:
+            self._disk_bytes += len(data)
+            if self._disk_bytes <= self.max_disk_bytes or self._prune_scheduled:
+                return
+            self._prune_scheduled = True
+        self._executor.submit(self._prune_disk)
+
+    def _prune_disk(self):
+        """Удаляет давно не использованные превью, пока папка больше лимита"""
+        with self._lock:
+            counted = self._disk_bytes
+        total = 0
+        try:
+            entries = []
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith('.png'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total += stat.st_size
+            if total > self.max_disk_bytes:
+                target = self.max_disk_bytes * DISK_PRUNE_TARGET
+                entries.sort()
+                for _, size, path in entries:
+                    if total <= target:
+                        break
+                    os.remove(path)
+                    total -= size
+        except OSError as e:
+            logger.debug("Ошибка очистки кэша превью: %s", e)
+        finally:
+            with self._lock:
+                # Записанное во время очистки добавляется сверху (часть его могла попасть в подсчет - это запас)
+                self._disk_bytes = total + self._disk_bytes - counted
+                self._prune_scheduled = False
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._session.close()
@@ -1,17 +1,19 @@
 ﻿import re
 import requests
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, parse_qsl, urlencode
 from config import AppConfig
 import logging
-from typing import Tuple, Optional, Dict, Any
+from typing import Tuple, Optional, Dict, Any, Iterable, Callable
+from preflight import URLPreflight
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class URLValidator:
     """Улучшенный валидатор URL с расширенной поддержкой сервисов и надежной проверкой"""
     
+    # Общий пул keep-alive сессий для проверки доступности
+    _preflight = None
+
     # Расширенные паттерны для различных сервисов
     EXTENDED_PATTERNS = {
         'YouTube': [
@@ -48,6 +50,50 @@ class URLValidator:
             r'm\.rutube\.ru'
         ]
     }
+
+    # ID содержимого в пути ссылки: (регулярное выражение по "домен/путь", шаблон канонической ссылки).
+    # Домен приводится к нижнему регистру и без префиксов www./m./mobile.; регистр ID сохраняется
+    CONTENT_ID_PATTERNS = [
+        (r'^(?:youtube\.com|music\.youtube\.com|youtube-nocookie\.com)/(?:shorts|embed|v|e|live)/([\w-]{11})(?:[/?]|$)',
+         'https://www.youtube.com/watch?v={id}'),
+        (r'^youtu\.be/([\w-]{11})(?:[/?]|$)', 'https://www.youtube.com/watch?v={id}'),
+        (r'^tiktok\.com/(?:@[\w.-]*/video|embed(?:/v2)?|v)/(\d+)', 'https://www.tiktok.com/@/video/{id}'),
+        (r'^(?:instagram\.com|instagr\.am)/(?:[\w.]+/)?(?:p|reels?|tv)/([\w-]+)', 'https://www.instagram.com/p/{id}/'),
+        (r'^twitch\.tv/videos/(\d+)', 'https://www.twitch.tv/videos/{id}'),
+        (r'^(?:clips\.twitch\.tv|twitch\.tv/\w+/clip)/([\w-]+)', 'https://clips.twitch.tv/{id}'),
+        (r'^(?:vk\.com|vk\.ru|vkvideo\.ru)/(?:video|clip)(-?\d+_\d+)', 'https://vk.com/video{id}'),
+        (r'^rutube\.ru/(?:video|shorts|play/embed)/([0-9a-f]{32})', 'https://rutube.ru/video/{id}/'),
+        (r'^(?:twitter\.com|x\.com)/(?:\w+|i(?:/web)?)/status(?:es)?/(\d+)', 'https://x.com/i/status/{id}'),
+        (r'^facebook\.com/(?:[\w.-]+/videos/(?:[\w.-]+/)?|reel/)(\d+)', 'https://www.facebook.com/watch/?v={id}'),
+        (r'^(?:vimeo\.com|player\.vimeo\.com/video)/(?:channels/\w+/|groups/\w+/videos/)?(\d+)',
+         'https://vimeo.com/{id}'),
+    ]
+
+    # ID содержимого в параметре ссылки: (домен/путь, параметр, выражение по значению, шаблон)
+    CONTENT_ID_PARAMS = [
+        (r'^(?:youtube\.com|music\.youtube\.com)/watch$', 'v', r'^([\w-]{11})$', 'https://www.youtube.com/watch?v={id}'),
+        (r'^facebook\.com/(?:watch|watch/live|video\.php)$', 'v', r'^(\d+)$', 'https://www.facebook.com/watch/?v={id}'),
+        (r'^(?:vk\.com|vk\.ru|vkvideo\.ru)/', 'z', r'^(?:video|clip)(-?\d+_\d+)', 'https://vk.com/video{id}'),
+    ]
+
+    # Параметры рекламных и перекрестных меток, не влияющие на содержимое на любом сайте (и все utm_*)
+    TRACKING_PARAMS = frozenset({
+        'fbclid', 'gclid', 'dclid', 'gbraid', 'wbraid', 'msclkid', 'yclid', 'igshid', 'igsh', 'mibextid'
+    })
+
+    # Короткие параметры шаринга, которые безопасно убирать только на своем сервисе:
+    # на других сайтах s, t или ref могут быть частью адреса содержимого
+    SERVICE_TRACKING_PARAMS = {
+        'youtube.com': frozenset({'si', 'feature', 'pp', 't', 'time_continue', 'ab_channel',
+                                  'embeds_referring_euri', 'embeds_euri'}),
+        'youtu.be': frozenset({'si', 'feature', 't'}),
+        'youtube-nocookie.com': frozenset({'si', 'feature'}),
+        'soundcloud.com': frozenset({'si', 'ref'}),
+        'twitter.com': frozenset({'s', 't', 'ref_src', 'ref_url'}),
+        'x.com': frozenset({'s', 't', 'ref_src', 'ref_url'}),
+        'tiktok.com': frozenset({'is_from_webapp', 'is_copy_url', 'sender_device', 'share_id', '_r', '_t'}),
+        'facebook.com': frozenset({'rdid', 'ref'}),
+    }
     
     @classmethod
     def validate_url(cls, url: str) -> bool:
@@ -68,12 +114,12 @@ class URLValidator:
         
         # Минимальная длина URL
         if len(url) < 10:
-            logger.debug(f"URL слишком короткий: {len(url)} символов")
+            logger.debug("URL слишком короткий: %d символов", len(url))
             return False
         
         # Максимальная длина URL (RFC 2616 рекомендует не более 2048)
         if len(url) > 2048:
-            logger.debug(f"URL слишком длинный: {len(url)} символов")
+            logger.debug("URL слишком длинный: %d символов", len(url))
             return False
         
         try:
@@ -82,12 +128,12 @@ class URLValidator:
             
             # Проверка схемы
             if parsed.scheme not in ('http', 'https'):
-                logger.debug(f"Неподдерживаемая схема: {parsed.scheme}")
+                logger.debug("Неподдерживаемая схема: %s", parsed.scheme)
                 return False
             
             # Проверка домена
             if not parsed.netloc or len(parsed.netloc) < 3:
-                logger.debug(f"Некорректный домен: {parsed.netloc}")
+                logger.debug("Некорректный домен: %s", parsed.netloc)
                 return False
             
             # Проверка на наличие недопустимых символов
@@ -98,13 +144,13 @@ class URLValidator:
             
             # Дополнительная проверка домена
             if not cls._is_valid_domain(parsed.netloc):
-                logger.debug(f"Недопустимый домен: {parsed.netloc}")
+                logger.debug("Недопустимый домен: %s", parsed.netloc)
                 return False
                 
             return True
             
         except Exception as e:
-            logger.error(f"Ошибка при валидации URL {url}: {str(e)}")
+            logger.error("Ошибка при валидации URL %s: %s", url, e)
             return False
     
     @classmethod
@@ -164,10 +210,10 @@ class URLValidator:
                     for pattern in patterns:
                         try:
                             if re.search(pattern, url_lower):
-                                logger.info(f"Сервис определен: {service_name}")
+                                logger.debug("Сервис определен: %s", service_name)
                                 return service_name, service_info
                         except re.error as e:
-                            logger.warning(f"Некорректный regex паттерн {pattern}: {e}")
+                            logger.warning("Некорректный regex паттерн %s: %s", pattern, e)
                             continue
             
             # Затем проверяем расширенные паттерны
@@ -177,10 +223,10 @@ class URLValidator:
                         if re.search(pattern, url_lower):
                             # Создаем базовую информацию о сервисе
                             service_info = cls._get_default_service_info(service_name)
-                            logger.info(f"Сервис определен через расширенные паттерны: {service_name}")
+                            logger.debug("Сервис определен через расширенные паттерны: %s", service_name)
                             return service_name, service_info
                     except re.error as e:
-                        logger.warning(f"Некорректный regex паттерн {pattern}: {e}")
+                        logger.warning("Некорректный regex паттерн %s: %s", pattern, e)
                         continue
             
             # Если не удалось определить, пытаемся по домену
@@ -190,13 +236,13 @@ class URLValidator:
             for service_name in cls.EXTENDED_PATTERNS.keys():
                 if service_name.lower() in domain:
                     service_info = cls._get_default_service_info(service_name)
-                    logger.info(f"Сервис определен по домену: {service_name}")
+                    logger.debug("Сервис определен по домену: %s", service_name)
                     return service_name, service_info
                     
         except Exception as e:
-            logger.error(f"Ошибка при определении сервиса для URL {url}: {str(e)}")
+            logger.error("Ошибка при определении сервиса для URL %s: %s", url, e)
         
-        logger.debug(f"Сервис не поддерживается для URL: {url}")
+        logger.debug("Сервис не поддерживается для URL: %s", url)
         return "Неподдерживаемый сервис", None
     
     @classmethod
@@ -241,39 +287,106 @@ class URLValidator:
             if service_info and 'icon' in service_info:
                 return service_info['icon']
         except Exception as e:
-            logger.error(f"Ошибка при получении иконки для {url}: {e}")
+            logger.error("Ошибка при получении иконки для %s: %s", url, e)
         
         return '🌐'
     
+    @staticmethod
+    def _normalized_parts(url: str) -> Tuple[str, str, list]:
+        """
+        Разбирает ссылку на домен (нижний регистр, без www./m./mobile. и порта), путь и параметры.
+
+        Raises:
+            ValueError: ссылку не удалось разобрать
+        """
+        parsed = urlparse(url.strip())
+        if not parsed.netloc:
+            parsed = urlparse(f"https://{url.strip()}")
+        host = (parsed.hostname or '').rstrip('.')
+        if not host:
+            raise ValueError(f"нет домена в ссылке {url}")
+        for prefix in ('www.', 'm.', 'mobile.'):
+            if host.startswith(prefix):
+                host = host[len(prefix):]
+                break
+        path = parsed.path.rstrip('/')
+        return host, path, parse_qsl(parsed.query, keep_blank_values=True)
+
+    @classmethod
+    def _content_id(cls, url: str) -> Tuple[Optional[str], Optional[str]]:
+        """Возвращает (ID содержимого, шаблон канонической ссылки) или (None, None)"""
+        host, path, params = cls._normalized_parts(url)
+        location = f"{host}{path}"
+        for pattern, template in cls.CONTENT_ID_PATTERNS:
+            match = re.search(pattern, location)
+            if match:
+                return match.group(1), template
+        query = dict(params)
+        for pattern, param, value_pattern, template in cls.CONTENT_ID_PARAMS:
+            if param in query and re.search(pattern, location):
+                match = re.search(value_pattern, query[param])
+                if match:
+                    return match.group(1), template
+        return None, None
+
     @classmethod
     def extract_video_id(cls, url: str) -> Optional[str]:
         """
-        Извлекает ID видео из URL (полезно для некоторых сервисов).
+        Извлекает ID видео из URL для всех сервисов, где он есть в самой ссылке.
+
+        Короткие ссылки, требующие перехода (vm.tiktok.com, fb.watch), ID не дают.
         
         Args:
             url (str): URL видео
             
         Returns:
-            Optional[str]: ID видео или None
+            Optional[str]: ID видео (с сохранением регистра) или None
         """
         try:
-            parsed = urlparse(url.lower())
-            
-            # YouTube
-            if 'youtube.com' in parsed.netloc:
-                if 'watch' in parsed.path:
-                    return parse_qs(parsed.query).get('v', [None])[0]
-                elif 'embed' in parsed.path:
-                    return parsed.path.split('/')[-1]
-            elif 'youtu.be' in parsed.netloc:
-                return parsed.path.lstrip('/')
-            
-            # Для других сервисов можно добавить аналогичную логику
-            
+            return cls._content_id(url)[0]
         except Exception as e:
-            logger.error(f"Ошибка при извлечении ID видео из {url}: {e}")
+            logger.error("Ошибка при извлечении ID видео из %s: %s", url, e)
         
         return None
+
+    @classmethod
+    def _service_tracking_params(cls, host: str) -> frozenset:
+        """Параметры отслеживания сервиса, которому принадлежит домен (с учетом поддоменов)"""
+        for domain, params in cls.SERVICE_TRACKING_PARAMS.items():
+            if host == domain or host.endswith(f".{domain}"):
+                return params
+        return frozenset()
+
+    @classmethod
+    def canonicalize_url(cls, url: str) -> str:
+        """
+        Приводит ссылку к каноническому виду, одинаковому для всех вариантов ссылки на одно видео.
+
+        youtu.be/X, m.youtube.com/watch?v=X&si=..., youtube.com/shorts/X дают одну и ту же
+        ссылку watch?v=X. Для ссылок без ID приводятся к нижнему регистру схема и домен,
+        убираются www./m., порт, якорь, завершающий слеш и параметры отслеживания,
+        оставшиеся параметры сортируются. Каноническая ссылка сама пригодна для загрузки.
+
+        Args:
+            url (str): исходная ссылка
+
+        Returns:
+            str: каноническая ссылка (исходная без пробелов, если ее не удалось разобрать)
+        """
+        try:
+            content_id, template = cls._content_id(url)
+            if content_id:
+                return template.format(id=content_id)
+            host, path, params = cls._normalized_parts(url)
+            service_params = cls._service_tracking_params(host)
+            params = sorted(
+                (key, value) for key, value in params
+                if key not in cls.TRACKING_PARAMS and key not in service_params and not key.startswith('utm_')
+            )
+            return f"https://{host}{path}" + (f"?{urlencode(params)}" if params else '')
+        except Exception as e:
+            logger.debug("Не удалось привести ссылку %s к каноническому виду: %s", url, e)
+            return url.strip()
     
     @classmethod
     def is_playlist(cls, url: str) -> bool:
@@ -296,10 +409,22 @@ class URLValidator:
             # Можно добавить проверки для других сервисов
             
         except Exception as e:  
-            logger.error(f"Ошибка при проверке плейлиста {url}: {e}")
+            logger.error("Ошибка при проверке плейлиста %s: %s", url, e)
         
         return False
     
+    @classmethod
+    def get_preflight(cls) -> URLPreflight:
+        """
+        Возвращает общий экземпляр предварительной проверки URL.
+
+        Returns:
+            URLPreflight: экземпляр с пулом сессий и кэшем результатов
+        """
+        if cls._preflight is None:
+            cls._preflight = URLPreflight()
+        return cls._preflight
+
     @classmethod
     def check_url_accessibility(cls, url: str, timeout: int = 10) -> bool:
         """
@@ -312,9 +437,19 @@ class URLValidator:
         Returns:
             bool: True, если URL доступен
         """
-        try:
-            response = requests.head(url, timeout=timeout, allow_redirects=True)
-            return response.status_code < 400
-        except Exception as e:
-            logger.warning(f"URL недоступен {url}: {e}")
-            return False
\ No newline at end of file
+        return cls.get_preflight().check(url, timeout=timeout)['ok']
+
+    @classmethod
+    def preflight_urls(cls, urls: Iterable[str],
+                       progress_callback: Optional[Callable[[int, int], None]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Параллельно проверяет доступность набора URL перед загрузкой.
+        
+        Args:
+            urls (Iterable[str]): URL для проверки
+            progress_callback (Callable): вызывается с (проверено, всего)
+            
+        Returns:
+            Dict[str, Dict[str, Any]]: результаты проверки по каждому URL
+        """
+        return cls.get_preflight().check_many(urls, progress_callback=progress_callback)
@@ -0,0 +1,162 @@
+﻿import argparse
+import logging
+import os
+import socket
+import threading
+
+from config import AppConfig
+from download_manager import DownloadManager
+from job_queue import JobQueue
+from log_setup import setup_logging, shutdown_logging, apply_levels
+from perf_profile import get_profile
+
+logger = logging.getLogger(__name__)
+
+
+class QueueWorker:
+    """Узел, который берет задачи из общей очереди и качает их своим DownloadManager.
+
+    Арендует столько задач, сколько у менеджера свободных воркеров, и раз
+    в heartbeat_seconds продлевает аренду, отправляя координатору прогресс.
+    Если аренда потеряна (например, узел надолго завис), задача еще не
+    начавшая качаться снимается локально, а результат уже идущей будет отброшен очередью.
+    """
+
+    def __init__(self, job_queue, worker_id=None, lease_seconds=AppConfig.JOB_LEASE_SECONDS,
+                 heartbeat_seconds=AppConfig.JOB_HEARTBEAT_SECONDS, poll_seconds=AppConfig.JOB_POLL_SECONDS):
+        self.job_queue = job_queue
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.poll_seconds = poll_seconds
+        self.manager = DownloadManager(self._on_progress, self._on_completion)
+        # download_id -> job_id и последний прогресс задач, которые сейчас у этого узла
+        self._jobs = {}
+        self._reports = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.completed = 0
+
+    @property
+    def capacity(self):
+        return self.manager.perf.get('concurrency', 'max_parallel_downloads')
+
+    def _on_progress(self, download_id, progress, speed, status, filename):
+        with self._lock:
+            job_id = self._jobs.get(download_id)
+            if job_id is not None:
+                self._reports[job_id] = {'progress': progress, 'speed': speed, 'status': status, 'filename': filename}
+
+    def _on_completion(self, download_id, success, message, result):
+        with self._lock:
+            job_id = self._jobs.pop(download_id, None)
+            self._reports.pop(job_id, None)
+        if job_id is None:
+            return
+        self.job_queue.complete(job_id, self.worker_id, success, message, checksum=result['checksum'])
+        self.completed += 1
+        logger.info("Задача %s завершена (%s)", job_id, "успешно" if success else message)
+
+    def _lease_jobs(self):
+        """Арендует задачи под свободные места менеджера"""
+        with self._lock:
+            free = self.capacity - len(self._jobs)
+        if free <= 0:
+            return 0
+        jobs = self.job_queue.lease(self.worker_id, limit=free, lease_seconds=self.lease_seconds)
+        for job in jobs:
+            # Блокировка удерживается до регистрации, чтобы ранний вызов прогресса нашел задачу
+            with self._lock:
+                download_id = self.manager.add_download(job['url'], job['type'], job['quality'], job['path'])
+                self._jobs[download_id] = job['id']
+                self._reports[job['id']] = {'progress': 0, 'speed': 0.0, 'status': 'В очереди', 'filename': ''}
+            logger.info("Взята задача %s: %s", job['id'], job['url'])
+        return len(jobs)
+
+    def _heartbeat(self):
+        """Продлевает аренду своих задач и снимает те, что достались другому узлу"""
+        with self._lock:
+            reports = {job_id: dict(report) for job_id, report in self._reports.items()}
+        lost = self.job_queue.heartbeat(self.worker_id, reports, lease_seconds=self.lease_seconds)
+        if not lost:
+            return
+        with self._lock:
+            for download_id, job_id in list(self._jobs.items()):
+                if job_id in lost:
+                    del self._jobs[download_id]
+                    self._reports.pop(job_id, None)
+                    # Еще не начатая задача без других получателей пропускается воркером менеджера
+                    self.manager.detach(download_id)
+                    logger.warning("Аренда задачи %s потеряна, задача снята с узла %s", job_id, self.worker_id)
+
+    def _heartbeat_loop(self):
+        while not self._stop_event.wait(self.heartbeat_seconds):
+            try:
+                self._heartbeat()
+            except Exception as e:
+                logger.warning("Не удалось отправить пульс: %s", e)
+
+    def run(self, exit_when_empty=False):
+        """Главный цикл узла; возвращается после stop() или, с exit_when_empty, когда очередь пуста"""
+        logger.info("Воркер %s подключен к очереди %s", self.worker_id, self.job_queue.path)
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name="queue-heartbeat", daemon=True)
+        heartbeat.start()
+        self._heartbeat()
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    leased = self._lease_jobs()
+                except Exception as e:
+                    logger.warning("Не удалось получить задачи из очереди: %s", e)
+                    leased = 0
+                with self._lock:
+                    busy = bool(self._jobs)
+                if exit_when_empty and not leased and not busy:
+                    break
+                self._stop_event.wait(self.poll_seconds)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Возвращает незавершенные задачи в очередь и останавливает менеджер"""
+        self._stop_event.set()
+        with self._lock:
+            jobs, self._jobs = self._jobs, {}
+            self._reports.clear()
+        for job_id in jobs.values():
+            try:
+                self.job_queue.release(job_id, self.worker_id)
+            except Exception as e:
+                logger.warning("Не удалось вернуть задачу %s в очередь: %s", job_id, e)
+        if jobs:
+            logger.info("Возвращено в очередь задач: %d", len(jobs))
+        self.manager.stop_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воркер общей очереди загрузок Video Downloader Pro")
+    parser.add_argument('--db', default=AppConfig.JOB_QUEUE_DB, help="Файл очереди SQLite")
+    parser.add_argument('--id', help="ID воркера (по умолчанию хост-pid)")
+    parser.add_argument('--lease', type=float, default=AppConfig.JOB_LEASE_SECONDS, help="Время аренды задачи, с")
+    parser.add_argument('--heartbeat', type=float, default=AppConfig.JOB_HEARTBEAT_SECONDS, help="Период пульса, с")
+    parser.add_argument('--exit-when-empty', action='store_true', help="Завершиться, когда очередь опустеет")
+    args = parser.parse_args()
+    if args.heartbeat >= args.lease:
+        parser.error("--heartbeat должен быть меньше --lease")
+
+    setup_logging(get_profile().section('logging'))
+    get_profile().add_listener(lambda profile: apply_levels(profile.section('logging')))
+    job_queue = JobQueue(args.db)
+    worker = QueueWorker(job_queue, args.id, lease_seconds=args.lease, heartbeat_seconds=args.heartbeat)
+    try:
+        worker.run(exit_when_empty=args.exit_when_empty)
+    except KeyboardInterrupt:
+        # Незавершенные задачи уже возвращены в очередь в run()
+        pass
+    finally:
+        job_queue.close()
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+﻿import copy
+import logging
+import re
+from collections import OrderedDict
+from functools import lru_cache
+
+import yt_dlp
+from yt_dlp.postprocessor import FFmpegMergerPP
+from perf_profile import get_profile
+from log_setup import ytdlp_logger
+
+logger = logging.getLogger(__name__)
+
+# Общие заголовки для всех сервисов
+BASE_HTTP_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-us,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate',
+    'DNT': '1',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none'
+}
+
+# Формат качества YouTube -> цепочка форматов с приоритетом mp4
+YOUTUBE_FORMAT_MAP = {
+    'best[height<=2160]': 'best[height<=2160][ext=mp4]/best[height<=2160]/best[ext=mp4]/best',
+    'best[height<=1080]': 'best[height<=1080][ext=mp4]/best[height<=1080]/best[ext=mp4]/best',
+    'best[height<=720]': 'best[height<=720][ext=mp4]/best[height<=720]/best[ext=mp4]/best',
+    'best[height<=480]': 'best[height<=480][ext=mp4]/best[height<=480]/best[ext=mp4]/best',
+    'best[height<=360]': 'best[height<=360][ext=mp4]/best[height<=360]/best[ext=mp4]/best',
+    'best': 'best[ext=mp4]/best'
+}
+
+
+@lru_cache(maxsize=1)
+def can_merge_streams():
+    """Доступен ли ffmpeg для склейки отдельных видео- и аудиопотоков"""
+    try:
+        return FFmpegMergerPP(None).available
+    except Exception:
+        return False
+
+
+def merged_format(quality_format):
+    """
+    Превращает пресет качества 'best[height<=N]' в цепочку с раздельными потоками.
+
+    Сначала mp4+m4a (склейка в mp4 без перекодирования), затем любые
+    video+audio, и только потом файлы, где звук и видео уже вместе.
+    """
+    match = re.fullmatch(r'best((?:\[[^\]]+\])*)', quality_format)
+    if not match:
+        return quality_format
+    filters = match.group(1)
+    chain = (f'bestvideo{filters}[ext=mp4]+bestaudio[ext=m4a]', f'bestvideo{filters}+bestaudio',
+             f'best{filters}[ext=mp4]', f'best{filters}', 'best')
+    # Без фильтров best{filters} и последний запасной вариант совпадают
+    return '/'.join(dict.fromkeys(chain))
+
+
+def _service_overrides(service_name):
+    """Возвращает специальные настройки для сервиса"""
+    if service_name == 'YouTube':
+        return {
+            'http_headers': {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                'Referer': 'https://www.youtube.com/',
+                'Origin': 'https://www.youtube.com',
+            },
+            'extractor_args': {
+                'youtube': {
+                    'player_client': ['web'],  # Используем только web клиент
+                    'formats': 'missing_pot'  # Разрешаем форматы без PO Token
+                }
+            },
+            # Упрощенные настройки формата
+            'format': 'best[ext=mp4]/best',
+        }
+    if service_name == 'TikTok':
+        return {
+            'http_headers': {
+                'Referer': 'https://www.tiktok.com/',
+                'Origin': 'https://www.tiktok.com',
+                'Authority': 'www.tiktok.com',
+                'Cache-Control': 'max-age=0',
+                'Sec-Ch-Ua': '"Not A(Brand";v="99", "Google Chrome";v="121", "Chromium";v="121"',
+                'Sec-Ch-Ua-Mobile': '?0',
+                'Sec-Ch-Ua-Platform': '"macOS"'
+            },
+            'extractor_args': {
+                'tiktok': {
+                    'webpage_url_basename': 'video',
+                    'api_hostname': 'api.tiktokv.com'
+                }
+            }
+        }
+    if service_name == 'Instagram':
+        return {
+            'http_headers': {
+                'Referer': 'https://www.instagram.com/',
+                'Origin': 'https://www.instagram.com',
+                'X-Instagram-AJAX': '1',
+                'X-Requested-With': 'XMLHttpRequest'
+            }
+        }
+    return {}
+
+
+@lru_cache(maxsize=256)
+def _compile_profile(service_name, download_type, quality, profile_version):
+    """Собирает профиль настроек yt-dlp один раз для комбинации сервис/тип/качество и версии профиля производительности"""
+    perf = get_profile()
+    retries = perf.section('retries', service_name)
+    rate_limits = perf.section('rate_limits', service_name)
+    chunks = perf.section('chunks', service_name)
+
+    ydl_opts = {
+        'outtmpl': '%(title)s.%(ext)s',
+        'noplaylist': True,
+        # Вывод yt-dlp идет в логгер yt_dlp (ротируемый файл), строки прогресса не печатаются
+        'quiet': True,
+        'noprogress': True,
+        'no_warnings': False,
+        'fragment_retries': retries['fragment_retries'],
+        'retries': retries['retries'],
+        'http_headers': dict(BASE_HTTP_HEADERS),
+        'socket_timeout': perf.get('timeouts', 'socket_timeout', service_name),
+        'nocheckcertificate': True,
+        'geo_bypass': True,
+        'extractor_retries': retries['extractor_retries'],
+        'file_access_retries': retries['file_access_retries'],
+        'sleep_interval': rate_limits['sleep_interval'],
+        'max_sleep_interval': rate_limits['max_sleep_interval'],
+        'ratelimit': rate_limits['ratelimit'],
+        'http_chunk_size': chunks['http_chunk_size'],
+        # HLS/DASH: фрагменты качаются параллельно и дописываются в файл по порядку
+        'concurrent_fragment_downloads': chunks['concurrent_fragment_downloads'],
+        'writesubtitles': False,
+        'writeautomaticsub': False,
+        'ignoreerrors': False,
+        'no_check_certificates': True,
+        'prefer_insecure': False,
+        # Отключаем прокси принудительно
+        'proxy': '',
+        'source_address': None
+    }
+
+    overrides = _service_overrides(service_name)
+    ydl_opts.update({
+        **overrides,
+        'http_headers': {**ydl_opts['http_headers'], **overrides.get('http_headers', {})}
+    })
+
+    # Обработка аудио загрузок
+    if download_type == 'Только аудио (MP3)':
+        ydl_opts.update({
+            'format': 'bestaudio/best' if service_name == 'SoundCloud' else 'bestaudio[ext=m4a]/bestaudio/best',
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': '320' if service_name == 'SoundCloud' else '192'
+            }]
+        })
+    else:
+        # Обработка видео загрузок
+        quality_format = perf.section('video_qualities').get(quality, 'best')
+
+        if service_name != 'TikTok' and can_merge_streams():
+            # Высокие разрешения есть только раздельными потоками; они качаются параллельно и склеиваются
+            ydl_opts['format'] = merged_format(quality_format)
+            ydl_opts['merge_output_format'] = 'mp4'
+        elif service_name == 'YouTube':
+            ydl_opts['format'] = YOUTUBE_FORMAT_MAP.get(quality_format, YOUTUBE_FORMAT_MAP['best'])
+        elif service_name == 'TikTok' or quality_format == 'best':
+            ydl_opts['format'] = 'best[ext=mp4]/best'
+        else:
+            ydl_opts['format'] = f'{quality_format}[ext=mp4]/{quality_format}/best[ext=mp4]/best'
+
+        # Приведение к mp4 (noop/ремукс/перекодирование) выбирает VideoOutputProcessor после загрузки
+
+    return ydl_opts
+
+
+def get_profile_options(service_name, download_type, quality):
+    """Возвращает копию скомпилированного профиля, которую можно изменять"""
+    return copy.deepcopy(_compile_profile(service_name, download_type, quality, get_profile().version))
+
+
+class PooledYoutubeDL:
+    """Экземпляр YoutubeDL, переиспользуемый между задачами одного воркера.
+
+    Экстракторы, cookie jar и HTTP-обработчики создаются один раз,
+    для каждой задачи подменяются только папка вывода, User-Agent и
+    получатель событий прогресса.
+    """
+
+    def __init__(self, options, key=None):
+        self.key = key
+        options = copy.deepcopy(options)
+        options['progress_hooks'] = [self._dispatch_progress]
+        options['logger'] = ytdlp_logger
+        self.ydl = yt_dlp.YoutubeDL(options)
+        self.jobs_served = 0
+        self._progress_target = None
+
+    def prepare_job(self, output_path, user_agent, progress_hook):
+        """Подменяет поля, зависящие от конкретной задачи"""
+        self.ydl.params['paths'] = {'home': output_path}
+        self.ydl.params['http_headers']['User-Agent'] = user_agent
+        self._progress_target = progress_hook
+
+    def finish_job(self):
+        """Отвязывает экземпляр от завершенной задачи"""
+        self._progress_target = None
+        self.jobs_served += 1
+
+    def _dispatch_progress(self, d):
+        if self._progress_target:
+            self._progress_target(d)
+
+    def close(self):
+        try:
+            self.ydl.close()
+        except Exception as e:
+            logger.debug("Ошибка при закрытии YoutubeDL: %s", e)
+
+
+class YoutubeDLPool:
+    """Пул «теплых» экземпляров YoutubeDL одного воркера с вытеснением LRU"""
+
+    def __init__(self, max_size=4):
+        self.max_size = max_size
+        self._instances = OrderedDict()
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, service_name, download_type, quality):
+        """Возвращает экземпляр для профиля, создавая его при необходимости"""
+        # Версия в ключе: после перезагрузки профиля старые экземпляры вытесняются по LRU
+        key = (service_name, download_type, quality, get_profile().version)
+        instance = self._instances.get(key)
+        if instance is not None:
+            self._instances.move_to_end(key)
+            self.reused += 1
+            return instance
+
+        instance = PooledYoutubeDL(_compile_profile(*key), key=key)
+        self._instances[key] = instance
+        self.created += 1
+
+        while len(self._instances) > self.max_size:
+            _, evicted = self._instances.popitem(last=False)
+            evicted.close()
+
+        return instance
+
+    def discard(self, instance):
+        """Удаляет экземпляр из пула (например, после ошибки загрузки)"""
+        if self._instances.get(instance.key) is instance:
+            del self._instances[instance.key]
+        instance.close()
+
+    def close(self):
+        """Закрывает все экземпляры пула"""
+        while self._instances:
+            _, instance = self._instances.popitem()
+            instance.close()